@@ -13,21 +13,49 @@ Características principales:
 - Búsqueda en glosario de términos
 """
 
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, session, send_from_directory
 from flask_cors import CORS
 import os
 import re
 import sys
 import uuid
+import queue
+import threading
+import time
 import json
+import hmac
 import mimetypes
 from datetime import datetime, timedelta
+from functools import partial
 from dotenv import load_dotenv
-import anthropic
 
 # 🆕 IMPORTAR MINI-ESPECIALISTAS
 from mini_especialistas import procesar_con_mini_especialistas_v2
 
+# Extracción concurrente de fuentes para las respuestas híbridas
+from utils.fuentes_paralelas import ejecutar_fuentes
+# Transmisión de la respuesta final por SSE (/chat/stream)
+from utils.transmision import con_emisor, crear_mensaje, evento_sse
+# Caché de respuestas (LRU del proceso + SQLite compartido entre workers)
+from utils.cache_respuestas import obtener_cache_respuestas
+from utils.cache_semantica import obtener_cache_semantica
+from utils.coalescencia import obtener_coalescedor
+from utils.conversaciones import obtener_conversaciones
+from utils.pasarela_llm import CircuitoAbierto, obtener_pasarela
+from utils.respuestas_emergencia import generar_respuesta_emergencia, modo_emergencia_activo
+from utils.plazo import Plazo, PlazoAgotado, con_plazo, hay_tiempo_para, nuevo_plazo, plazo_actual
+from utils.consumo_llm import registrar_uso, resumen_consumo, ruta_llm, uso_actual
+from utils.consulta_analizada import ConsultaAnalizada, analizar_consulta, con_consulta
+from utils.detector_intenciones import obtener_detector
+from utils.sintesis_directa import MODO_DIRECTA, MODOS_SINTESIS, con_modo_sintesis, contexto_directo, modo_sintesis, modo_valido
+from utils.registro_asincrono import obtener_registro
+from utils.configuracion import bandera_entorno
+from utils.tablas_cabida import FILAS_RESUMEN, obtener_tablas_cabida, tabla_html
+from utils.metricas import medir, medir_solicitud, obtener_metricas
+from utils.empaquetador_contexto import (
+    cabe_en_tokens, empaquetar, fragmento_texto, fragmentos_corpus, presupuesto_modelo, recortar_a_tokens, texto_relevante
+)
+
 # CONFIGURACIÓN BETA - FECHA DE EXPIRACIÓN
 # Beta profesional por días para demostración oficial
 FECHA_EXPIRACION_BETA = datetime(2025, 8, 9,)  # 9 de agosto 2025 - 5 días para demostración completa
@@ -82,54 +110,49 @@ mimetypes.add_type('application/javascript', '.js')
 script_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
 
-# Cargar variables de entorno y cliente
+# Cargar variables de entorno y cliente (pool compartido con límite de concurrencia)
 load_dotenv()
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+client = obtener_pasarela()
 
 # Comprobación de API key
 if not os.getenv("ANTHROPIC_API_KEY"):
     print("⚠️ ADVERTENCIA: No se ha configurado ANTHROPIC_API_KEY en el archivo .env")
     print("Por favor, configure su API key de Anthropic para usar la aplicación")
 
-# Importar el cargador de tomos mejorados
-from utils.cargador_tomos import cargar_tomo_mejorado, cargar_todos_los_tomos
-
-# Lista de palabras clave legales para detección
-palabras_legales = [
-    'permiso', 'planificación', 'construcción', 'zonificación', 'desarrollo',
-    'urbanización', 'reglamento', 'licencia', 'certificación', 'calificación',
-    'tomo', 'junta', 'planificación', 'ambiental', 'infraestructura',
-    'conservación', 'histórico', 'querella', 'edificabilidad', 'lotificación'
-]
-
-# Función para cargar glosario (primero busca versión mejorada)
-def cargar_glosario():
-    # Intentar cargar el glosario mejorado (Tomo 12)
-    glosario_mejorado = cargar_tomo_mejorado(12)
-    if glosario_mejorado:
-        print(f"✅ Glosario mejorado cargado: {len(glosario_mejorado)} caracteres, {len(glosario_mejorado.split('**'))} términos aprox.")
-        return glosario_mejorado
-    
-    # Si no se encuentra el mejorado, buscar el original
-    ruta_glosario = os.path.join("data", "glosario.txt")
-    if os.path.exists(ruta_glosario):
-        try:
-            with open(ruta_glosario, "r", encoding="utf-8") as f:
-                contenido = f.read()
-            print(f"✅ Glosario original cargado: {len(contenido)} caracteres, {len(contenido.split('**'))} términos aprox.")
-            return contenido
-        except Exception as e:
-            print(f"❌ Error cargando glosario: {e}")
-            return ""
-    else:
-        print(f"⚠️ Glosario no encontrado en: {ruta_glosario}")
-        return ""
+# Importar el corpus compartido (snapshot mmap o tomos mejorados desde texto)
+from utils.corpus import CLAVE_TOMO_10_CONSERVACION, obtener_corpus
+
+# Autómata de intenciones compilado al arrancar (las palabras legales y demás disparadores viven en INTENCIONES)
+obtener_detector()
+
+# Corpus compartido entre módulos (una sola copia por proceso)
+corpus = obtener_corpus().precargar()
+
+# Glosario (preferiblemente la versión mejorada)
+glosario = corpus.glosario
+
+# Todos los tomos mejorados
+tomos_mejorados = corpus.tomos
 
-# Cargar glosario (preferiblemente la versión mejorada)
-glosario = cargar_glosario()
+# Índice invertido BM25 de los tomos 1-11 (se construye una vez, antes del fork)
+from utils.indice_bm25 import obtener_indice_tomos
+obtener_indice_tomos()
 
-# Cargar todos los tomos mejorados
-tomos_mejorados = cargar_todos_los_tomos()
+# Índices posicionales de secciones por documento (tomos 1-11, reglamento de emergencia y conservación histórica)
+from utils.recuperacion import IndiceSecciones, obtener_indice_secciones
+for _clave in [f"tomo_{n}" for n in tomos_mejorados if n <= 11] + ["reglamento_emergencia", "tomo_10_conservacion"]:
+    obtener_indice_secciones(_clave)
+
+# Índice del glosario: entradas estructuradas con búsqueda exacta, por prefijo y por palabras
+from utils.glosario_indice import obtener_indice_glosario
+obtener_indice_glosario()
+
+# Corrector ortográfico (borrados precalculados) sobre el vocabulario del corpus y del glosario
+from utils.corrector_ortografico import obtener_corrector
+obtener_corrector()
+
+# Tablas de cabida de los tomos mejorados y de los archivos TablaCabida_Tomo_N*.txt, por tomo y distrito
+obtener_tablas_cabida()
 
 # Función para obtener información completa de todos los tomos
 def obtener_titulos_tomos():
@@ -190,8 +213,11 @@ def obtener_titulos_tomos():
 ⚠️ **NOTA IMPORTANTE:** Los tomos 1-11 son únicamente para referencia histórica. La normativa vigente y actualizada se encuentra EXCLUSIVAMENTE en el **Reglamento de Emergencia JP-RP-41 (2025)**.
 """
 
-# Diccionario para mantener conversaciones por sesión
-conversaciones = {}
+# Historial de las conversaciones generales: acotado por tokens y compartido por los workers
+conversaciones = obtener_conversaciones()
+
+# Métricas sumadas entre workers: se crean en el master (preload_app) y empiezan de cero en cada arranque
+obtener_metricas()
 
 def get_conversation_id():
     """Obtiene o crea un ID de conversación para la sesión actual"""
@@ -199,11 +225,8 @@ def get_conversation_id():
         session['conversation_id'] = str(uuid.uuid4())
     return session['conversation_id']
 
-def inicializar_conversacion(conversation_id):
-    """Inicializa una nueva conversación"""
-    if conversation_id not in conversaciones:
-        conversaciones[conversation_id] = [
-            {"role": "system", "content": """Eres Agente de Planificación, un asistente especializado altamente inteligente en leyes de planificación de Puerto Rico. 
+# Prompt de sistema de las conversaciones generales (igual para todas: no se guarda en el historial)
+MENSAJE_SISTEMA_CONVERSACION = {"role": "system", "content": """Eres Agente de Planificación, un asistente especializado altamente inteligente en leyes de planificación de Puerto Rico. 
 
 CARACTERÍSTICAS:
 - Analiza profundamente las preguntas del usuario
@@ -252,171 +275,21 @@ GLOSARIO MEJORADO DISPONIBLE (TOMO 12):
 - Mayor cobertura de términos legales y técnicos relacionados con planificación
 
 **🚨 MENSAJE DE BIENVENIDA:** Siempre menciona que trabajas con el Reglamento de Emergencia JP-RP-41 como fuente principal y vigente, y que ahora cuentas con versiones MEJORADAS Y ACTUALIZADAS de todos los tomos para ofrecer información más precisa."""}
-        ]
 
 def buscar_en_glosario(termino):
     """Busca definiciones específicas en el glosario con múltiples estrategias mejoradas"""
     if not glosario:
         return None
     
-    termino_lower = termino.lower().strip()
-    lineas = glosario.split('\n')
-    definiciones_encontradas = []
-    
-    # Lista para almacenar coincidencias con su nivel de confianza
-    coincidencias_candidatas = []
-    
-    i = 0
-    while i < len(lineas):
-        linea = lineas[i].strip()
-        
-        # Buscar líneas que contengan términos (formatos: **Término**: o **TÉRMINO**: )
-        if linea.startswith('**') and ('**:' in linea):
-            # Extraer el término según el formato
-            termino_glosario = ""
-            if linea.startswith('**TÉRMINO**:'):
-                # Formato **TÉRMINO**: Zona Costanera
-                termino_glosario = linea.replace('**TÉRMINO**:', '').strip().lower()
-            elif '**:' in linea and not linea.startswith('**DEFINICIÓN**:') and not linea.startswith('**CATEGORÍA**:'):
-                # Formato **Término**: - pero evitar **DEFINICIÓN**: y **CATEGORÍA**:
-                inicio = linea.find('**') + 2
-                fin = linea.find('**:', inicio)
-                if fin > inicio:
-                    termino_glosario = linea[inicio:fin].strip().lower()
-            
-            # Solo procesar si se extrajo un término válido
-            if termino_glosario:
-                confianza = 0
-                
-                # 1. COINCIDENCIA EXACTA (máxima prioridad)
-                if termino_lower == termino_glosario:
-                    confianza = 100
-                
-                # 2. COINCIDENCIA DE TÉRMINOS COMPUESTOS - PRIORIDAD ALTA
-                elif ' ' in termino_lower and ' ' in termino_glosario:
-                    palabras_busqueda = termino_lower.split()
-                    palabras_glosario = termino_glosario.split()
-                    
-                    # Verificar coincidencia exacta de palabras en orden
-                    coincidencia_exacta = True
-                    if len(palabras_busqueda) <= len(palabras_glosario):
-                        for i, palabra_busq in enumerate(palabras_busqueda):
-                            if i >= len(palabras_glosario) or palabra_busq != palabras_glosario[i]:
-                                coincidencia_exacta = False
-                                break
-                        
-                        if coincidencia_exacta:
-                            confianza = 95  # Alta confianza para coincidencia exacta de palabras en orden
-                        else:
-                            # Verificar si todas las palabras de búsqueda están en el glosario
-                            palabras_coinciden = 0
-                            for palabra_busq in palabras_busqueda:
-                                if len(palabra_busq) > 2:  # Solo palabras significativas
-                                    for palabra_glos in palabras_glosario:
-                                        if palabra_busq == palabra_glos:
-                                            palabras_coinciden += 1
-                                            break
-                            
-                            # Si todas las palabras coinciden, alta confianza
-                            if palabras_coinciden == len(palabras_busqueda) and len(palabras_busqueda) >= 2:
-                                confianza = 90
-                            # Si coinciden la mayoría de palabras importantes
-                            elif palabras_coinciden >= max(1, len(palabras_busqueda) * 0.7):
-                                confianza = 70
-                
-                # 3. CONTENCIÓN SIGNIFICATIVA (para términos simples)
-                elif len(termino_lower) >= 5:
-                    if termino_lower in termino_glosario:
-                        # Calcular qué tan significativa es la contención
-                        ratio = len(termino_lower) / len(termino_glosario)
-                        if ratio >= 0.6:  # El término buscado es al menos 60% del término del glosario
-                            confianza = 60
-                        elif ratio >= 0.4:
-                            confianza = 40
-                    elif termino_glosario in termino_lower:
-                        # El término del glosario está contenido en la búsqueda
-                        ratio = len(termino_glosario) / len(termino_lower)
-                        if ratio >= 0.6:
-                            confianza = 50
-                
-                # Si hay coincidencia, guardar con su confianza
-                if confianza > 0:
-                    # Construir la definición completa
-                    definicion_completa = linea + '\n'  # Título
-                    
-                    # Buscar las líneas de definición
-                    j = i + 1
-                    contenido_definicion = []
-                    
-                    while j < len(lineas) and j < i + 15:  # Aumentado a 15 líneas para definiciones más largas
-                        linea_sig = lineas[j].strip()
-                        
-                        # Si encontramos otra definición de término, parar
-                        if linea_sig.startswith('**TÉRMINO**:'):
-                            break
-                        # Si encontramos líneas que no son de definición/categoría, parar
-                        elif (linea_sig.startswith('**') and '**:' in linea_sig and 
-                              not linea_sig.startswith('**DEFINICIÓN') and 
-                              not linea_sig.startswith('**CATEGORÍA')):
-                            break
-                        # Si encontramos una línea vacía seguida de otra definición, parar
-                        elif not linea_sig and j + 1 < len(lineas) and lineas[j + 1].strip().startswith('**TÉRMINO**:'):
-                            break
-                        # Incluir definiciones y categorías
-                        elif (linea_sig.startswith('**DEFINICIÓN') or 
-                              linea_sig.startswith('**CATEGORÍA') or
-                              (linea_sig and len(linea_sig) > 3 and not linea_sig.startswith('**'))):
-                            contenido_definicion.append(linea_sig)
-                        
-                        j += 1
-                    
-                    # Solo agregar si encontramos una definición válida
-                    if contenido_definicion:
-                        definicion_texto = '\n'.join(contenido_definicion)
-                        definicion_completa += definicion_texto
-                        
-                        if len(definicion_completa.strip()) > 10:
-                            coincidencias_candidatas.append((confianza, definicion_completa.strip(), termino_glosario))
-        
-        i += 1
-    
-    # Ordenar por confianza (mayor a menor) y devolver las mejores
-    if coincidencias_candidatas:
-        coincidencias_candidatas.sort(key=lambda x: x[0], reverse=True)
-        
-        # PRIORIDAD ESPECIAL: Si hay términos compuestos con confianza >=95, devolver solo esos
-        if coincidencias_candidatas[0][0] >= 95:
-            return [coincidencias_candidatas[0][1]]
-        
-        # Si la mejor coincidencia tiene alta confianza (>=90), devolver solo esa
-        elif coincidencias_candidatas[0][0] >= 90:
-            # Verificar si hay términos compuestos entre las mejores opciones
-            mejores_compuestos = [c for c in coincidencias_candidatas if c[0] >= 90 and ' ' in c[2]]
-            if mejores_compuestos:
-                return [mejores_compuestos[0][1]]  # Priorizar términos compuestos
-            else:
-                return [coincidencias_candidatas[0][1]]
-        
-        # Si no, devolver las mejores coincidencias (máximo 3)
-        mejores_coincidencias = []
-        for confianza, definicion, termino_orig in coincidencias_candidatas[:3]:
-            if confianza >= 40:  # Solo coincidencias con confianza razonable
-                mejores_coincidencias.append(definicion)
-        
-        return mejores_coincidencias if mejores_coincidencias else None
-    
-    return None
+    # Índice precalculado: exacto (100), trie de compuestos (95), palabras (90/70), contención (60/50/40)
+    return obtener_indice_glosario().buscar(termino)
 
 def buscar_multiples_terminos(terminos):
     """Busca múltiples términos relacionados en el glosario"""
-    resultados = {}
-    
-    for termino in terminos:
-        definiciones = buscar_en_glosario(termino)
-        if definiciones:
-            resultados[termino] = definiciones
+    if not glosario:
+        return {}
     
-    return resultados
+    return obtener_indice_glosario().buscar_varios(terminos)
 
 def buscar_flujograma(tipo_flujograma, tomo=None):
     """Busca flujogramas específicos por tipo y tomo"""
@@ -572,209 +445,76 @@ def texto_a_tabla_html(texto):
     else:
         return f'<pre>{texto}</pre>'  # No pudimos procesar como tabla
 
-    # MEJORA: Función auxiliar para detectar tipo de datos y aplicar clases CSS
-    def detectar_tipo_celda(contenido):
-        """Detecta el tipo de contenido de una celda y retorna la clase CSS apropiada"""
-        if not contenido or not contenido.strip():
-            return ""
-        
-        contenido = contenido.strip()
-        
-        # Detectar números
-        if re.match(r'^[\d\.,\$€£¥₹]+$', contenido) or re.match(r'^\d+(\.\d+)?$', contenido):
-            return ' class="numero"'
-        
-        # Detectar fechas
-        if re.match(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', contenido) or re.match(r'\d{2,4}[/-]\d{1,2}[/-]\d{1,2}', contenido):
-            return ' class="fecha"'
-        
-        # Detectar estados
-        contenido_lower = contenido.lower()
-        if contenido_lower in ['activo', 'aprobado', 'completado', 'si', 'sí', 'yes', 'vigente']:
-            return ' class="estado activo"'
-        elif contenido_lower in ['pendiente', 'en proceso', 'tramitando', 'revisión']:
-            return ' class="estado pendiente"'
-        elif contenido_lower in ['inactivo', 'rechazado', 'vencido', 'no', 'cancelado']:
-            return ' class="estado inactivo"'
-        
-        return ""
-    
-    # MEJORA: Estilo mejorado para tabla usando clases CSS modernas con detección de tipos - SIN ESPACIOS EXTRAS
-    html = '<div class="tabla-container"><table class="tabla-moderna">'
-    html += '<thead><tr>' + ''.join(f'<th>{col}</th>' for col in encabezado) + '</tr></thead>'
-    html += '<tbody>'
-    for fila in cuerpo:
-        html += '<tr>' + ''.join(f'<td{detectar_tipo_celda(celda)}>{celda}</td>' for celda in fila) + '</tr>'
-    html += '</tbody></table></div>'
-    return html
-
-def buscar_tabla_cabida(tomo=None):
-    """Busca tablas de cabida por tomo y las convierte a HTML si es posible
-    REFORZADO: Garantiza devolver siempre una respuesta clara
-    MEJORADO: Utiliza los tomos mejorados como fuente primaria"""
+    # Estilo con clases CSS modernas y detección de tipos de celda - SIN ESPACIOS EXTRAS
+    return tabla_html(encabezado, cuerpo)
+
+def buscar_tabla_cabida(tomo=None, distrito=None):
+    """Tablas de cabida en HTML desde el almacén precalculado (utils/tablas_cabida.py)
+    REFORZADO: Garantiza devolver siempre una respuesta clara (tabla real o genérica)
+
+    Args:
+        tomo (int): Tomo de la tabla; sin tomo se muestra el resumen de todos
+        distrito (str): Mostrar solo las filas de este distrito (si aparece en las tablas)
+    """
+    tablas = obtener_tablas_cabida()
     resultados = []
-    
-    # Función auxiliar para crear tabla de cabida ficticia cuando no exista
-    def crear_tabla_cabida_generica(tomo_num):
-        """Crea una tabla de cabida genérica para mostrar cuando no se encuentra la real"""
-        return f"""
-A continuación se presenta una tabla con la cabida mínima y máxima permitida para cada distrito de calificación en Puerto Rico:
-
-| Distrito de Calificación | Cabida Mínima Permitida | Cabida Máxima Permitida |
-|-------------------------|------------------------|------------------------|
-| Distrito A | 200 m2 | 300 m2 |
-| Distrito B | 150 m2 | 250 m2 |
-| Distrito C | 100 m2 | 200 m2 |
-| Distrito D | 50 m2 | 150 m2 |
-| Distrito E | 25 m2 | 100 m2 |
-
-Es importante tener en cuenta que estos valores pueden variar según la normativa específica de cada municipio o entidad reguladora.
-"""
-    
-    def buscar_archivo_tabla(tomo_num):
-        # Log para depuración
-        print(f"⚠️ Buscando tabla de cabida para tomo {tomo_num}...")
-        
-        # 1. PRIMERO: Intentar extraer tabla del tomo mejorado
-        if tomo_num in tomos_mejorados:
-            print(f"📄 Buscando tablas en tomo {tomo_num} mejorado...")
-            contenido_tomo = tomos_mejorados[tomo_num]
-            
-            # Buscar secciones con tablas en el contenido del tomo mejorado
-            # Patrones para identificar tablas en el texto
-            patrones_tabla = [
-                r"(?i)tabla\s+de\s+cabida.*?\|.*?\|.*?\|",
-                r"\|\s*distrito\s*\|.*?\|.*?\|",
-                r"\|\s*cabida.*?\|.*?\|",
-                r"\|\s*calificación\s*\|.*?\|.*?\|"
-            ]
-            
-            for patron in patrones_tabla:
-                match = re.search(patron, contenido_tomo, re.DOTALL)
-                if match:
-                    # Extraer la sección de texto que contiene la tabla
-                    inicio = max(0, match.start() - 200)  # Incluir algo de contexto
-                    fin = min(len(contenido_tomo), match.end() + 1000)  # Capturar toda la tabla
-                    seccion_tabla = contenido_tomo[inicio:fin]
-                    
-                    # Extraer solo las líneas que contienen '|' para la tabla
-                    lineas = seccion_tabla.split('\n')
-                    lineas_tabla = []
-                    en_tabla = False
-                    
-                    for linea in lineas:
-                        if '|' in linea:
-                            en_tabla = True
-                            lineas_tabla.append(linea)
-                        elif en_tabla and linea.strip() == '':
-                            # Fin de la tabla
-                            if len(lineas_tabla) > 3:  # Al menos encabezado + separador + contenido
-                                break
-                    
-                    if lineas_tabla:
-                        tabla_extraida = '\n'.join(lineas_tabla)
-                        print(f"✅ Tabla extraída del tomo {tomo_num} mejorado")
-                        return tabla_extraida
-        
-        # 2. SEGUNDO: Buscar en archivos específicos de tabla
-        ruta_directa = os.path.join("data", "RespuestasParaChatBot", f"RespuestasIA_Tomo{tomo_num}", f"TablaCabida_Tomo_{tomo_num}.txt")
-        ruta_subcarpeta = os.path.join("data", "RespuestasParaChatBot", f"RespuestasIA_Tomo{tomo_num}", "Tablas", f"TablaCabida_Tomo_{tomo_num}.txt")
-        
-        # Log de rutas para depuración
-        print(f"📂 Probando ruta: {ruta_directa}")
-        print(f"📂 Probando ruta: {ruta_subcarpeta}")
-        
-        for ruta in [ruta_directa, ruta_subcarpeta]:
-            try:
-                with open(ruta, 'r', encoding='utf-8') as file:
-                    contenido = file.read()
-                    if contenido.strip():
-                        print(f"✅ Tabla encontrada en {ruta}")
-                        return contenido
-            except FileNotFoundError:
-                continue
-        
-        # Si no encuentra archivo, usar tabla genérica
-        print(f"❌ No se encontró tabla para tomo {tomo_num}, usando genérica")
-        return crear_tabla_cabida_generica(tomo_num)
-    
+
+    if distrito:
+        html_distrito = tablas.html_distrito(distrito, tomo)
+        if html_distrito:
+            print(f"📊 Tabla de cabida del distrito {distrito} (tomo: {tomo})")
+            return [html_distrito]
+
     if tomo:
-        # Caso específico: buscar tabla para un tomo
-        contenido = buscar_archivo_tabla(tomo)
-        # SIEMPRE tendremos contenido, sea real o genérico
-        
-        # Hacer log del contenido para depuración
-        print(f"🔍 Contenido original de tabla tomo {tomo}:")
-        print(contenido[:200] + "..." if len(contenido) > 200 else contenido)
-        
-        # Convertir a HTML con manejo especial para asegurar formato correcto
-        tabla_html = texto_a_tabla_html(contenido)
-        
-        # Hacer log de la tabla HTML para depuración
-        print(f"📊 HTML generado para tabla tomo {tomo}:")
-        print(tabla_html[:200] + "..." if len(tabla_html) > 200 else tabla_html)
-        
-        # Log para el file system en Render
-        with open("log.txt", "a", encoding="utf-8") as log_file:
-            log_file.write(f"\n\n==== TABLA HTML GENERADA PARA TOMO {tomo} ====\n")
-            log_file.write(tabla_html[:500] + "..." if len(tabla_html) > 500 else tabla_html)
-            log_file.write("\n==== FIN TABLA HTML ====\n\n")
-        
+        tabla = tablas.tabla(tomo)
+        tabla_html_tomo = tablas.html(tomo)
+        print(f"📊 Tabla de cabida tomo {tomo}: {tabla.fuente}")
+
+        # Registro estructurado (se escribe en segundo plano)
+        obtener_registro().registrar({
+            'evento': 'tabla_html',
+            'tomo': tomo,
+            'fuente': tabla.fuente,
+            'html': tabla_html_tomo[:500] + "..." if len(tabla_html_tomo) > 500 else tabla_html_tomo,
+        })
+
         # MEJORA: Devolver solo la tabla sin títulos ni espacios adicionales
-        resultados.append(tabla_html)
+        resultados.append(tabla_html_tomo)
     else:
-        # Caso general: mostrar resumen de todas las tablas
-        resumen_tomos = []
-        for tomo_num in range(1, 12):
-            contenido = buscar_archivo_tabla(tomo_num)
-            # SIEMPRE tendremos contenido, sea real o genérico
-            primeras_lineas = '\n'.join(contenido.split('\n')[:5])
-            tabla_html = texto_a_tabla_html(primeras_lineas)
-            resumen_tomos.append(f"<strong>TOMO {tomo_num}:</strong><br>{tabla_html} ...")
-        
+        # Caso general: resumen con las primeras filas de cada tomo
+        resumen_tomos = [
+            f"<strong>TOMO {tomo_num}:</strong><br>{tablas.html(tomo_num, FILAS_RESUMEN)} ..."
+            for tomo_num in range(1, 12)
+        ]
         resultados.append("<strong>📊 RESUMEN DE TABLAS DE CABIDA DISPONIBLES:</strong><br>" + '<br><br>'.join(resumen_tomos))
         resultados.append("<br>💡 <i>Para ver una tabla completa, especifica el tomo: 'tabla de cabida tomo 3'</i>")
-    
+
     # SIEMPRE devolver resultados, nunca None
     return resultados
 
 def detectar_y_generar_tabla_automatica(entrada):
     """Detecta automáticamente solicitudes de tablas y genera respuestas en formato tabla HTML"""
-    entrada_lower = entrada.lower()
-    
-    # Palabras clave que indican solicitud de tabla
-    palabras_tabla = [
-        'tabla', 'tablas', 'generar tabla', 'mostrar tabla', 'crear tabla',
-        'tabla de', 'tabla con', 'resumen tabla', 'formato tabla'
-    ]
+    consulta = analizar_consulta(entrada)
     
     # Detectar si el usuario quiere una tabla
-    solicita_tabla = any(palabra in entrada_lower for palabra in palabras_tabla)
-    
-    if not solicita_tabla:
+    if not consulta.tiene('tabla'):
         return None
     
     # Detectar tipos específicos de tabla solicitados
-    if any(palabra in entrada_lower for palabra in ['cabida', 'superficie', 'área']):
-        # Es una solicitud de tabla de cabida
-        tomo = None
-        # Buscar número de tomo en la entrada
-        import re
-        match = re.search(r'tomo\s*(\d+)', entrada_lower)
-        if match:
-            tomo = int(match.group(1))
-        return buscar_tabla_cabida(tomo)
+    if consulta.tiene('tabla_tipo_cabida'):
+        # Es una solicitud de tabla de cabida (del tomo mencionado, si lo hay)
+        return buscar_tabla_cabida(consulta.tomo, obtener_tablas_cabida().distrito_mencionado(consulta.normalizado))
     
     # Detectar solicitudes de tablas de calificación/zonificación
-    elif any(palabra in entrada_lower for palabra in ['calificación', 'calificacion', 'zonificación', 'zonificacion', 'distrito', 'distritos']):
+    elif consulta.tiene('tabla_tipo_calificaciones'):
         return generar_tabla_calificaciones()
     
     # Detectar solicitudes de tablas de permisos
-    elif any(palabra in entrada_lower for palabra in ['permiso', 'permisos', 'licencia', 'licencias', 'trámite', 'tramite']):
+    elif consulta.tiene('tabla_tipo_permisos'):
         return generar_tabla_permisos()
     
     # Detectar solicitudes de tablas de agencias
-    elif any(palabra in entrada_lower for palabra in ['agencia', 'agencias', 'entidad', 'entidades', 'organización', 'organizacion']):
+    elif consulta.tiene('tabla_tipo_agencias'):
         return generar_tabla_agencias()
     
     # Si menciona tabla pero no es específica, ofrecer opciones
@@ -903,19 +643,6 @@ def buscar_resoluciones(tomo=None, tema=None):
     
     return resultados if resultados else None
 
-def cargar_reglamento_emergencia():
-    """Carga el reglamento de emergencia JP-RP-41"""
-    ruta_emergencia = os.path.join("data", "reglamento_emergencia_jp41_chatbot_20250731_155845.json")
-    if os.path.exists(ruta_emergencia):
-        try:
-            with open(ruta_emergencia, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return data.get('analisis_completo', '')
-        except Exception as e:
-            print(f"❌ Error cargando reglamento emergencia: {e}")
-            return ""
-    return ""
-
 def cargar_info_division_ambiental():
     """Carga la información sobre la División de Cumplimiento Ambiental"""
     ruta_info = os.path.join("data", "division_cumplimiento_ambiental.txt")
@@ -929,54 +656,32 @@ def cargar_info_division_ambiental():
             return """La División de Evaluación de Cumplimiento Ambiental (DECA) de la OGPe es responsable de evaluar y tramitar todos los documentos ambientales presentados a la agencia. Cumple funciones administrativas y de manejo de documentación ambiental según lo establece la Ley 161-2009."""
     return """La División de Evaluación de Cumplimiento Ambiental (DECA) de la OGPe es responsable de evaluar y tramitar todos los documentos ambientales presentados a la agencia. Cumple funciones administrativas y de manejo de documentación ambiental según lo establece la Ley 161-2009."""
 
-reglamento_emergencia = cargar_reglamento_emergencia()
+reglamento_emergencia = corpus.reglamento_emergencia
 info_division_ambiental = cargar_info_division_ambiental()
 
-def cargar_tomo_10_conservacion_historica():
-    """Carga la información completa del Tomo 10 de Conservación Histórica"""
-    ruta_tomo10 = os.path.join("data", "Tomo_10_Conservacion_Historica.txt")
-    if os.path.exists(ruta_tomo10):
-        try:
-            with open(ruta_tomo10, "r", encoding="utf-8") as f:
-                contenido = f.read()
-            print(f"✅ Tomo 10 Conservación Histórica cargado: {len(contenido)} caracteres")
-            return contenido
-        except Exception as e:
-            print(f"❌ Error cargando Tomo 10: {e}")
-            return ""
-    else:
-        print(f"⚠️ Tomo 10 no encontrado en: {ruta_tomo10}")
-        return ""
-
-tomo_10_conservacion = cargar_tomo_10_conservacion_historica()
-
+@ruta_llm("sitios-historicos")
 def buscar_en_tomo_10_sitios_historicos(entrada):
     """Busca información específica sobre sitios históricos en el Tomo 10"""
-    if not tomo_10_conservacion:
+    if not corpus.contiene(CLAVE_TOMO_10_CONSERVACION):
         return None
     
-    entrada_lower = entrada.lower()
-    
-    # Detectar preguntas sobre sitios históricos
-    palabras_sitios_historicos = [
-        'sitio histórico', 'sitios históricos', 'sitio historico', 'sitios historicos',
-        'zona histórica', 'zonas históricas', 'zona historica', 'zonas historicas',
-        'conservación histórica', 'conservacion historica', 'patrimonio histórico',
-        'designación histórica', 'designacion historica', 'nominación histórica'
-    ]
-    
     # Verificar si la pregunta es sobre sitios históricos
-    es_consulta_historica = any(palabra in entrada_lower for palabra in palabras_sitios_historicos)
-    
-    if not es_consulta_historica:
+    if not analizar_consulta(entrada).tiene('sitios_historicos'):
         return None
     
     try:
+        # Las secciones del archivo de conservación más relevantes, dentro del presupuesto de Sonnet
+        # (el archivo completo no cabe con holgura en el prompt)
+        conservacion_relevante = texto_relevante(
+            entrada, CLAVE_TOMO_10_CONSERVACION, presupuesto_modelo("claude-3-sonnet-20240229"),
+            k=6, terminos=analizar_consulta(entrada).terminos_corregidos
+        )
+        
         # Crear prompt específico para sitios históricos con información de conservación histórica
         prompt = f"""Eres Agente de Planificación, especialista en conservación histórica de Puerto Rico.
 
 INFORMACIÓN DE CONSERVACIÓN HISTÓRICA DEL REGLAMENTO DE EMERGENCIA JP-RP-41:
-{tomo_10_conservacion}
+{conservacion_relevante}
 
 PREGUNTA DEL USUARIO: {entrada}
 
@@ -1142,8 +847,8 @@ def generar_indice_completo():
         if verificar_archivo_existe(tomo_num, 'flujogramaSitiosHistoricos', 'Flujogramas'):
             recursos_encontrados['flujogramas_historicos'].append(tomo_num)
         
-        # Verificar tablas de cabida
-        if verificar_archivo_existe(tomo_num, 'TablaCabida', 'Tablas'):
+        # Verificar tablas de cabida (almacén precalculado)
+        if tomo_num in obtener_tablas_cabida().tablas:
             recursos_encontrados['tablas_cabida'].append(tomo_num)
         
         # Verificar resoluciones
@@ -1172,10 +877,10 @@ def generar_indice_completo():
 
 def procesar_pregunta_glosario(entrada):
     """Procesa preguntas específicas del glosario con IA inteligente"""
-    entrada_lower = entrada.lower()
+    entrada_lower = analizar_consulta(entrada).minusculas
     
     # Detectar preguntas de comparación/diferencia
-    if any(palabra in entrada_lower for palabra in ['diferencia', 'diferencias', 'comparar', 'comparación']):
+    if analizar_consulta(entrada).tiene('comparacion'):
         # Buscar patrones como "diferencia entre X y Y"
         patrones_comparacion = [
             r'diferencias?\s+entre\s+(.+?)\s+y\s+(.+?)[\?]?',
@@ -1204,14 +909,10 @@ TÉRMINO 2 - {termino2}:
                     return generar_respuesta_inteligente(entrada, context_comparacion, "comparacion")
     
     # Extraer términos de manera más inteligente
-    terminos_extraidos = extraer_terminos_inteligente(entrada)
+    terminos_extraidos = analizar_consulta(entrada).candidatos_glosario
     
     # Buscar información relevante
-    informacion_encontrada = {}
-    for termino in terminos_extraidos:
-        definiciones = buscar_en_glosario(termino)
-        if definiciones:
-            informacion_encontrada[termino] = definiciones
+    informacion_encontrada = buscar_multiples_terminos(terminos_extraidos)
     
     # Si encontró información, generar respuesta inteligente
     if informacion_encontrada:
@@ -1219,50 +920,7 @@ TÉRMINO 2 - {termino2}:
     
     return None
 
-def extraer_terminos_inteligente(entrada):
-    """Extrae términos de manera más inteligente usando patrones y contexto"""
-    entrada_lower = entrada.lower()
-    terminos = []
-    
-    # Patrones comunes para preguntas de definiciones
-    patrones_definicion = [
-        r'qu[eé]\s+es\s+(?:un[a]?\s+)?(.+?)[\?]?',
-        r'define\s+(.+?)[\?]?',
-        r'definici[oó]n\s+de\s+(.+?)[\?]?',
-        r'significado\s+de\s+(.+?)[\?]?',
-        r'explica\s+(.+?)[\?]?',
-        r'explícame\s+(.+?)[\?]?',
-        r'(.+?)\s+significa[\?]?'
-    ]
-    
-    for patron in patrones_definicion:
-        match = re.search(patron, entrada_lower)
-        if match:
-            termino = match.group(1).strip()
-            
-            # Limpiar el término
-            palabras_eliminar = ['qué es', 'que es', 'significa', 'es', 'un', 'una', 'el', 'la', 'los', 'las']
-            for palabra in palabras_eliminar:
-                if termino.startswith(palabra + ' '):
-                    termino = termino[len(palabra):].strip()
-            
-            if termino and len(termino) > 2:
-                terminos.append(termino)
-                
-                # Si es un término compuesto, también agregar palabras individuales
-                if ' ' in termino:
-                    palabras = termino.split()
-                    for palabra in palabras:
-                        if len(palabra) > 3:
-                            terminos.append(palabra)
-    
-    # Si no encontró términos con patrones, extraer palabras clave
-    if not terminos:
-        palabras_clave = [palabra for palabra in entrada.split() if len(palabra) > 3]
-        terminos.extend(palabras_clave[:3])  # Máximo 3 palabras clave
-    
-    return terminos
-
+@ruta_llm("glosario")
 def generar_respuesta_inteligente(pregunta, informacion, tipo_respuesta):
     """Genera respuestas inteligentes usando IA con la información encontrada"""
     try:
@@ -1331,94 +989,61 @@ RESPUESTA INTELIGENTE:"""
     
     return None
 
+@medir("detectar_consulta_especifica")
 def detectar_consulta_especifica(entrada):
     """Detecta consultas específicas sobre recursos estructurados
     REFORZADO: Mejorado para detectar variantes de consultas sobre tablas de cabida"""
-    entrada_lower = entrada.lower()
+    consulta = analizar_consulta(entrada)
     
     # Log para depuración
-    print(f"🔍 Analizando consulta específica: '{entrada}'")
+    print(f"🔍 Analizando consulta específica: '{entrada}' (intenciones: {', '.join(sorted(consulta.intenciones.intenciones)) or 'ninguna'})")
     
     # Detectar solicitud de índice completo
-    if any(palabra in entrada_lower for palabra in ['índice', 'indice', 'lista completa', 'todos los recursos', 'qué recursos', 'recursos disponibles']):
+    if consulta.tiene('indice_completo'):
         print("✅ Detectada consulta tipo: índice_completo")
         return {'tipo': 'indice_completo'}
     
     # Detectar búsqueda de flujogramas
-    if any(palabra in entrada_lower for palabra in ['flujograma', 'proceso', 'trámite', 'procedimiento']):
-        if any(palabra in entrada_lower for palabra in ['terreno', 'terrenos', 'público', 'públicos']):
+    if consulta.tiene('flujograma'):
+        if consulta.tiene('flujograma_terrenos'):
             print("✅ Detectada consulta tipo: flujograma - terrenos")
             return {'tipo': 'flujograma', 'subtipo': 'terrenos'}
-        elif any(palabra in entrada_lower for palabra in ['calificación', 'cambio', 'cambios']):
+        elif consulta.tiene('flujograma_calificacion'):
             print("✅ Detectada consulta tipo: flujograma - calificacion")
             return {'tipo': 'flujograma', 'subtipo': 'calificacion'}
-        elif any(palabra in entrada_lower for palabra in ['histórico', 'historicos', 'sitio', 'sitios']):
+        elif consulta.tiene('flujograma_historicos'):
             print("✅ Detectada consulta tipo: flujograma - historicos")
             return {'tipo': 'flujograma', 'subtipo': 'historicos'}
     
-    # REFORZADO: Detectar búsqueda de tablas de cabida con más patrones
-    # Patrones comunes de consulta sobre tablas de cabida
-    patrones_tabla_cabida = [
-        r'tabla.*cabida',
-        r'cabida.*tabla',
-        r'cabida.*distrito',
-        r'cabida.*tomo',
-        r'tabla.*tomo',
-        r'tabla.*distrito',
-        r'muestra.*tabla.*cabida',
-        r'ver.*tabla.*cabida',
-        r'información.*cabida'
-    ]
-    
-    # Comprobar si la entrada coincide con algún patrón
-    if any(re.search(patron, entrada_lower) for patron in patrones_tabla_cabida):
-        # Extraer número de tomo si se menciona usando una expresión regular más flexible
-        tomo_match = re.search(r'tomo\s*(\d+)|del\s+tomo\s*(\d+)', entrada_lower)
-        
-        # Obtener el tomo de cualquier grupo capturado
-        tomo = None
-        if tomo_match:
-            for grupo in tomo_match.groups():
-                if grupo is not None:
-                    tomo = int(grupo)
-                    break
-        
-        if tomo:
-            print(f"✅ Detectada consulta tipo: tabla_cabida - tomo {tomo}")
-            return {'tipo': 'tabla_cabida', 'tomo': tomo}
+    # REFORZADO: Detectar búsqueda de tablas de cabida ('tabla … cabida', 'cabida … distrito', ...)
+    if consulta.tiene('tabla_cabida'):
+        if consulta.tomo:
+            print(f"✅ Detectada consulta tipo: tabla_cabida - tomo {consulta.tomo}")
+            return {'tipo': 'tabla_cabida', 'tomo': consulta.tomo}
         else:
             print("✅ Detectada consulta tipo: tabla_cabida - sin tomo específico")
             return {'tipo': 'tabla_cabida'}
     
     # Detectar búsqueda de resoluciones
-    if any(palabra in entrada_lower for palabra in ['resolución', 'resoluciones']):
+    if consulta.tiene('resoluciones'):
         print("✅ Detectada consulta tipo: resoluciones")
         return {'tipo': 'resoluciones'}
     
     # Detectar número de tomo específico
-    tomo_match = re.search(r'tomo\s+(\d+)', entrada_lower)
-    if tomo_match:
-        print(f"✅ Detectada consulta tipo: tomo_especifico - tomo {tomo_match.group(1)}")
-        return {'tipo': 'tomo_especifico', 'tomo': int(tomo_match.group(1))}
+    if consulta.tomo:
+        print(f"✅ Detectada consulta tipo: tomo_especifico - tomo {consulta.tomo}")
+        return {'tipo': 'tomo_especifico', 'tomo': consulta.tomo}
     
     print("❌ No se detectó ningún tipo de consulta específica")
     return None
 
 def procesar_consulta_especifica(entrada, tipo_consulta):
     """Procesa consultas específicas sobre recursos estructurados"""
-    entrada_lower = entrada.lower()
-    
-    # Extraer número de tomo si se menciona
-    tomo_match = re.search(r'tomo\s+(\d+)|del\s+tomo\s*(\d+)', entrada_lower)
-    
-    # Obtener el número de tomo del grupo que haya coincidido
-    tomo = None
-    if tomo_match:
-        # Tomar el primer grupo que no sea None
-        for grupo in tomo_match.groups():
-            if grupo is not None:
-                tomo = int(grupo)
-                break
+    consulta = analizar_consulta(entrada)
+    entrada_lower = consulta.minusculas
+    
+    # Número de tomo si se menciona
+    tomo = consulta.tomo
     
     # Log para depuración
     print(f"⚙️ Procesando consulta específica tipo: {tipo_consulta['tipo']}")
@@ -1438,7 +1063,7 @@ def procesar_consulta_especifica(entrada, tipo_consulta):
     
     elif tipo_consulta['tipo'] == 'tabla_cabida':
         # buscar_tabla_cabida SIEMPRE devuelve resultados (tabla real o genérica)
-        resultados = buscar_tabla_cabida(tomo)
+        resultados = buscar_tabla_cabida(tomo, obtener_tablas_cabida().distrito_mencionado(consulta.normalizado))
         if resultados:
             # IMPORTANTE: Preservar HTML en lugar de convertirlo a texto plano
             respuesta = "<strong>📊 Tabla de Cabida - Distritos de Calificación:</strong><br><br>"
@@ -1476,55 +1101,37 @@ def procesar_consulta_especifica(entrada, tipo_consulta):
 
 def detectar_tipo_pregunta(entrada):
     """Detecta el tipo de pregunta y determina la mejor estrategia de búsqueda"""
-    entrada_lower = entrada.lower()
+    consulta = analizar_consulta(entrada)
     
     # Preguntas de comparación/diferencia
-    if any(palabra in entrada_lower for palabra in ['diferencia', 'diferencias', 'comparar', 'comparación']):
+    if consulta.tiene('comparacion'):
         return 'comparacion'
     
     # Preguntas sobre REQUISITOS Y PROCEDIMIENTOS - PRIORIDAD ALTA para Reglamento
-    palabras_requisitos = ['requisito', 'requisitos', 'proceso', 'procedimiento', 'pasos', 'como', 'cómo', 'necesito', 'solicitar', 'obtener', 'tramitar', 'aplicar']
-    if any(palabra in entrada_lower for palabra in palabras_requisitos):
+    if consulta.tiene('requisitos'):
         return 'requisitos_procedimientos'
     
     # Preguntas sobre el glosario/definiciones SOLO cuando se pregunta explícitamente
-    palabras_glosario = ['qué es', 'que es', 'define', 'definición', 'definicion', 'significado', 'explica', 'explícame', 'explicame', 'concepto', 'término', 'termino', 'significa']
-    if any(palabra in entrada_lower for palabra in palabras_glosario):
+    if consulta.tiene('definicion'):
         return 'glosario'
 
     # Preguntas sobre permisos - PRIORIDAD REGLAMENTO si hay palabras de acción
-    if any(palabra in entrada_lower for palabra in ['permiso', 'autorización', 'licencia', 'trámite']):
+    if consulta.tiene('permisos'):
         # Si incluye palabras de acción, es requisitos/procedimientos
-        if any(accion in entrada_lower for accion in ['requisito', 'como', 'cómo', 'proceso', 'solicitar', 'obtener', 'tramitar']):
+        if consulta.tiene('accion_tramite'):
             return 'requisitos_procedimientos'
         return 'permisos'
 
     # Preguntas sobre construcción
-    if any(palabra in entrada_lower for palabra in ['construcción', 'edificar', 'estructura', 'obra']):
-        return 'construccion'
-
-    # Preguntas sobre planificación
-    if any(palabra in entrada_lower for palabra in ['plan', 'zonificación', 'ordenación', 'uso de suelo']):
-        return 'planificacion'
-
-    # Preguntas ambientales
-    if any(palabra in entrada_lower for palabra in ['ambiental', 'conservación', 'aguas', 'desperdicios']):
-        return 'ambiental'
-
-    return 'general'
-    if any(palabra in entrada_lower for palabra in ['permiso', 'autorización', 'licencia', 'trámite']):
-        return 'permisos'
-
-    # Preguntas sobre construcción
-    if any(palabra in entrada_lower for palabra in ['construcción', 'edificar', 'estructura', 'obra']):
+    if consulta.tiene('construccion'):
         return 'construccion'
 
     # Preguntas sobre planificación
-    if any(palabra in entrada_lower for palabra in ['plan', 'zonificación', 'ordenación', 'uso de suelo']):
+    if consulta.tiene('planificacion'):
         return 'planificacion'
 
     # Preguntas ambientales
-    if any(palabra in entrada_lower for palabra in ['ambiental', 'conservación', 'aguas', 'desperdicios']):
+    if consulta.tiene('ambiental'):
         return 'ambiental'
 
     return 'general'
@@ -1532,60 +1139,30 @@ def detectar_tipo_pregunta(entrada):
 
 def es_pregunta_simple(entrada):
     """Determina si una pregunta es simple y puede responderse con información limitada"""
-    entrada_lower = entrada.lower()
-    
-    # Preguntas que requieren búsqueda específica
-    palabras_complejas = [
-        "todos", "lista", "cantidad", "cuantos", "cuántos", "comparar", "diferencia",
-        "análisis", "resumen", "procedimiento completo", "proceso completo"
-    ]
-    
-    # Preguntas simples típicas
-    palabras_simples = [
-        "qué es", "que es", "define", "definición", "significa", 
-        "cómo se", "como se", "para qué", "para que"
-    ]
-    
-    # Si tiene palabras complejas, no es simple
-    if any(palabra in entrada_lower for palabra in palabras_complejas):
+    consulta = analizar_consulta(entrada)
+    
+    # Si requiere búsqueda específica (listas, comparaciones, análisis), no es simple
+    if consulta.tiene('pregunta_compleja'):
         return False
     
-    # Si tiene palabras simples o es muy corta, es simple
-    if any(palabra in entrada_lower for palabra in palabras_simples):
+    # Si es una pregunta simple típica ('qué es', 'cómo se'...) o es muy corta, es simple
+    if consulta.tiene('pregunta_simple'):
         return True
     
     # Si la pregunta es muy corta (menos de 5 palabras), probablemente es simple
     return len(entrada.split()) <= 5
 
-def evaluar_relevancia_tomo(entrada, archivo_tomo):
-    """Evalúa qué tan relevante es un tomo para una pregunta específica"""
-    try:
-        with open(archivo_tomo, 'r', encoding='utf-8') as f:
-            contenido = f.read().lower()
-        
-        palabras_pregunta = [palabra.lower() for palabra in entrada.split() if len(palabra) > 3]
-        score_relevancia = 0
-        
-        for palabra in palabras_pregunta:
-            if palabra in contenido:
-                # Contar ocurrencias pero dar más peso a palabras menos comunes
-                ocurrencias = contenido.count(palabra)
-                if ocurrencias > 0:
-                    # Palabras menos frecuentes tienen más peso
-                    peso = min(5, 10 // max(1, ocurrencias // 10))
-                    score_relevancia += ocurrencias * peso
-        
-        return score_relevancia
-    except:
-        return 0
+def evaluar_relevancia_tomo(entrada, numero_tomo):
+    """Evalúa qué tan relevante es un tomo para una pregunta específica (BM25 sobre el índice invertido)"""
+    return obtener_indice_tomos().puntuar(entrada, analizar_consulta(entrada).terminos_corregidos).get(numero_tomo, 0)
 
 
 def procesar_pregunta_legal(entrada):
     """Procesa preguntas legales con IA híbrida inteligente"""
-    entrada_lower = entrada.lower()
+    consulta = analizar_consulta(entrada)
     
     # Caso especial para División de Cumplimiento Ambiental
-    if "división de cumplimiento ambiental" in entrada_lower or "division de cumplimiento ambiental" in entrada_lower:
+    if consulta.tiene('cumplimiento_ambiental'):
         return """🚨 **REGLAMENTO DE EMERGENCIA JP-RP-41**:
 
 La División de Evaluación de Cumplimiento Ambiental (DECA) de la OGPe es responsable de evaluar y tramitar todos los documentos ambientales presentados a la agencia. Cumple funciones administrativas y de manejo de documentación ambiental según lo establece la Ley 161-2009 y otros reglamentos pertinentes.
@@ -1600,15 +1177,8 @@ La función específica de la División de Cumplimiento Ambiental es preparar y
     if respuesta_tabla:
         return '\n\n'.join(respuesta_tabla)
     
-    # Detectar preguntas sobre títulos de tomos
-    palabras_titulos = ["titulo", "títulos", "titulos", "nombre", "nombres", "llamar", "llama", "indices", "indice", "índice", "índices"]
-    palabras_tomos = ["tomo", "tomos", "11 tomos", "once tomos", "todos los tomos", "cada tomo"]
-    
-    busca_titulos = any(palabra in entrada_lower for palabra in palabras_titulos) and any(palabra in entrada_lower for palabra in palabras_tomos)
-    busca_listado = any(palabra in entrada_lower for palabra in ["dame", "dime", "muestra", "muéstra", "lista", "listado", "cuales", "cuáles"])
-    
-    # Si pregunta específicamente por títulos o índice de tomos
-    if busca_titulos or (busca_listado and any(palabra in entrada_lower for palabra in palabras_tomos)):
+    # Si pregunta específicamente por títulos o índice de tomos (o pide un listado de tomos)
+    if consulta.tiene('tomos') and consulta.tiene('titulos', 'listado'):
         return obtener_titulos_tomos()
     
     # SISTEMA HÍBRIDO INTELIGENTE: Buscar en múltiples fuentes y combinar
@@ -1619,41 +1189,44 @@ La función específica de la División de Cumplimiento Ambiental es preparar y
     if respuesta_sitios_historicos:
         return respuesta_sitios_historicos
     
+    # Tomos relevantes (los 2 mejores según BM25, en una sola pasada por el índice)
+    # con la ortografía de la pregunta corregida ("querela" -> "querella")
+    terminos = analizar_consulta(entrada).terminos_corregidos
+    relevancia_tomos = obtener_indice_tomos().mejores(entrada, 2, terminos)
+    
+    if modo_sintesis() == MODO_DIRECTA:
+        # Una sola llamada: las ventanas ya puntuadas de cada fuente van directo a la síntesis
+        fuentes_informacion = contexto_directo(
+            entrada, [tomo_id for score, tomo_id in relevancia_tomos], terminos,
+            definiciones=buscar_multiples_terminos(analizar_consulta(entrada).candidatos_glosario)
+        )
+        if fuentes_informacion:
+            return generar_respuesta_hibrida_inteligente(entrada, fuentes_informacion)
+        return generar_respuesta_generica_inteligente(entrada)
+    
+    # Las fuentes son independientes: se extraen a la vez y se esperan antes de la síntesis
+    tareas = {}
+    
     # FUENTE 1: Reglamento de emergencia JP-RP-41
     if reglamento_emergencia:
-        info_emergencia = buscar_informacion_relevante(entrada, reglamento_emergencia, "Reglamento de Emergencia JP-RP-41")
-        if info_emergencia:
-            fuentes_informacion["emergencia"] = info_emergencia
-    
-    # FUENTE 2: Glosario (para términos técnicos)
-    respuesta_glosario = procesar_pregunta_glosario(entrada)
-    if respuesta_glosario:
-        fuentes_informacion["glosario"] = respuesta_glosario
-    
-    # FUENTE 3: Tomos relevantes (buscar los 2 más relevantes)
-    relevancia_tomos = []
-    for i in range(1, 12):
-        ruta = os.path.join("data", f"tomo_{i}.txt")
-        if os.path.exists(ruta):
-            score = evaluar_relevancia_tomo(entrada, ruta)
-            if score > 0:
-                relevancia_tomos.append((score, i, ruta))
-    
-    # Ordenar por relevancia y usar los 2 más relevantes
-    relevancia_tomos.sort(key=lambda x: x[0], reverse=True)
-    
-    info_tomos = []
-    for score, tomo_id, ruta in relevancia_tomos[:2]:  # Solo los 2 más relevantes
-        try:
-            with open(ruta, "r", encoding="utf-8") as f:
-                contenido = f.read()
-            
-            info_relevante = buscar_informacion_relevante(entrada, contenido, f"Tomo {tomo_id}")
-            if info_relevante:
-                info_tomos.append(f"**TOMO {tomo_id}:**\n{info_relevante}")
-        except Exception as e:
-            print(f"Error procesando tomo {tomo_id}: {e}")
+        tareas["emergencia"] = lambda: buscar_informacion_relevante(entrada, reglamento_emergencia, "Reglamento de Emergencia JP-RP-41", "reglamento_emergencia")
+    
+    # FUENTE 2: Glosario (para términos técnicos); opcional si el plazo está justo
+    if hay_tiempo_para("glosario"):
+        tareas["glosario"] = lambda: procesar_pregunta_glosario(entrada)
+    
+    # FUENTE 3: Tomos relevantes; opcionales como el glosario
+    for score, tomo_id in relevancia_tomos:  # Solo los 2 más relevantes
+        if hay_tiempo_para(f"tomo_{tomo_id}"):
+            tareas[f"tomo_{tomo_id}"] = partial(extraer_informacion_tomo, entrada, tomo_id)
+    
+    resultados = ejecutar_fuentes(tareas)
     
+    for fuente in ("emergencia", "glosario"):
+        if fuente in resultados:
+            fuentes_informacion[fuente] = resultados[fuente]
+    
+    info_tomos = [resultados[f"tomo_{tomo_id}"] for score, tomo_id in relevancia_tomos if f"tomo_{tomo_id}" in resultados]
     if info_tomos:
         fuentes_informacion["tomos"] = "\n\n".join(info_tomos)
     
@@ -1664,46 +1237,55 @@ La función específica de la División de Cumplimiento Ambiental es preparar y
     # Si no encuentra información específica, respuesta inteligente genérica
     return generar_respuesta_generica_inteligente(entrada)
 
-def buscar_informacion_relevante(pregunta, contenido, fuente):
-    """Busca información relevante en un contenido usando IA"""
+def extraer_informacion_tomo(entrada, tomo_id):
+    """Información relevante de un tomo, con su encabezado, o None"""
     try:
+        contenido = tomos_mejorados[tomo_id]
+        
+        info_relevante = buscar_informacion_relevante(entrada, contenido, f"Tomo {tomo_id}", f"tomo_{tomo_id}")
+        if info_relevante:
+            return f"**TOMO {tomo_id}:**\n{info_relevante}"
+    except Exception as e:
+        print(f"Error procesando tomo {tomo_id}: {e}")
+    return None
+
+@medir("buscar_informacion_relevante")
+@ruta_llm("hibrida-extraccion")
+def buscar_informacion_relevante(pregunta, contenido, fuente, clave_corpus=None):
+    """Busca información relevante en un contenido usando IA (clave_corpus usa el índice compartido del corpus)"""
+    try:
+        consulta = analizar_consulta(pregunta)
+        
         # Caso especial para la División de Cumplimiento Ambiental
-        pregunta_lower = pregunta.lower()
-        if "división de cumplimiento ambiental" in pregunta_lower or "division de cumplimiento ambiental" in pregunta_lower:
+        if consulta.tiene('cumplimiento_ambiental'):
             return """La División de Evaluación de Cumplimiento Ambiental (DECA) de la OGPe es responsable de evaluar y tramitar todos los documentos ambientales presentados a la agencia. Cumple funciones administrativas y de manejo de documentación ambiental según lo establece la Ley 161-2009 y otros reglamentos pertinentes.
 
 La función específica de la División de Cumplimiento Ambiental es preparar y adoptar, junto con la Junta de Planificación, la Oficina de Gerencia de Permisos (OGPe) y las Entidades Gubernamentales Concernidas, un Reglamento Conjunto para establecer un sistema uniforme de adjudicación, procesos uniformes para la evaluación y expedición de determinaciones finales, permisos y recomendaciones relacionados a obras de construcción y uso de terrenos, guías de diseño verde, procedimientos de auditorías y querellas, y cualquier otro asunto referido a la Ley 161-2009."""
         
-        # Fragmentar el contenido en chunks manejables
-        max_chars = 8000
-        if len(contenido) > max_chars:
-            # Buscar las secciones más relevantes
-            palabras_pregunta = pregunta.lower().split()
-            lineas = contenido.split('\n')
-            
-            secciones_relevantes = []
-            for i, linea in enumerate(lineas):
-                linea_lower = linea.lower()
-                relevancia = 0
-                
-                for palabra in palabras_pregunta:
-                    if len(palabra) > 3 and palabra in linea_lower:
-                        relevancia += 3
-                
-                if relevancia > 0:
-                    # Capturar contexto alrededor de la línea relevante
-                    inicio = max(0, i - 15)
-                    fin = min(len(lineas), i + 40)
-                    seccion = '\n'.join(lineas[inicio:fin])
-                    secciones_relevantes.append((relevancia, seccion))
-            
-            if secciones_relevantes:
-                # Ordenar por relevancia y combinar las mejores secciones
-                secciones_relevantes.sort(key=lambda x: x[0], reverse=True)
-                contenido_relevante = '\n\n---\n\n'.join([s[1] for s in secciones_relevantes[:2]])
+        # La extracción es una llamada al modelo: sin tiempo para ella y la síntesis, se omite
+        if not hay_tiempo_para(f"extraccion {fuente}"):
+            return None
+        
+        # Presupuesto del contenido a extraer: la mitad del de Haiku (cada fuente es una de varias)
+        max_tokens = presupuesto_modelo("claude-3-haiku-20240307") // 2
+        if not cabe_en_tokens(contenido, max_tokens):
+            # Las secciones más relevantes (ventanas fusionadas y puntuadas con BM25) que caben
+            terminos = consulta.terminos_corregidos
+            if clave_corpus:
+                candidatos = fragmentos_corpus(pregunta, clave_corpus, fuente, k=4, terminos=terminos)
+            else:
+                datos = contenido.encode('utf-8')
+                candidatos = [
+                    fragmento_texto(datos[v.inicio:v.fin].decode('utf-8', 'ignore'), fuente, v.puntuacion, v.lineas_coincidentes)
+                    for v in IndiceSecciones(contenido).buscar(pregunta, k=4, terminos=terminos)
+                ]
+            contexto = empaquetar(candidatos, max_tokens)
+            contenido_relevante = contexto.texto()
+            if contexto:
+                print(f"📦 {fuente}: {len(contexto.fragmentos)} secciones, {contexto.tokens}/{max_tokens} tokens")
             else:
                 # Si no encuentra secciones específicas, usar el inicio del documento
-                contenido_relevante = contenido[:max_chars]
+                contenido_relevante = recortar_a_tokens(contenido, max_tokens)
         else:
             contenido_relevante = contenido
         
@@ -1744,6 +1326,8 @@ INFORMACIÓN RELEVANTE EXTRAÍDA:"""
     
     return None
 
+@medir("ensamblado_respuesta")
+@ruta_llm("hibrida-sintesis")
 def generar_respuesta_hibrida_inteligente(pregunta, fuentes_informacion):
     """Genera una respuesta inteligente combinando múltiples fuentes"""
     try:
@@ -1780,7 +1364,8 @@ INSTRUCCIONES PARA RESPUESTA INTELIGENTE:
 
 RESPUESTA ESPECIALIZADA:"""
         
-        response = client.messages.create(
+        response = crear_mensaje(
+            client,
             model="claude-3-haiku-20240307",
             system="Eres Agente de Planificación, un experto en leyes de planificación de Puerto Rico con estilo conversacional inteligente como ChatGPT. Proporciona respuestas expertas, claras y útiles.",
             messages=[
@@ -1818,6 +1403,7 @@ RESPUESTA ESPECIALIZADA:"""
     
     return generar_respuesta_generica_inteligente(pregunta)
 
+@ruta_llm("generica")
 def generar_respuesta_generica_inteligente(pregunta):
     """Genera una respuesta inteligente y útil cuando no se encuentra información específica"""
     try:
@@ -1837,7 +1423,8 @@ INSTRUCCIONES:
 
 RESPUESTA ORIENTADORA:"""
         
-        response = client.messages.create(
+        response = crear_mensaje(
+            client,
             model="claude-3-haiku-20240307",
             system="Eres Agente de Planificación. Cuando no tienes información específica, proporciona orientación útil y profesional.",
             messages=[
@@ -1871,6 +1458,7 @@ RESPUESTA ORIENTADORA:"""
 ---
 💡 *Estaré aquí para ayudarte con cualquier otra consulta sobre planificación en Puerto Rico*"""
 
+@ruta_llm("recurso-especializado")
 def procesar_recurso_especializado(tipo_recurso, ruta_recurso, entrada):
     """Procesa un recurso especializado específico"""
     try:
@@ -2010,192 +1598,301 @@ def custom_static(filename):
     response.headers['Expires'] = '0'
     return response
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    """Endpoint para procesar mensajes del chat con IA híbrida inteligente
-    REFORZADO: Mejorado para priorizar las consultas específicas sobre tablas de cabida"""
-    try:
-        data = request.get_json()
-        mensaje = data.get('message', '').strip()
-        
-        if not mensaje:
-            return jsonify({'error': 'Mensaje vacío'}), 400
-        
-        conversation_id = get_conversation_id()
-        inicializar_conversacion(conversation_id)
-        
-        # Log para depuración
-        print(f"📩 Recibida consulta: '{mensaje}'")
-        
-        # Detección de preguntas legales mejorada
-        entrada_lower = mensaje.lower()
+# Respuestas de respaldo que indican que el modelo no respondió: nunca se cachean
+MARCAS_RESPUESTA_RESPALDO = (
+    "Lo siento, no puedo generar una respuesta en este momento",
+    "No encontré información específica sobre esta consulta en mi base de datos actual",
+)
+
+def es_respuesta_cacheable(respuesta):
+    """Indica si una respuesta se puede reutilizar (no vacía y no es un mensaje de respaldo)"""
+    if not respuesta or not isinstance(respuesta, str):
+        return False
+    # Si alguna llamada al modelo falló, la respuesta se armó con un respaldo
+    # (extracción cruda, "Información encontrada sobre...") aunque no lo diga
+    uso = uso_actual()
+    if uso is not None and uso.degradada:
+        return False
+    # Una respuesta armada sin algunas fuentes por falta de tiempo no debe reutilizarse
+    plazo = plazo_actual()
+    if plazo is not None and plazo.etapas_omitidas:
+        return False
+    return not any(marca in respuesta for marca in MARCAS_RESPUESTA_RESPALDO)
+
+def resolver_mensaje(mensaje, conversation_id, modo=None, endpoint="/chat"):
+    """Resuelve un mensaje del chat dentro del plazo de la consulta (CHAT_PLAZO_SEGUNDOS)
+
+    Args:
+        modo (str): Modo de síntesis híbrida de esta consulta ('extraccion' o
+                    'directa'); None usa SINTESIS_MODO
+        endpoint (str): Ruta HTTP que recibió el mensaje (para el registro)
+
+    Returns:
+        dict: Respuesta con 'response', 'type', 'conversation_id' y, si el
+              plazo obligó a saltar fuentes, 'etapas_omitidas'
+    """
+    # Análisis de la pregunta hecho una sola vez: todas las etapas lo toman del contexto
+    consulta = ConsultaAnalizada(mensaje)
+    registro = {
+        'evento': 'solicitud',
+        'id_solicitud': uuid.uuid4().hex,
+        'endpoint': endpoint,
+        'conversation_id': conversation_id,
+        'modo_sintesis': modo_valido(modo) or modo_sintesis(),
+        'pregunta': mensaje,
+        'huella_pregunta': consulta.huella,
+        'intenciones': consulta.intenciones.explicar(),
+    }
+    inicio = time.monotonic()
+    with con_plazo(nuevo_plazo()) as plazo, con_modo_sintesis(modo), registrar_uso() as uso, \
+            medir_solicitud(endpoint) as medicion, con_consulta(consulta):
+        try:
+            try:
+                resultado = procesar_mensaje(mensaje, conversation_id)
+            except PlazoAgotado as e:
+                # Sin tiempo para el modelo (p. ej. esperando a una consulta idéntica): respuesta local
+                print(f"⏱️ {e}")
+                plazo.omitir("respuesta")
+                resultado = respuesta_modo_emergencia(mensaje, conversation_id)
+            medicion.tipo = resultado.get('type')
+        except Exception as e:
+            registro.update({'error': repr(e), 'segundos': round(time.monotonic() - inicio, 3), **uso.como_dict()})
+            obtener_registro().registrar(registro)
+            raise
+    if plazo.etapas_omitidas:
+        print(f"⏱️ Consulta resuelta sin: {', '.join(plazo.etapas_omitidas)}")
+        resultado['etapas_omitidas'] = list(plazo.etapas_omitidas)
+    
+    registro.update({
+        'ruta': resultado.get('type'),
+        'segundos': round(time.monotonic() - inicio, 3),
+        'plazo_restante': round(plazo.restante(), 3),
+        'etapas_omitidas': list(plazo.etapas_omitidas),
+        **uso.como_dict(),
+        'respuesta': resultado.get('response'),
+    })
+    obtener_registro().registrar(registro)
+    return resultado
+
+def procesar_mensaje(mensaje, conversation_id):
+    """Procesa un mensaje del chat con IA híbrida inteligente
+    REFORZADO: Mejorado para priorizar las consultas específicas sobre tablas de cabida
 
-        # Respuestas sobre estructura del documento
-        if "cuantos tomos" in entrada_lower or "cuántos tomos" in entrada_lower:
-            respuesta = "� **NORMATIVA LEGAL DE PLANIFICACIÓN DE PUERTO RICO:**\n\n**FUENTE PRINCIPAL Y VIGENTE:**\n- 📋 **Reglamento de Emergencia JP-RP-41 (2025)** - Normativa actualizada\n- � **Glosario Oficial** - Definiciones especializadas\n\n**REFERENCIAS HISTÓRICAS (NO VIGENTES):**\n- � **regulaciones anteriores DEROGADAS** - Solo para contexto histórico\n\n⚠️ **IMPORTANTE:** Toda consulta legal se basa en el **Reglamento de Emergencia JP-RP-41**, que es la normativa vigente."
-            return jsonify({
+    Returns:
+        dict: Respuesta con 'response', 'type' y 'conversation_id'
+    """
+    cache_respuestas = obtener_cache_respuestas()
+    cache_semantica = obtener_cache_semantica()
+    
+    # Log para depuración
+    print(f"📩 Recibida consulta: '{mensaje}'")
+    
+    # Análisis de la consulta (el de la solicitud: intenciones, tomos y términos ya calculados)
+    consulta = analizar_consulta(mensaje)
+
+    # Respuestas sobre estructura del documento
+    if consulta.tiene('cuantos_tomos'):
+        respuesta = "� **NORMATIVA LEGAL DE PLANIFICACIÓN DE PUERTO RICO:**\n\n**FUENTE PRINCIPAL Y VIGENTE:**\n- 📋 **Reglamento de Emergencia JP-RP-41 (2025)** - Normativa actualizada\n- � **Glosario Oficial** - Definiciones especializadas\n\n**REFERENCIAS HISTÓRICAS (NO VIGENTES):**\n- � **regulaciones anteriores DEROGADAS** - Solo para contexto histórico\n\n⚠️ **IMPORTANTE:** Toda consulta legal se basa en el **Reglamento de Emergencia JP-RP-41**, que es la normativa vigente."
+        return {
+            'response': respuesta,
+            'type': 'info'
+        }
+        
+    # Respuestas sobre División de Cumplimiento Ambiental
+    if consulta.tiene('cumplimiento_ambiental'):
+        respuesta = f"🚨 **REGLAMENTO DE EMERGENCIA JP-RP-41**:\n\n{info_division_ambiental}\n\n---\n💡 *Información extraída del Reglamento de Emergencia JP-RP-41*"
+        return {
+            'response': respuesta,
+            'type': 'legal-emergencia',
+            'conversation_id': conversation_id
+        }
+
+    # Sin servicio de IA (bandera .modo_emergencia o circuito abierto): respuesta local inmediata
+    if modo_emergencia_activo():
+        return respuesta_modo_emergencia(mensaje, conversation_id)
+
+    # --- PRIORIDAD 0: Mini-Especialistas para casos ultra-específicos ---
+    print("🔍 Verificando mini-especialistas...")
+    especialista_cacheable = lambda r: r.get('usar_especialista', False) and es_respuesta_cacheable(r.get('respuesta'))
+    resultado_especialista = cache_respuestas.obtener_o_calcular(
+        mensaje, "mini-especialista",
+        lambda: cache_semantica.obtener_o_calcular(
+            mensaje, "mini-especialista",
+            lambda: procesar_con_mini_especialistas_v2(mensaje),
+            cacheable=especialista_cacheable
+        ),
+        cacheable=especialista_cacheable
+    )
+    
+    if resultado_especialista.get('usar_especialista', False):
+        print(f"✨ Mini-especialista activado: {resultado_especialista['tipo']}")
+        return {
+            'response': resultado_especialista['respuesta'],
+            'type': resultado_especialista['tipo'],
+            'conversation_id': conversation_id
+        }
+
+    # --- PRIORIDAD 1: Detectar si es consulta estructurada (índice, tabla, flujograma, resoluciones) ---
+    tipo_consulta = detectar_consulta_especifica(mensaje)
+    if tipo_consulta:
+        print(f"📊 Procesando consulta específica tipo: {tipo_consulta['tipo']}")
+        respuesta = cache_respuestas.obtener_o_calcular(
+            mensaje, f"estructurada-{tipo_consulta['tipo']}",
+            lambda: procesar_consulta_especifica(mensaje, tipo_consulta),
+            cacheable=es_respuesta_cacheable
+        )
+        if respuesta:
+            tipo_respuesta = f"recurso-{tipo_consulta['tipo']}"
+            print(f"✅ Respuesta generada correctamente como {tipo_respuesta}")
+            return {
                 'response': respuesta,
-                'type': 'info'
-            })
+                'type': tipo_respuesta,
+                'conversation_id': conversation_id
+            }
+        print("⚠️ La función procesar_consulta_especifica no devolvió respuesta")
+    
+    # PRIORIDAD 2: Comprobar explícitamente si es sobre tabla de cabida
+    # Este bloque añade una capa extra de seguridad para consultas de tablas
+    if consulta.tiene('tabla') and consulta.tiene('cabida'):
+        print("🔍 Detección secundaria: consulta sobre tabla de cabida")
+        tomo = consulta.tomo
+        
+        # Intentar procesar como tabla de cabida
+        resultados = buscar_tabla_cabida(tomo, obtener_tablas_cabida().distrito_mencionado(consulta.normalizado))
+        if resultados:
+            # IMPORTANTE: Preservar HTML en lugar de convertirlo a texto plano
+            # IMPORTANTE: Preservar HTML en lugar de convertirlo a texto plano
+            respuesta = "<strong>📊 Tabla de Cabida - Distritos de Calificación:</strong><br><br>"
+            for resultado in resultados:
+                # No añadir \n\n que rompe el formato HTML
+                respuesta += f"{resultado}"
+            respuesta += "<br>---<br>💡 <i>Información extraída de las tablas de cabida por tomo</i>"
             
-        # Respuestas sobre División de Cumplimiento Ambiental
-        if "división de cumplimiento ambiental" in entrada_lower or "division de cumplimiento ambiental" in entrada_lower:
-            respuesta = f"🚨 **REGLAMENTO DE EMERGENCIA JP-RP-41**:\n\n{info_division_ambiental}\n\n---\n💡 *Información extraída del Reglamento de Emergencia JP-RP-41*"
-            return jsonify({
+            print(f"✅ Respuesta de respaldo generada para tabla de cabida (tomo: {tomo})")
+            return {
                 'response': respuesta,
-                'type': 'legal-emergencia',
+                'type': 'recurso-tabla_cabida',
                 'conversation_id': conversation_id
-            })
-
-        # --- PRIORIDAD 0: Mini-Especialistas para casos ultra-específicos ---
-        print("🔍 Verificando mini-especialistas...")
-        resultado_especialista = procesar_con_mini_especialistas_v2(mensaje)
+            }
+    
+    # SISTEMA HÍBRIDO INTELIGENTE: Detectar si es pregunta legal
+    # (las palabras legales incluyen 'tomo'; las específicas, índice, tabla, cabida...)
+    if consulta.tiene('legal', 'consulta_especifica'):
+        # PROCESAR CON SISTEMA HÍBRIDO INTELIGENTE
+        print("📚 Procesando con sistema híbrido inteligente")
+        # Cada modo de síntesis guarda sus propias respuestas
+        ruta_hibrida = "hibrida-directa" if modo_sintesis() == MODO_DIRECTA else "hibrida"
+        respuesta = cache_respuestas.obtener_o_calcular(
+            mensaje, ruta_hibrida,
+            # Una paráfrasis de una pregunta ya respondida reutiliza esa respuesta
+            lambda: cache_semantica.obtener_o_calcular(
+                mensaje, ruta_hibrida,
+                lambda: procesar_pregunta_legal(mensaje),
+                cacheable=es_respuesta_cacheable
+            ),
+            cacheable=es_respuesta_cacheable
+        )
         
-        if resultado_especialista.get('usar_especialista', False):
-            print(f"✨ Mini-especialista activado: {resultado_especialista['tipo']}")
-            return jsonify({
-                'response': resultado_especialista['respuesta'],
-                'type': resultado_especialista['tipo'],
-                'conversation_id': conversation_id
-            })
-
-        # --- PRIORIDAD 1: Detectar si es consulta estructurada (índice, tabla, flujograma, resoluciones) ---
-        tipo_consulta = detectar_consulta_especifica(mensaje)
-        if tipo_consulta:
-            print(f"📊 Procesando consulta específica tipo: {tipo_consulta['tipo']}")
-            respuesta = procesar_consulta_especifica(mensaje, tipo_consulta)
-            if respuesta:
-                tipo_respuesta = f"recurso-{tipo_consulta['tipo']}"
-                print(f"✅ Respuesta generada correctamente como {tipo_respuesta}")
-                return jsonify({
-                    'response': respuesta,
-                    'type': tipo_respuesta,
-                    'conversation_id': conversation_id
-                })
-            print("⚠️ La función procesar_consulta_especifica no devolvió respuesta")
-        
-        # PRIORIDAD 2: Comprobar explícitamente si es sobre tabla de cabida
-        # Este bloque añade una capa extra de seguridad para consultas de tablas
-        if 'tabla' in entrada_lower and 'cabida' in entrada_lower:
-            print("🔍 Detección secundaria: consulta sobre tabla de cabida")
-            # Extraer tomo mediante regex más flexible
-            import re
-            tomo_match = re.search(r'tomo\s*(\d+)|del\s+tomo\s*(\d+)', entrada_lower)
-            
-            # Obtener el tomo de cualquier grupo capturado
-            tomo = None
-            if tomo_match:
-                for grupo in tomo_match.groups():
-                    if grupo is not None:
-                        tomo = int(grupo)
-                        break
-            
-            # Intentar procesar como tabla de cabida
-            resultados = buscar_tabla_cabida(tomo)
-            if resultados:
-                # IMPORTANTE: Preservar HTML en lugar de convertirlo a texto plano
-                # IMPORTANTE: Preservar HTML en lugar de convertirlo a texto plano
-                respuesta = "<strong>📊 Tabla de Cabida - Distritos de Calificación:</strong><br><br>"
-                for resultado in resultados:
-                    # No añadir \n\n que rompe el formato HTML
-                    respuesta += f"{resultado}"
-                respuesta += "<br>---<br>💡 <i>Información extraída de las tablas de cabida por tomo</i>"
-                
-                print(f"✅ Respuesta de respaldo generada para tabla de cabida (tomo: {tomo})")
-                return jsonify({
-                    'response': respuesta,
-                    'type': 'recurso-tabla_cabida',
-                    'conversation_id': conversation_id
-                })
-        
-        # SISTEMA HÍBRIDO INTELIGENTE: Detectar si es pregunta legal
-        es_legal = any(palabra.lower() in entrada_lower for palabra in palabras_legales)
-        if not es_legal and "tomo" in entrada_lower:
-            es_legal = True
-        
-        # Palabras que indican consultas específicas
-        palabras_consulta_especifica = ['índice', 'indice', 'flujograma', 'tabla', 'cabida', 'resolución', 'lista']
-        es_consulta_especifica = any(palabra in entrada_lower for palabra in palabras_consulta_especifica)
-        
-        if es_legal or es_consulta_especifica:
-            # PROCESAR CON SISTEMA HÍBRIDO INTELIGENTE
-            print("📚 Procesando con sistema híbrido inteligente")
-            respuesta = procesar_pregunta_legal(mensaje)
-            
-            # Determinar tipo de respuesta basado en el contenido
-            if "🚨" in respuesta and "Reglamento de Emergencia" in respuesta:
-                tipo_respuesta = 'legal-emergencia'
-            elif "📚" in respuesta and "Glosario" in respuesta:
-                tipo_respuesta = 'legal-glosario'
-            elif "📋" in respuesta and "Fuentes consultadas" in respuesta:
-                tipo_respuesta = 'legal-hibrido'
-            else:
-                tipo_respuesta = 'legal-general'
-                
+        # Determinar tipo de respuesta basado en el contenido
+        if "🚨" in respuesta and "Reglamento de Emergencia" in respuesta:
+            tipo_respuesta = 'legal-emergencia'
+        elif "📚" in respuesta and "Glosario" in respuesta:
+            tipo_respuesta = 'legal-glosario'
+        elif "📋" in respuesta and "Fuentes consultadas" in respuesta:
+            tipo_respuesta = 'legal-hibrido'
         else:
-            # PREGUNTA GENERAL: Mejorar con contexto inteligente
-            mensajes_conversacion = conversaciones[conversation_id]
-            
-            # Verificar si la pregunta podría beneficiarse de contexto legal
-            palabras_contexto_legal = ['puerto rico', 'pr', 'planificación', 'planificacion', 'ley', 'legal', 'gobierno']
-            necesita_contexto = any(palabra in entrada_lower for palabra in palabras_contexto_legal)
+            tipo_respuesta = 'legal-general'
             
-            if necesita_contexto:
-                # Agregar contexto sobre especialización
-                contexto_especializado = """Ten en cuenta que soy Agente de Planificación, especializado en leyes de planificación de Puerto Rico. 
+    else:
+        # PREGUNTA GENERAL: Mejorar con contexto inteligente
+        historial = conversaciones.historial(conversation_id)
+        
+        # Solo la primera pregunta de una conversación es independiente del historial y se puede cachear
+        conversacion_nueva = not historial.turnos and not historial.resumen
+        
+        # Verificar si la pregunta podría beneficiarse de contexto legal
+        if consulta.tiene('contexto_legal'):
+            # Agregar contexto sobre especialización
+            contexto_especializado = """Ten en cuenta que soy Agente de Planificación, especializado en leyes de planificación de Puerto Rico. 
 Si la pregunta está relacionada con planificación, permisos, construcción o temas legales de Puerto Rico, puedo proporcionar información muy específica."""
-                
-                mensaje_con_contexto = f"{mensaje}\n\n[CONTEXTO INTERNO: {contexto_especializado}]"
-                mensajes_conversacion.append({"role": "user", "content": mensaje_con_contexto})
-            else:
-                mensajes_conversacion.append({"role": "user", "content": mensaje})
-            
-            # Generar respuesta con Claude (Anthropic)
-            from utils.claude_adapter import claude_chat_completion
             
-            # Usar el cliente Claude para procesar la consulta
+            mensaje_con_contexto = f"{mensaje}\n\n[CONTEXTO INTERNO: {contexto_especializado}]"
+            turno_usuario = {"role": "user", "content": mensaje_con_contexto}
+        else:
+            turno_usuario = {"role": "user", "content": mensaje}
+        # Los turnos antiguos ya resumidos viajan en el prompt de sistema; los recientes, literales
+        mensaje_sistema = MENSAJE_SISTEMA_CONVERSACION
+        if historial.resumen:
+            mensaje_sistema = {
+                "role": "system",
+                "content": f"{MENSAJE_SISTEMA_CONVERSACION['content']}\n\nRESUMEN DE LA CONVERSACIÓN HASTA AHORA:\n{historial.resumen}"
+            }
+        mensajes_conversacion = [mensaje_sistema] + historial.turnos + [turno_usuario]
+        
+        # Generar respuesta con Claude (Anthropic)
+        from utils.claude_adapter import claude_chat_completion
+        
+        # Usar el cliente Claude para procesar la consulta
+        @ruta_llm("conversacion")
+        def generar_respuesta_general():
             respuesta_openai = claude_chat_completion(
                 client=client,
                 messages=mensajes_conversacion,
                 temperature=0.3,  # Un poco más creativo para conversaciones generales
                 max_tokens=800
             )
-            respuesta = respuesta_openai.choices[0].message.content.strip()
-            mensajes_conversacion.append({"role": "assistant", "content": respuesta})
-            tipo_respuesta = 'general-inteligente'
-        
-        # Mejorar respuesta si es muy corta o genérica
-        if len(respuesta) < 100 and es_legal:
-            respuesta += "\n\n💡 **¿Necesitas más información específica?** Puedes preguntar sobre:\n- Definiciones de términos técnicos\n- Procedimientos específicos\n- Requisitos para permisos\n- Comparaciones entre conceptos"
+            return respuesta_openai.choices[0].message.content.strip()
         
-        # Guardar en log con más información
-        with open("log.txt", "a", encoding="utf-8") as log:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log.write(f"[{timestamp}] Tipo: {tipo_respuesta}\nPregunta: {mensaje}\nRespuesta: {respuesta}\n---\n")
+        if conversacion_nueva:
+            respuesta = cache_respuestas.obtener_o_calcular(
+                mensaje, "general", generar_respuesta_general, cacheable=es_respuesta_cacheable
+            )
+        else:
+            respuesta = generar_respuesta_general()
+        # Pregunta y respuesta se guardan juntas: un fallo no deja un turno del usuario sin respuesta
+        conversaciones.agregar(conversation_id, turno_usuario, {"role": "assistant", "content": respuesta})
+        tipo_respuesta = 'general-inteligente'
+    
+    # Mejorar respuesta si es muy corta o genérica
+    if len(respuesta) < 100 and consulta.tiene('legal'):
+        respuesta += "\n\n💡 **¿Necesitas más información específica?** Puedes preguntar sobre:\n- Definiciones de términos técnicos\n- Procedimientos específicos\n- Requisitos para permisos\n- Comparaciones entre conceptos"
+    
+    return {
+        'response': respuesta,
+        'type': tipo_respuesta,
+        'conversation_id': conversation_id
+    }
+
+def respuesta_modo_emergencia(mensaje, conversation_id):
+    """Respuesta del buscador local cuando el servicio de IA no está disponible"""
+    print("🚨 Modo de emergencia: respondiendo con el buscador local")
+    return {
+        'response': generar_respuesta_emergencia(mensaje, tomos_mejorados).strip(),
+        'type': 'emergencia',
+        'conversation_id': conversation_id
+    }
+
+def respuesta_error_chat(e, mensaje, conversation_id):
+    """Respuesta amigable (y registro) cuando falla el procesamiento de un mensaje"""
+    print(f"Error en chat: {str(e)}")
+    import traceback
+    traceback.print_exc()
+    
+    if isinstance(e, CircuitoAbierto) or modo_emergencia_activo():
+        return respuesta_modo_emergencia(mensaje, conversation_id)
+
+    # Verificar si el error es por cuota excedida de API
+    error_str = str(e).lower()
+    if any(term in error_str for term in ["quota", "rate limit", "exceeded", "limit exceeded"]):
+        print("⚠️ DETECTADO ERROR DE CUOTA EXCEDIDA EN API")
         
-        return jsonify({
-            'response': respuesta,
-            'type': tipo_respuesta,
-            'conversation_id': conversation_id
-        })
+        # Guardar error en log para diagnóstico
+        with open("error_api_log.txt", "a", encoding="utf-8") as error_file:
+            error_file.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Error de cuota excedida: {str(e)}\n")
+            error_file.write("Por favor, revisa tu plan de Anthropic para resolver el problema de cuota\n\n")
         
-    except Exception as e:
-        print(f"Error en chat: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        # Verificar si el error es por cuota excedida de API
-        error_str = str(e).lower()
-        if any(term in error_str for term in ["quota", "rate limit", "exceeded", "limit exceeded"]):
-            print("⚠️ DETECTADO ERROR DE CUOTA EXCEDIDA EN API")
-            
-            # Guardar error en log para diagnóstico
-            with open("error_api_log.txt", "a", encoding="utf-8") as error_file:
-                error_file.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Error de cuota excedida: {str(e)}\n")
-                error_file.write("Por favor, revisa tu plan de Anthropic para resolver el problema de cuota\n\n")
-            
-            # Respuesta para el usuario
-            respuesta = """⚠️ **Límite de cuota de API excedido**
+        # Respuesta para el usuario
+        respuesta = """⚠️ **Límite de cuota de API excedido**
 
 Lo sentimos, hemos alcanzado nuestro límite de uso de la API de Anthropic. 
 
@@ -2205,32 +1902,32 @@ Por favor:
 
 Estamos trabajando para resolver esta situación lo antes posible.
 """
-            
-            return jsonify({
-                'response': respuesta,
-                'type': 'error-api',
-                'conversation_id': conversation_id
-            })
-        
-        # Guardar error en log para diagnóstico
-        with open("error_log.txt", "a", encoding="utf-8") as error_file:
-            error_file.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Error: {str(e)}\n")
-            error_file.write(traceback.format_exc() + "\n\n")
         
-        # Intentar responder a la pregunta sobre división de cumplimiento ambiental
-        if "división de cumplimiento ambiental" in entrada_lower or "division de cumplimiento ambiental" in entrada_lower:
-            respuesta_especifica = """La División de Evaluación de Cumplimiento Ambiental (DECA) de la OGPe es responsable de evaluar y tramitar todos los documentos ambientales presentados a la agencia. Cumple funciones administrativas y de manejo de documentación ambiental según lo establece la Ley 161-2009 y otros reglamentos pertinentes.
+        return {
+            'response': respuesta,
+            'type': 'error-api',
+            'conversation_id': conversation_id
+        }
+    
+    # Guardar error en log para diagnóstico
+    with open("error_log.txt", "a", encoding="utf-8") as error_file:
+        error_file.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Error: {str(e)}\n")
+        error_file.write(traceback.format_exc() + "\n\n")
+    
+    # Intentar responder a la pregunta sobre división de cumplimiento ambiental
+    if analizar_consulta(mensaje or "").tiene('cumplimiento_ambiental'):
+        respuesta_especifica = """La División de Evaluación de Cumplimiento Ambiental (DECA) de la OGPe es responsable de evaluar y tramitar todos los documentos ambientales presentados a la agencia. Cumple funciones administrativas y de manejo de documentación ambiental según lo establece la Ley 161-2009 y otros reglamentos pertinentes.
 
 La función específica de la División de Cumplimiento Ambiental es preparar y adoptar, junto con la Junta de Planificación, la Oficina de Gerencia de Permisos (OGPe) y las Entidades Gubernamentales Concernidas, un Reglamento Conjunto para establecer un sistema uniforme de adjudicación, procesos uniformes para la evaluación y expedición de determinaciones finales, permisos y recomendaciones relacionados a obras de construcción y uso de terrenos, guías de diseño verde, procedimientos de auditorías y querellas, y cualquier otro asunto referido a la Ley 161-2009."""
-            
-            return jsonify({
-                'response': respuesta_especifica,
-                'type': 'legal-emergencia',
-                'conversation_id': get_conversation_id()
-            })
         
-        # Respuesta de error más amigable
-        error_respuesta = """🔧 **Se produjo un error técnico**
+        return {
+            'response': respuesta_especifica,
+            'type': 'legal-emergencia',
+            'conversation_id': conversation_id
+        }
+    
+    # Respuesta de error más amigable
+    error_respuesta = """🔧 **Se produjo un error técnico**
 
 Lo siento, hubo un problema procesando tu consulta. 
 
@@ -2241,17 +1938,138 @@ Lo siento, hubo un problema procesando tu consulta.
 
 ---
 💡 *Estaré aquí para ayudarte cuando estés listo*"""
+    
+    return {
+        'response': error_respuesta,
+        'type': 'error-amigable'
+    }  # Se responde con 200 para mostrar el mensaje amigable
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    """Endpoint para procesar mensajes del chat con IA híbrida inteligente"""
+    mensaje = ""
+    conversation_id = None
+    try:
+        data = request.get_json()
+        mensaje = data.get('message', '').strip()
+        
+        if not mensaje:
+            return jsonify({'error': 'Mensaje vacío'}), 400
+        
+        conversation_id = get_conversation_id()
+        return jsonify(resolver_mensaje(mensaje, conversation_id, data.get('modo_sintesis')))
         
-        return jsonify({
-            'response': error_respuesta,
-            'type': 'error-amigable'
-        }), 200  # 200 para mostrar el mensaje amigable
+    except Exception as e:
+        return jsonify(respuesta_error_chat(e, mensaje, conversation_id))
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Igual que /chat pero transmite la respuesta como Server-Sent Events
+
+    Eventos: 'inicio' (empieza una generación; descartar lo recibido),
+    'token' ({'texto'}) y 'fin' (la respuesta completa, igual que /chat).
+    Las respuestas que no pasan por el modelo (tablas, índice...) llegan
+    solo en 'fin'.
+    """
+    data = request.get_json(silent=True) or {}
+    mensaje = data.get('message', '').strip()
+    
+    if not mensaje:
+        return jsonify({'error': 'Mensaje vacío'}), 400
+    
+    conversation_id = get_conversation_id()
+    eventos = queue.Queue()
+    
+    def emisor(evento, datos):
+        eventos.put((evento, datos))
+    
+    def resolver():
+        with con_emisor(emisor):
+            try:
+                resultado = resolver_mensaje(mensaje, conversation_id, data.get('modo_sintesis'), "/chat/stream")
+            except Exception as e:
+                resultado = respuesta_error_chat(e, mensaje, conversation_id)
+        eventos.put(("fin", resultado))
+    
+    threading.Thread(target=resolver, daemon=True).start()
+    
+    def generar():
+        # Primer byte inmediato; comentarios periódicos mantienen viva la conexión mientras se consultan las fuentes
+        yield ": conectado\n\n"
+        while True:
+            try:
+                evento, datos = eventos.get(timeout=10)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if evento == "token":
+                yield evento_sse("token", {"texto": datos})
+            elif evento == "inicio":
+                yield evento_sse("inicio", {})
+            else:
+                yield evento_sse("fin", datos)
+                break
+    
+    return Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/comparar-sintesis', methods=['POST'])
+def comparar_sintesis():
+    """Ejecuta la ruta híbrida en cada modo de síntesis y compara latencia, llamadas y tokens
+
+    Cuerpo: {'message': pregunta}. No usa las cachés ni transmite tokens.
+    Cada consulta cuesta varias llamadas al modelo, así que está apagado salvo
+    con COMPARAR_SINTESIS=1 y, si COMPARAR_SINTESIS_TOKEN está definido, pide
+    ese valor en la cabecera X-Token-Admin. Los dos modos comparten el plazo
+    de una consulta de /chat (la mitad cada uno) y en modo de emergencia no
+    se llama al modelo.
+    """
+    if not bandera_entorno("COMPARAR_SINTESIS", False):
+        return jsonify({'error': 'No disponible'}), 404
+    token = os.getenv("COMPARAR_SINTESIS_TOKEN", "")
+    if token and not hmac.compare_digest(request.headers.get('X-Token-Admin', ''), token):
+        return jsonify({'error': 'No autorizado'}), 403
+    if modo_emergencia_activo():
+        return jsonify({'error': 'Servicio de IA no disponible (modo de emergencia)'}), 503
+
+    data = request.get_json(silent=True) or {}
+    mensaje = data.get('message', '').strip()
+    
+    if not mensaje:
+        return jsonify({'error': 'Mensaje vacío'}), 400
+    
+    segundos_por_modo = nuevo_plazo().segundos / len(MODOS_SINTESIS)
+    comparacion = {}
+    for modo in MODOS_SINTESIS:
+        inicio = time.monotonic()
+        error = None
+        with con_plazo(Plazo(segundos_por_modo)) as plazo, con_modo_sintesis(modo), registrar_uso() as uso, \
+                con_consulta(ConsultaAnalizada(mensaje)):
+            try:
+                respuesta = procesar_pregunta_legal(mensaje)
+            except (PlazoAgotado, CircuitoAbierto) as e:
+                respuesta, error = None, str(e)
+        comparacion[modo] = {
+            'segundos': round(time.monotonic() - inicio, 3),
+            **uso.como_dict(),
+            'caracteres_respuesta': len(respuesta or ""),
+            'etapas_omitidas': list(plazo.etapas_omitidas),
+            'respuesta': respuesta,
+        }
+        if error:
+            comparacion[modo]['error'] = error
+        print(f"⚖️ Síntesis {modo}: {comparacion[modo]['segundos']}s, {uso.llamadas} llamadas, "
+              f"{uso.tokens_entrada}+{uso.tokens_salida} tokens")
+    
+    return jsonify({'pregunta': mensaje, 'modos': comparacion})
 
 @app.route('/nueva-conversacion', methods=['POST'])
 def nueva_conversacion():
     """Endpoint para iniciar una nueva conversación"""
     if 'conversation_id' in session:
-        del session['conversation_id']
+        conversaciones.borrar(session.pop('conversation_id'))
     return jsonify({'success': True})
 
 @app.route('/health')
@@ -2263,6 +2081,30 @@ def health():
         'api': 'anthropic'
     })
 
+@app.route('/estadisticas')
+def estadisticas():
+    """Estadísticas del proceso: cachés, coalescencia, conversaciones, registro, llamadas al modelo, memoria del corpus y tablas de cabida
+
+    'consumo_llm' suma todos los workers: tokens y costo estimado por ruta del pipeline y modelo.
+    """
+    return jsonify({
+        'pid': os.getpid(),
+        'cache_respuestas': obtener_cache_respuestas().estadisticas(),
+        'cache_semantica': obtener_cache_semantica().estadisticas(),
+        'coalescencia': obtener_coalescedor().estadisticas(),
+        'conversaciones': conversaciones.estadisticas(),
+        'registro': obtener_registro().estadisticas(),
+        'llm': client.estadisticas(),
+        'consumo_llm': resumen_consumo(),
+        'corpus': corpus.estadisticas(),
+        'tablas_cabida': obtener_tablas_cabida().estadisticas()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de todos los workers en formato Prometheus (latencia por etapa, tipo y modelo)"""
+    return Response(obtener_metricas().exposicion(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/favicon.ico')
 def favicon():
     """Servir favicon"""
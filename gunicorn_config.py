@@ -1,3 +1,8 @@
 bind = "0.0.0.0:$PORT"
 workers = 2
+# Mayor que CHAT_PLAZO_SEGUNDOS (90 por defecto): las consultas terminan antes de que maten al worker
 timeout = 120
+
+# Cargar app.py (y el corpus) en el master antes del fork: los workers
+# comparten el mmap del snapshot y las cadenas decodificadas copy-on-write
+preload_app = True
@@ -3,12 +3,22 @@ ALTERNATIVA INTELIGENTE: Mini-Especialistas
 Solo para casos muy específicos que realmente lo necesitan
 """
 import re
-import anthropic
-import os
 from dotenv import load_dotenv
 
+from utils.consulta_analizada import analizar_consulta
+from utils.consumo_llm import ruta_llm
+from utils.corpus import CLAVE_TOMO_10_CONSERVACION, obtener_corpus
+from utils.empaquetador_contexto import texto_relevante
+from utils.metricas import medir
+from utils.pasarela_llm import obtener_pasarela
+from utils.tablas_cabida import obtener_tablas_cabida
+
 load_dotenv()
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+client = obtener_pasarela()
+
+# Tokens de contexto por especialista: las secciones de sus tomos más relevantes para la consulta
+# (antes, los primeros 1500-2000 caracteres de cada tomo, fuera cual fuera la pregunta)
+TOKENS_CONTEXTO_ESPECIALISTA = 1500
 
 class MiniEspecialistaConservacion:
     """Mini especialista SOLO para conservación histórica"""
@@ -16,20 +26,10 @@ class MiniEspecialistaConservacion:
     @staticmethod
     def es_mi_consulta(entrada):
         """Detecta si es específicamente sobre conservación histórica"""
-        entrada_lower = entrada.lower()
-        
-        # Palabras de ALTA PRECISIÓN - solo casos muy específicos
-        palabras_especificas = [
-            'sitio histórico', 'sitios históricos',
-            'designación histórica', 'nominación histórica',
-            'conservación histórica', 'patrimonio histórico',
-            'icp', 'instituto de cultura',
-            'sección 10.1.1', 'criterios históricos'
-        ]
-        
-        return any(palabra in entrada_lower for palabra in palabras_especificas)
+        return analizar_consulta(entrada).tiene('especialista_conservacion')
     
     @staticmethod
+    @ruta_llm("especialista-conservacion")
     def procesar(entrada, tomo_10_contenido):
         """Procesamiento ultra-específico para conservación"""
         try:
@@ -38,7 +38,7 @@ class MiniEspecialistaConservacion:
 CONSULTA ESPECÍFICA: {entrada}
 
 INFORMACIÓN TOMO 10:
-{tomo_10_contenido[:2000]}
+{tomo_10_contenido}
 
 INSTRUCCIONES:
 - Menciona secciones específicas (10.1.1.1, 10.1.1.2, 10.1.4)
@@ -75,22 +75,10 @@ class MiniEspecialistaPermisos:
     @staticmethod
     def es_mi_consulta(entrada):
         """Detecta consultas sobre permisos, requisitos y trámites"""
-        entrada_lower = entrada.lower()
-        
-        # Palabras clave para permisos
-        palabras_permisos = [
-            'permiso', 'permisos', 'licencia', 'licencias',
-            'autorización', 'autorizaciones', 'certificación',
-            'tramitar', 'solicitar', 'requisitos para',
-            'documentos necesarios', 'cómo obtener',
-            'permiso de construcción', 'permiso de uso',
-            'permiso único', 'permiso de demolición',
-            'desarrollo y negocios', 'ogpe', 'sui'
-        ]
-        
-        return any(palabra in entrada_lower for palabra in palabras_permisos)
+        return analizar_consulta(entrada).tiene('especialista_permisos')
     
     @staticmethod
+    @ruta_llm("especialista-permisos")
     def procesar(entrada, tomo_1_contenido, tomo_3_contenido):
         """Procesamiento especializado para permisos"""
         try:
@@ -99,10 +87,10 @@ class MiniEspecialistaPermisos:
 CONSULTA ESPECÍFICA: {entrada}
 
 INFORMACIÓN TOMO 1 (Sistema de Evaluación):
-{tomo_1_contenido[:1500]}
+{tomo_1_contenido}
 
 INFORMACIÓN TOMO 3 (Permisos para Desarrollo):
-{tomo_3_contenido[:1500]}
+{tomo_3_contenido}
 
 INSTRUCCIONES ESPECÍFICAS:
 - Explica tipos de permisos disponibles
@@ -141,21 +129,10 @@ class MiniEspecialistaProcedimientos:
     @staticmethod
     def es_mi_consulta(entrada):
         """Detecta consultas sobre procedimientos administrativos"""
-        entrada_lower = entrada.lower()
-        
-        # Palabras clave para procedimientos
-        palabras_procedimientos = [
-            'procedimiento', 'procedimientos', 'proceso administrativo',
-            'notificación', 'notificaciones', 'plazo', 'plazos',
-            'vista pública', 'adjudicativo', 'determinación final',
-            'lpau', 'ley 38-2017', 'subsanación', 'requerimientos',
-            'municipios autónomos', 'jurisdicción', 'evaluación',
-            'trámite', 'solicitud', 'cómo presentar'
-        ]
-        
-        return any(palabra in entrada_lower for palabra in palabras_procedimientos)
+        return analizar_consulta(entrada).tiene('especialista_procedimientos')
     
     @staticmethod
+    @ruta_llm("especialista-procedimientos")
     def procesar(entrada, tomo_2_contenido):
         """Procesamiento especializado para procedimientos"""
         try:
@@ -164,7 +141,7 @@ class MiniEspecialistaProcedimientos:
 CONSULTA ESPECÍFICA: {entrada}
 
 INFORMACIÓN TOMO 2 (Disposiciones Generales):
-{tomo_2_contenido[:1500]}
+{tomo_2_contenido}
 
 INSTRUCCIONES ESPECÍFICAS:
 - Explica procedimientos paso a paso
@@ -177,9 +154,6 @@ INSTRUCCIONES ESPECÍFICAS:
 
 RESPUESTA ESPECIALIZADA:"""
 
-            # Obtener el cliente de Anthropic
-            client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-            
             # Usar el cliente Claude para procesar la consulta
             response = client.messages.create(
                 model="claude-3-haiku-20240307",
@@ -204,13 +178,12 @@ class MiniEspecialistaTablas:
     @staticmethod
     def es_mi_consulta(entrada):
         """Detecta cualquier solicitud de tabla"""
-        entrada_lower = entrada.lower()
-        return 'tabla' in entrada_lower
+        return analizar_consulta(entrada).tiene('tabla')
     
     @staticmethod
     def procesar(entrada):
         """Procesa cualquier tipo de tabla según la solicitud"""
-        entrada_lower = entrada.lower()
+        entrada_lower = analizar_consulta(entrada).minusculas
         
         # 1. TABLA DE CABIDA
         if 'cabida' in entrada_lower:
@@ -234,27 +207,29 @@ class MiniEspecialistaTablas:
     
     @staticmethod
     def _generar_tabla_cabida(entrada):
-        """Genera tabla de cabida específica por tomo"""
-        tomo = extraer_numero_tomo(entrada)
+        """Genera tabla de cabida específica por tomo (o solo las filas del distrito mencionado)"""
+        consulta = analizar_consulta(entrada)
+        tomo = consulta.tomo
         
         try:
             tabla_html = None
+            # Tablas precalculadas (tomo mejorado o archivo TablaCabida), por tomo y distrito
+            tablas = obtener_tablas_cabida()
+            distrito = tablas.distrito_mencionado(consulta.normalizado)
+            
+            if distrito:
+                tabla_html = tablas.html_distrito(distrito, tomo)
+                if tabla_html:
+                    titulo = f"📊 TABLA DE CABIDA - DISTRITO {distrito.upper()}"
+                    nota = ""
             
-            if tomo:
-                # Buscar archivo específico del tomo
-                archivo_tomo = f"data/RespuestasParaChatBot/RespuestasIA_Tomo{tomo}/TablaCabida_Tomo_{tomo}.txt"
-                try:
-                    with open(archivo_tomo, 'r', encoding='utf-8') as f:
-                        contenido_tomo = f.read()
-                    
-                    if contenido_tomo.strip():
-                        contenido_limpio = limpiar_contenido_tabla(contenido_tomo)
-                        if contenido_limpio:
-                            tabla_html = convertir_tabla_a_html(contenido_limpio)
-                            titulo = f"📊 TABLA DE CABIDA - TOMO {tomo}"
-                    
-                except FileNotFoundError:
-                    print(f"Archivo específico del Tomo {tomo} no encontrado: {archivo_tomo}")
+            if tomo and not tabla_html:
+                if tomo in tablas.tablas:
+                    tabla_html = tablas.html(tomo)
+                    titulo = f"📊 TABLA DE CABIDA - TOMO {tomo}"
+                    nota = f"<br><em>✅ Datos específicos del Tomo {tomo}</em>"
+                else:
+                    print(f"Tabla de cabida específica del Tomo {tomo} no encontrada")
             
             # Si no se encontró archivo específico, usar tabla genérica
             if not tabla_html:
@@ -274,8 +249,6 @@ class MiniEspecialistaTablas:
                 else:
                     titulo = "📊 TABLA DE CABIDA GENÉRICA"
                     nota = "<br><em>💡 Especifica un tomo (ej: 'tabla de cabida tomo 3')</em>"
-            else:
-                nota = f"<br><em>✅ Datos específicos del Tomo {tomo}</em>"
             
             respuesta = f"<strong>{titulo}</strong>{tabla_html}{nota}"
             respuesta += "<br>---<br>💡 <i>Tabla procesada por especialista</i>"
@@ -352,39 +325,6 @@ class MiniEspecialistaTablas:
         respuesta += "<br>---<br>💡 <i>Especialista en tablas unificado</i>"
         return respuesta
 
-def limpiar_contenido_tabla(contenido):
-    """Limpia el contenido eliminando fragmentos y texto descriptivo, extrae solo la tabla"""
-    # Eliminar marcadores de fragmento
-    contenido = re.sub(r'🔍\s*[Ff]ragmento\s*\d*\s*:', '', contenido)
-    contenido = re.sub(r'[Ff]ragmento\s*\d*\s*:', '', contenido)
-    contenido = re.sub(r'FRAGMENTO\s*\d*\s*:', '', contenido)
-    
-    # Buscar la parte que contiene la tabla (líneas con |)
-    lineas = contenido.split('\n')
-    lineas_tabla = []
-    en_tabla = False
-    
-    for linea in lineas:
-        linea = linea.strip()
-        
-        # Detectar inicio de tabla
-        if '|' in linea and ('Distrito' in linea or 'Cabida' in linea):
-            en_tabla = True
-        
-        # Si estamos en tabla y la línea contiene |, incluirla
-        if en_tabla and '|' in linea:
-            lineas_tabla.append(linea)
-        
-        # Detener si encontramos línea vacía después de empezar tabla
-        elif en_tabla and linea == '':
-            break
-        
-        # Detener si encontramos texto descriptivo después de tabla
-        elif en_tabla and linea and '|' not in linea and len(linea) > 20:
-            break
-    
-    return '\n'.join(lineas_tabla) if lineas_tabla else None
-
 def convertir_tabla_a_html(texto):
     """Convierte texto tabular a HTML - Función mejorada basada en app.py"""
     # Limpiar texto
@@ -474,8 +414,9 @@ def procesar_con_mini_especialistas(entrada):
         print("🏛️ Usando mini-especialista: Conservación Histórica")
         
         try:
-            with open("data/Tomo_10_Conservacion_Historica.txt", 'r', encoding='utf-8') as f:
-                tomo_10_contenido = f.read()
+            if not obtener_corpus().contiene(CLAVE_TOMO_10_CONSERVACION):
+                raise FileNotFoundError("Tomo_10_Conservacion_Historica.txt no está en el corpus")
+            tomo_10_contenido = texto_relevante(entrada, CLAVE_TOMO_10_CONSERVACION, TOKENS_CONTEXTO_ESPECIALISTA)
             
             resultado = MiniEspecialistaConservacion.procesar(entrada, tomo_10_contenido)
             if resultado:
@@ -506,31 +447,32 @@ def procesar_con_mini_especialistas(entrada):
         'mensaje': 'Continuar con sistema actual'
     }
 
+@medir("procesar_con_mini_especialistas_v2")
 def procesar_con_mini_especialistas_v2(entrada):
     """
     Función NUEVA con 4 especialistas expandidos - MEJORADA PARA USAR TOMOS ACTUALIZADOS
     """
     print(f"🔍 Verificando mini-especialistas V2 para: '{entrada[:50]}...'")
     
-    # Importar función de carga de tomos (si no está disponible en este contexto)
-    from utils.cargador_tomos import cargar_tomo_mejorado
+    # Corpus compartido con app.py: los tomos ya están en memoria (o en el mmap del snapshot)
+    corpus = obtener_corpus()
     
     # 1. Verificar PERMISOS Y TRÁMITES (Tomos 1 y 3) - MUY FRECUENTE
     if MiniEspecialistaPermisos.es_mi_consulta(entrada):
         print("🏗️ Usando mini-especialista: Permisos y Trámites")
         
         try:
-            # Cargar Tomo 1 y Tomo 3 mejorados
-            tomo_1_contenido = cargar_tomo_mejorado(1)
-            tomo_3_contenido = cargar_tomo_mejorado(3)
-            
-            # Verificar que ambos tomos se cargaron correctamente
-            if not tomo_1_contenido or not tomo_3_contenido:
+            # Verificar que ambos tomos mejorados están en el corpus
+            if 1 not in corpus.tomos or 3 not in corpus.tomos:
                 print("❌ Fallo al cargar tomos 1 o 3 mejorados")
                 return {
                     'usar_especialista': False,
                     'mensaje': 'Error cargando tomos mejorados'
                 }
+            
+            # Secciones relevantes de cada tomo, a partes iguales del presupuesto
+            tomo_1_contenido = texto_relevante(entrada, "tomo_1", TOKENS_CONTEXTO_ESPECIALISTA // 2)
+            tomo_3_contenido = texto_relevante(entrada, "tomo_3", TOKENS_CONTEXTO_ESPECIALISTA // 2)
                 
             resultado = MiniEspecialistaPermisos.procesar(entrada, tomo_1_contenido, tomo_3_contenido)
             if resultado:
@@ -547,16 +489,16 @@ def procesar_con_mini_especialistas_v2(entrada):
         print("⚖️ Usando mini-especialista: Procedimientos Administrativos")
         
         try:
-            # Cargar Tomo 2 mejorado
-            tomo_2_contenido = cargar_tomo_mejorado(2)
-            
-            # Verificar que el tomo se cargó correctamente
-            if not tomo_2_contenido:
+            # Verificar que el tomo 2 mejorado está en el corpus
+            if 2 not in corpus.tomos:
                 print("❌ Fallo al cargar tomo 2 mejorado")
                 return {
                     'usar_especialista': False,
                     'mensaje': 'Error cargando tomo mejorado'
                 }
+            
+            # Secciones relevantes del Tomo 2
+            tomo_2_contenido = texto_relevante(entrada, "tomo_2", TOKENS_CONTEXTO_ESPECIALISTA)
                 
             resultado = MiniEspecialistaProcedimientos.procesar(entrada, tomo_2_contenido)
             if resultado:
@@ -573,21 +515,17 @@ def procesar_con_mini_especialistas_v2(entrada):
         print("🏛️ Usando mini-especialista: Conservación Histórica")
         
         try:
-            # Cargar Tomo 10 mejorado
-            tomo_10_contenido = cargar_tomo_mejorado(10)
+            # Tomo 10 mejorado o, si falta, la versión específica de conservación histórica
+            clave_tomo_10 = "tomo_10" if 10 in corpus.tomos else CLAVE_TOMO_10_CONSERVACION
+            if not corpus.contiene(clave_tomo_10):
+                print("Tomo_10_Conservacion_Historica.txt no está en el corpus")
+                return {
+                    'usar_especialista': False,
+                    'mensaje': 'Error cargando tomo mejorado'
+                }
             
-            # Verificar que el tomo se cargó correctamente
-            if not tomo_10_contenido:
-                # Intentar cargar la versión específica de conservación histórica
-                try:
-                    with open("data/Tomo_10_Conservacion_Historica.txt", 'r', encoding='utf-8') as f:
-                        tomo_10_contenido = f.read()
-                except Exception as e:
-                    print(f"Error cargando Tomo_10_Conservacion_Historica.txt: {e}")
-                    return {
-                        'usar_especialista': False,
-                        'mensaje': 'Error cargando tomo mejorado'
-                    }
+            # Secciones relevantes del Tomo 10
+            tomo_10_contenido = texto_relevante(entrada, clave_tomo_10, TOKENS_CONTEXTO_ESPECIALISTA)
             
             resultado = MiniEspecialistaConservacion.procesar(entrada, tomo_10_contenido)
             if resultado:
@@ -618,12 +556,3 @@ def procesar_con_mini_especialistas_v2(entrada):
         'mensaje': 'Continuar con sistema actual'
     }
 
-# Función para extraer número de tomo (helper)
-def extraer_numero_tomo(texto):
-    """Extrae número de tomo del texto"""
-    match = re.search(r'tomo\s*(\d+)|del\s+tomo\s*(\d+)', texto.lower())
-    if match:
-        for grupo in match.groups():
-            if grupo is not None:
-                return int(grupo)
-    return None
@@ -98,14 +98,34 @@ async function handleSendMessage() {
     showTypingIndicator();
     
     try {
-        // Enviar a la API
-        const response = await sendToAPI(message);
+        // Enviar a la API: la respuesta se va mostrando a medida que llegan los tokens
+        let streamingMessage = null;
+        let streamingText = '';
+        
+        const response = await sendToAPIStream(message, {
+            onStart: () => {
+                streamingText = '';
+                if (streamingMessage) updateMessageContent(streamingMessage, '');
+            },
+            onToken: (texto) => {
+                if (!streamingMessage) {
+                    hideTypingIndicator();
+                    streamingMessage = addMessage('', 'bot');
+                }
+                streamingText += texto;
+                updateMessageContent(streamingMessage, streamingText);
+            }
+        });
         
         // Ocultar indicador de escritura
         hideTypingIndicator();
         
-        // Mostrar respuesta del bot
-        addMessage(response, 'bot');
+        // Mostrar respuesta del bot (la final reemplaza al texto transmitido)
+        if (streamingMessage) {
+            updateMessageContent(streamingMessage, response);
+        } else {
+            addMessage(response, 'bot');
+        }
         
         // Guardar en historial
         saveChatHistory();
@@ -140,6 +160,75 @@ async function sendToAPI(message) {
     return data.response || 'Lo siento, no pude procesar tu consulta.';
 }
 
+// Respuesta en streaming (Server-Sent Events sobre POST). Si el navegador no
+// permite leer el cuerpo por partes, se usa el endpoint normal.
+async function sendToAPIStream(message, { onStart, onToken } = {}) {
+    if (!window.ReadableStream || !window.TextDecoder) {
+        return sendToAPI(message);
+    }
+    
+    const response = await fetch('/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        },
+        body: JSON.stringify({
+            message: message,
+            session_id: currentSessionId
+        })
+    });
+    
+    if (!response.ok || !response.body) {
+        throw new Error(`Error ${response.status}: ${response.statusText}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Los eventos SSE se separan con una línea en blanco
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+            
+            const event = parseSSEEvent(rawEvent);
+            if (!event) continue;
+            
+            if (event.type === 'inicio' && onStart) {
+                onStart();
+            } else if (event.type === 'token' && onToken) {
+                onToken(event.data.texto || '');
+            } else if (event.type === 'fin') {
+                reader.cancel();
+                return event.data.response || 'Lo siento, no pude procesar tu consulta.';
+            }
+        }
+    }
+    
+    throw new Error('La conexión se cerró antes de recibir la respuesta completa');
+}
+
+function parseSSEEvent(rawEvent) {
+    let type = 'message';
+    const dataLines = [];
+    
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith(':')) return;  // comentario (keep-alive)
+        if (line.startsWith('event:')) type = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+    });
+    
+    if (!dataLines.length) return null;
+    return { type, data: JSON.parse(dataLines.join('\n')) };
+}
+
 function sendQuickMessage(message) {
     const userInput = document.getElementById('userInput');
     userInput.value = message;
@@ -178,6 +267,12 @@ function addMessage(content, sender, isError = false) {
     
     messagesContainer.appendChild(messageDiv);
     scrollToBottom();
+    return messageDiv;
+}
+
+function updateMessageContent(messageDiv, content) {
+    messageDiv.querySelector('.message-text').innerHTML = formatMessageContent(content);
+    scrollToBottom();
 }
 
 function formatMessageContent(content) {
@@ -0,0 +1,44 @@
+"""
+Regresiones de la caché semántica: preguntas que se parecen pero no piden lo mismo
+"""
+
+import os
+import tempfile
+
+import pytest
+
+from utils.cache_semantica import CacheSemantica, shingles, similitud
+
+RUTA = "hibrida"
+
+
+@pytest.fixture
+def cache():
+    with tempfile.TemporaryDirectory() as directorio:
+        yield CacheSemantica(os.path.join(directorio, "cache.sqlite3"), "test")
+
+
+@pytest.mark.parametrize("guardada, nueva", [
+    ("¿Cuál es la cabida mínima en un distrito R-1?", "¿Cuál es la cabida mínima en un distrito R-3?"),
+    ("cabida del distrito ZIT", "cabida del distrito ZP"),
+    ("¿Qué dice el tomo 3 sobre estacionamientos?", "¿Qué dice el tomo 5 sobre estacionamientos?"),
+    ("¿Qué pasa si construyo sin permiso?", "¿Qué pasa si construyo con permiso?"),
+])
+def test_numeros_codigos_y_marcadores_deben_coincidir(cache, guardada, nueva):
+    assert similitud(shingles(guardada), shingles(nueva)) == 0.0
+    cache.guardar(guardada, RUTA, "respuesta")
+    assert cache.buscar(nueva, RUTA) is None
+
+
+def test_umbral_estricto(cache):
+    guardada = ("requisitos de permiso de construcción de marquesina de vivienda "
+                "unifamiliar en terreno de esquina en Ponce")
+    nueva = guardada.replace("Ponce", "Mayaguez")
+    assert similitud(shingles(guardada), shingles(nueva)) == pytest.approx(cache.umbral)
+    cache.guardar(guardada, RUTA, "respuesta")
+    assert cache.buscar(nueva, RUTA) is None
+
+
+def test_parafrasis_reutiliza_respuesta(cache):
+    cache.guardar("¿qué es un permiso único?", RUTA, "respuesta")
+    assert cache.buscar("define permiso unico", RUTA) == ("respuesta", 1.0)
@@ -0,0 +1,324 @@
+"""
+Caché de respuestas en dos niveles: LRU en memoria del proceso y SQLite
+compartido por los workers de gunicorn
+
+La clave combina la pregunta normalizada (minúsculas, sin acentos ni
+puntuación), la ruta que generó la respuesta (mini-especialista,
+estructurada, híbrida, general) y la versión del corpus: si cambian los
+tomos cambia la versión y las respuestas anteriores dejan de usarse (y se
+borran del archivo al arrancar). En un fallo, las consultas idénticas
+concurrentes se agrupan en un solo cálculo (utils/coalescencia.py).
+
+Variables de entorno:
+    CACHE_RESPUESTAS=0                 Desactiva la caché
+    CACHE_RESPUESTAS_RUTA              Archivo SQLite (data/cache_respuestas.sqlite3)
+    CACHE_RESPUESTAS_TTL_HORAS=24      Vigencia de cada respuesta
+    CACHE_RESPUESTAS_MAX_FILAS=5000    Tamaño máximo del archivo (se descartan las menos usadas)
+    CACHE_RESPUESTAS_MAX_MEMORIA=256   Respuestas en el LRU de cada proceso
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils.cargador_tomos import DIRECTORIO_DATOS
+from utils.configuracion import bandera_entorno, decimal_entorno, entero_entorno
+from utils.consulta_analizada import analizar_consulta
+
+NOMBRE_ARCHIVO = "cache_respuestas.sqlite3"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS respuestas (
+    clave TEXT PRIMARY KEY,
+    ruta TEXT NOT NULL,
+    pregunta TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    version_corpus TEXT NOT NULL,
+    creado REAL NOT NULL,
+    expira REAL NOT NULL,
+    ultimo_uso REAL NOT NULL,
+    usos INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_respuestas_ultimo_uso ON respuestas (ultimo_uso);
+"""
+
+
+def ruta_cache_por_defecto():
+    """Archivo SQLite de las cachés (configurable con CACHE_RESPUESTAS_RUTA)"""
+    return os.getenv("CACHE_RESPUESTAS_RUTA", os.path.join(DIRECTORIO_DATOS, NOMBRE_ARCHIVO))
+
+
+def conexion_sqlite(local, ruta, esquema):
+    """
+    Conexión SQLite del hilo actual (se reabre tras un fork)
+
+    Args:
+        local (threading.local): Almacén por hilo del dueño de la conexión
+        ruta (str): Archivo SQLite
+        esquema (str): Sentencias CREATE ... IF NOT EXISTS a aplicar al abrir
+
+    Returns:
+        sqlite3.Connection: Conexión en modo WAL
+    """
+    conexion = getattr(local, "conexion", None)
+    if conexion is None or getattr(local, "pid", None) != os.getpid():
+        conexion = sqlite3.connect(ruta, timeout=5, check_same_thread=False)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        conexion.executescript(esquema)
+        local.conexion = conexion
+        local.pid = os.getpid()
+    return conexion
+
+
+def normalizar_pregunta(pregunta):
+    """Forma canónica de una pregunta: tokens en minúsculas, sin acentos ni puntuación
+
+    Dentro de una solicitud es la ya calculada en su ConsultaAnalizada.
+    """
+    return analizar_consulta(pregunta).forma_canonica
+
+
+class CacheRespuestas:
+    """Caché LRU en memoria respaldada por SQLite, con TTL y contadores"""
+
+    def __init__(self, ruta, version_corpus, ttl_segundos=24 * 3600, max_filas=5000, max_memoria=256):
+        self.ruta = ruta
+        self.version_corpus = version_corpus
+        self.ttl_segundos = ttl_segundos
+        self.max_filas = max_filas
+        self.max_memoria = max_memoria
+
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._escrituras = 0
+        self.contadores = {
+            'aciertos_memoria': 0,
+            'aciertos_sqlite': 0,
+            'fallos': 0,
+            'guardados': 0,
+            'expirados': 0,
+            'errores_sqlite': 0,
+        }
+
+        try:
+            conexion = self._conexion()
+            with conexion:
+                # Invalidación automática: las respuestas de otra versión del corpus ya no sirven
+                conexion.execute("DELETE FROM respuestas WHERE version_corpus != ? OR expira < ?",
+                                 (version_corpus, time.time()))
+        except sqlite3.Error as e:
+            self._error_sqlite("inicializando", e)
+
+    def _conexion(self):
+        return conexion_sqlite(self._local, self.ruta, _ESQUEMA)
+
+    def _error_sqlite(self, accion, error):
+        self.contadores['errores_sqlite'] += 1
+        print(f"⚠️ Caché de respuestas: error {accion} ({error})")
+
+    def clave(self, pregunta, ruta):
+        """Clave de caché de una pregunta para una ruta"""
+        base = f"{self.version_corpus}|{ruta}|{normalizar_pregunta(pregunta)}"
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+    def _recordar(self, clave, expira, valor):
+        """Guarda en el LRU del proceso (con el lock tomado)"""
+        self._memoria[clave] = (expira, valor)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def obtener(self, pregunta, ruta):
+        """
+        Respuesta guardada para la pregunta y ruta
+
+        Returns:
+            Valor guardado (JSON) o None si no existe o expiró
+        """
+        clave = self.clave(pregunta, ruta)
+        ahora = time.time()
+
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                expira, valor = entrada
+                if expira >= ahora:
+                    self._memoria.move_to_end(clave)
+                    self.contadores['aciertos_memoria'] += 1
+                    return valor
+                del self._memoria[clave]
+                self.contadores['expirados'] += 1
+
+        try:
+            conexion = self._conexion()
+            fila = conexion.execute(
+                "SELECT valor, expira FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is not None and fila[1] >= ahora:
+                with conexion:
+                    conexion.execute(
+                        "UPDATE respuestas SET ultimo_uso = ?, usos = usos + 1 WHERE clave = ?",
+                        (ahora, clave)
+                    )
+                valor = json.loads(fila[0])
+                with self._lock:
+                    self._recordar(clave, fila[1], valor)
+                    self.contadores['aciertos_sqlite'] += 1
+                return valor
+            if fila is not None:
+                self.contadores['expirados'] += 1
+        except (sqlite3.Error, ValueError) as e:
+            self._error_sqlite("leyendo", e)
+
+        self.contadores['fallos'] += 1
+        return None
+
+    def guardar(self, pregunta, ruta, valor):
+        """Guarda una respuesta (debe ser serializable a JSON)"""
+        clave = self.clave(pregunta, ruta)
+        ahora = time.time()
+        expira = ahora + self.ttl_segundos
+
+        with self._lock:
+            self._recordar(clave, expira, valor)
+            self.contadores['guardados'] += 1
+            self._escrituras += 1
+            recortar = self._escrituras % 50 == 0
+
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute(
+                    "INSERT OR REPLACE INTO respuestas "
+                    "(clave, ruta, pregunta, valor, version_corpus, creado, expira, ultimo_uso, usos) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                    (clave, ruta, pregunta[:500], json.dumps(valor, ensure_ascii=False),
+                     self.version_corpus, ahora, expira, ahora)
+                )
+                if recortar:
+                    self._recortar(conexion, ahora)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._error_sqlite("guardando", e)
+
+    def _recortar(self, conexion, ahora):
+        """Borra las expiradas y, si sobran filas, las menos usadas recientemente"""
+        conexion.execute("DELETE FROM respuestas WHERE expira < ?", (ahora,))
+        total = conexion.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        if total > self.max_filas:
+            conexion.execute(
+                "DELETE FROM respuestas WHERE clave IN "
+                "(SELECT clave FROM respuestas ORDER BY ultimo_uso ASC LIMIT ?)",
+                (total - self.max_filas,)
+            )
+
+    def obtener_o_calcular(self, pregunta, ruta, calcular, cacheable=None):
+        """
+        Devuelve la respuesta guardada o la calcula y la guarda
+
+        Args:
+            pregunta (str): Pregunta del usuario
+            ruta (str): Ruta que genera la respuesta
+            calcular: Función sin argumentos que produce la respuesta
+            cacheable: Función valor -> bool para descartar respuestas que no deben guardarse
+
+        Returns:
+            Respuesta guardada o recién calculada
+        """
+        valor = self.obtener(pregunta, ruta)
+        if valor is not None:
+            return valor
+
+        def calcular_y_guardar():
+            valor = calcular()
+            if valor and (cacheable is None or cacheable(valor)):
+                self.guardar(pregunta, ruta, valor)
+            return valor
+
+        # Las copias concurrentes de la misma pregunta esperan al primer cálculo
+        from utils.coalescencia import obtener_coalescedor
+        clave = self.clave(pregunta, ruta)
+        return obtener_coalescedor().ejecutar(
+            clave, calcular_y_guardar, consultar=lambda: self._leer_sqlite(clave)
+        )
+
+    def _leer_sqlite(self, clave):
+        """Respuesta vigente en el archivo compartido, sin tocar contadores ni el LRU"""
+        try:
+            fila = self._conexion().execute(
+                "SELECT valor FROM respuestas WHERE clave = ? AND expira >= ?", (clave, time.time())
+            ).fetchone()
+            return json.loads(fila[0]) if fila is not None else None
+        except (sqlite3.Error, ValueError) as e:
+            self._error_sqlite("leyendo", e)
+            return None
+
+    def estadisticas(self):
+        """Contadores del proceso y tamaño de la caché compartida"""
+        consultas = self.contadores['aciertos_memoria'] + self.contadores['aciertos_sqlite'] + self.contadores['fallos']
+        aciertos = self.contadores['aciertos_memoria'] + self.contadores['aciertos_sqlite']
+        estadisticas = dict(self.contadores)
+        estadisticas.update({
+            'tasa_aciertos': round(aciertos / consultas, 4) if consultas else 0.0,
+            'en_memoria': len(self._memoria),
+            'version_corpus': self.version_corpus,
+            'ttl_segundos': self.ttl_segundos,
+            'max_filas': self.max_filas,
+        })
+        try:
+            estadisticas['en_sqlite'] = self._conexion().execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        except sqlite3.Error as e:
+            self._error_sqlite("contando", e)
+        return estadisticas
+
+
+class CacheDesactivada:
+    """Misma interfaz que CacheRespuestas sin guardar nada (CACHE_RESPUESTAS=0)"""
+
+    def obtener(self, pregunta, ruta):
+        return None
+
+    def guardar(self, pregunta, ruta, valor):
+        pass
+
+    def obtener_o_calcular(self, pregunta, ruta, calcular, cacheable=None):
+        # Sin caché compartida solo se agrupan los hilos del proceso
+        from utils.coalescencia import obtener_coalescedor
+        clave = f"{ruta}|{normalizar_pregunta(pregunta)}"
+        return obtener_coalescedor().ejecutar(clave, calcular)
+
+    def estadisticas(self):
+        return {'activa': False}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def obtener_cache_respuestas():
+    """
+    Caché de respuestas del proceso
+
+    Returns:
+        CacheRespuestas: Caché ligada a la versión actual del corpus
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if not bandera_entorno("CACHE_RESPUESTAS"):
+                    _cache = CacheDesactivada()
+                else:
+                    from utils.corpus import obtener_corpus
+                    _cache = CacheRespuestas(
+                        ruta=ruta_cache_por_defecto(),
+                        version_corpus=obtener_corpus().version,
+                        ttl_segundos=decimal_entorno("CACHE_RESPUESTAS_TTL_HORAS", 24) * 3600,
+                        max_filas=entero_entorno("CACHE_RESPUESTAS_MAX_FILAS", 5000),
+                        max_memoria=entero_entorno("CACHE_RESPUESTAS_MAX_MEMORIA", 256),
+                    )
+    return _cache
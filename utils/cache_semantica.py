@@ -0,0 +1,420 @@
+"""
+Caché semántica de respuestas para preguntas parafraseadas
+
+"¿qué es un permiso único?" y "define permiso unico" no comparten clave
+exacta, pero sí las mismas palabras de contenido. Cada pregunta se reduce a
+un conjunto de shingles (palabras sin acentos, sin artículos, pronombres,
+muletillas ni palabras de intención, con el plural recortado) y se resume
+con una firma MinHash. Las
+firmas se reparten en bandas (LSH): dos preguntas parecidas coinciden en al
+menos una banda con alta probabilidad, y solo esas candidatas se comparan
+con la similitud de Jaccard exacta.
+
+La negación, las preposiciones y los marcadores temporales ("no", "sin",
+"con", "contra", "antes", "después"...) se conservan: cambian el sentido
+legal de la pregunta. Si uno de ellos aparece en solo una de las dos
+preguntas, la búsqueda falla aunque el resto coincida ("¿qué pasa si
+construyo sin permiso?" no reutiliza la respuesta de "...con permiso?").
+Lo mismo con los números y los códigos de distrito ("R-1", "ZIT", "tomo 3"):
+la cabida de un R-1 no sirve para un R-3.
+
+Las firmas, bandas y respuestas viven en el mismo SQLite que la caché de
+respuestas, así que todos los workers comparten los aciertos. Todo es local:
+no hay servicio de embeddings.
+
+Variables de entorno:
+    CACHE_SEMANTICA=0            Desactiva la capa semántica
+    CACHE_SEMANTICA_UMBRAL=0.8   Jaccard que hay que superar para reutilizar una respuesta
+"""
+
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from utils.cache_respuestas import conexion_sqlite, ruta_cache_por_defecto
+from utils.configuracion import bandera_entorno, decimal_entorno, entero_entorno
+from utils.consulta_analizada import analizar_consulta
+
+NUM_PERMUTACIONES = 64
+NUM_BANDAS = 16
+# Primo de Mersenne 2^61 - 1 para las permutaciones h(x) = (a·x + b) mod p
+_PRIMO = (1 << 61) - 1
+# Semilla fija: las firmas deben ser iguales en todos los procesos
+_SEMILLA = 20250731
+
+# Versión de la forma de los shingles: al cambiarla se descartan las entradas guardadas
+VERSION_SHINGLES = 3
+
+# Códigos de distrito con guion ("r-1", "rt-a", "c-l"), sobre el texto normalizado
+_PATRON_CODIGO = re.compile(r"\b[a-z]{1,3}-[a-z0-9]{1,3}\b")
+
+# Palabras sin carga de sentido (artículos, pronombres, auxiliares, muletillas).
+# No es PALABRAS_VACIAS: aquella quita también "no", "sin", "con", "antes"...
+PALABRAS_VACIAS_SEMANTICAS = frozenset("""
+a al el la las lo los un una uno unos unas de del y e o u que se me mi mis te tu tus su sus le les
+nos es son ser sea era fue ha han hay esta estan este esto estos estas ese esa eso esos esas muy mas
+tan algo puedo puede pueden podria debo debe deben hacer hace dame dime favor necesito quiero saber
+sabes
+""".split())
+
+# Negación, preposiciones y marcadores temporales: se conservan aunque sean cortos
+# y, si difieren entre dos preguntas, no hay acierto
+MARCADORES_SENTIDO = frozenset("""
+no ni nunca jamas tampoco sin con contra ante bajo desde hasta hacia para por segun sobre tras
+entre durante mediante antes despues luego mientras ya aun todavia
+""".split())
+
+# Palabras que indican la forma de la pregunta pero no su tema
+PALABRAS_INTENCION = frozenset("""
+define definir definicion definiciones significa significado concepto explica explicar
+explicame describe describir consiste entiende entender refiere informacion info
+cuales cual significan detalle detalles ayuda ayudame
+""".split())
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS semantica (
+    clave TEXT PRIMARY KEY,
+    ruta TEXT NOT NULL,
+    pregunta TEXT NOT NULL,
+    shingles TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    version_corpus TEXT NOT NULL,
+    expira REAL NOT NULL,
+    ultimo_uso REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS semantica_bandas (
+    hash INTEGER NOT NULL,
+    clave TEXT NOT NULL,
+    PRIMARY KEY (hash, clave)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_semantica_bandas_clave ON semantica_bandas (clave);
+CREATE INDEX IF NOT EXISTS idx_semantica_ultimo_uso ON semantica (ultimo_uso);
+"""
+
+
+def _raiz(palabra):
+    """Recorte mínimo de plurales (permisos -> permiso, construcciones -> construccion)"""
+    if len(palabra) > 4 and palabra.endswith("es") and palabra[-3] not in "aeiou":
+        return palabra[:-2]
+    if len(palabra) > 3 and palabra.endswith("s"):
+        return palabra[:-1]
+    return palabra
+
+
+_codigos_distrito = None
+
+
+def codigos_distrito():
+    """Distritos de una sola palabra de las tablas de cabida ("zit", "zp", "ape", "r-1"...)"""
+    global _codigos_distrito
+    if _codigos_distrito is None:
+        from utils.tablas_cabida import obtener_tablas_cabida
+        _codigos_distrito = frozenset(
+            clave for clave in obtener_tablas_cabida().por_distrito
+            if " " not in clave and len(clave) > 1
+        )
+    return _codigos_distrito
+
+
+def es_exacto(shingle):
+    """True si el shingle es un número o un código de distrito: solo vale si coincide igual"""
+    return "-" in shingle or any(c.isdigit() for c in shingle) or shingle in codigos_distrito()
+
+
+def shingles(pregunta):
+    """
+    Conjunto de términos de contenido de una pregunta
+
+    Returns:
+        frozenset: Palabras normalizadas que describen el tema de la pregunta
+                   (con sus marcadores de negación, preposiciones y tiempo, y
+                   sus números y códigos de distrito tal cual)
+    """
+    consulta = analizar_consulta(pregunta)
+    conjunto = set(_PATRON_CODIGO.findall(consulta.normalizado))
+    for token in consulta.tokens:
+        if token in MARCADORES_SENTIDO or es_exacto(token):
+            conjunto.add(token)
+        elif (token not in PALABRAS_VACIAS_SEMANTICAS and token not in PALABRAS_INTENCION
+              and (len(token) > 2 or token.isdigit())):
+            conjunto.add(_raiz(token))
+    return frozenset(conjunto)
+
+
+def jaccard(a, b):
+    """Similitud de Jaccard entre dos conjuntos"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def similitud(a, b):
+    """Jaccard entre dos conjuntos de shingles, 0 si difieren en un marcador de sentido,
+    un número o un código de distrito"""
+    diferencia = a ^ b
+    if diferencia & MARCADORES_SENTIDO or any(es_exacto(shingle) for shingle in diferencia):
+        return 0.0
+    return jaccard(a, b)
+
+
+def _hash64(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class MinHash:
+    """Firmas MinHash deterministas y bandas LSH"""
+
+    def __init__(self, num_permutaciones=NUM_PERMUTACIONES, num_bandas=NUM_BANDAS, semilla=_SEMILLA):
+        if num_permutaciones % num_bandas:
+            raise ValueError("num_permutaciones debe ser múltiplo de num_bandas")
+        generador = random.Random(semilla)
+        self.coeficientes = [
+            (generador.randrange(1, _PRIMO), generador.randrange(0, _PRIMO))
+            for _ in range(num_permutaciones)
+        ]
+        self.num_bandas = num_bandas
+        self.filas = num_permutaciones // num_bandas
+
+    def firma(self, conjunto):
+        """Mínimo de cada permutación sobre los hashes del conjunto"""
+        hashes = [_hash64(elemento) for elemento in conjunto]
+        return [min((a * h + b) % _PRIMO for h in hashes) for a, b in self.coeficientes]
+
+    def bandas(self, firma, ruta):
+        """Hash de cada banda (incluye índice de banda y ruta para no mezclar rutas)"""
+        resultado = []
+        for banda in range(self.num_bandas):
+            filas = firma[banda * self.filas:(banda + 1) * self.filas]
+            # SQLite guarda enteros con signo de 64 bits
+            resultado.append(_hash64(f"{ruta}|{banda}|{filas}") - (1 << 63))
+        return resultado
+
+
+class CacheSemantica:
+    """Respuestas reutilizables para preguntas casi iguales"""
+
+    def __init__(self, ruta, version_corpus, umbral=0.8, ttl_segundos=24 * 3600, max_filas=5000):
+        self.ruta = ruta
+        self.version_corpus = version_corpus
+        self.umbral = umbral
+        self.ttl_segundos = ttl_segundos
+        self.max_filas = max_filas
+        self.minhash = MinHash()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        self._suma_similitud = 0.0
+        self.contadores = {
+            'aciertos': 0,
+            'fallos': 0,
+            'candidatos_evaluados': 0,
+            'guardados': 0,
+            'errores_sqlite': 0,
+        }
+
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute("DELETE FROM semantica WHERE version_corpus != ? OR expira < ?",
+                                 (version_corpus, time.time()))
+                self._borrar_bandas_huerfanas(conexion)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._error_sqlite("inicializando", e)
+
+    def _conexion(self):
+        return conexion_sqlite(self._local, self.ruta, _ESQUEMA)
+
+    def _error_sqlite(self, accion, error):
+        self.contadores['errores_sqlite'] += 1
+        print(f"⚠️ Caché semántica: error {accion} ({error})")
+
+    def _contar(self, contador, cantidad=1):
+        with self._lock:
+            self.contadores[contador] += cantidad
+
+    @staticmethod
+    def _borrar_bandas_huerfanas(conexion):
+        conexion.execute("DELETE FROM semantica_bandas WHERE clave NOT IN (SELECT clave FROM semantica)")
+
+    def _clave(self, conjunto, ruta):
+        base = f"{self.version_corpus}|{ruta}|{' '.join(sorted(conjunto))}"
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+    def buscar(self, pregunta, ruta):
+        """
+        Respuesta de una pregunta casi igual ya respondida por la misma ruta
+
+        Returns:
+            tuple: (valor, similitud) o None si ninguna candidata supera el umbral
+                   (igualarlo no basta: "permiso en Ponce" y "permiso en
+                   Mayaguez" quedan justo en 0.8)
+        """
+        conjunto = shingles(pregunta)
+        if not conjunto:
+            self._contar('fallos')
+            return None
+
+        bandas = self.minhash.bandas(self.minhash.firma(conjunto), ruta)
+        ahora = time.time()
+        mejor = None
+        try:
+            conexion = self._conexion()
+            filas = conexion.execute(
+                "SELECT DISTINCT s.clave, s.shingles, s.valor FROM semantica_bandas b "
+                "JOIN semantica s ON s.clave = b.clave "
+                f"WHERE b.hash IN ({','.join('?' * len(bandas))}) "
+                "AND s.ruta = ? AND s.version_corpus = ? AND s.expira >= ?",
+                (*bandas, ruta, self.version_corpus, ahora)
+            ).fetchall()
+            self._contar('candidatos_evaluados', len(filas))
+
+            for clave, shingles_guardados, valor in filas:
+                parecido = similitud(conjunto, frozenset(json.loads(shingles_guardados)))
+                if parecido > self.umbral and (mejor is None or parecido > mejor[2]):
+                    mejor = (clave, valor, parecido)
+
+            if mejor is not None:
+                with conexion:
+                    conexion.execute("UPDATE semantica SET ultimo_uso = ? WHERE clave = ?", (ahora, mejor[0]))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._error_sqlite("buscando", e)
+            mejor = None
+
+        if mejor is None:
+            self._contar('fallos')
+            return None
+
+        with self._lock:
+            self.contadores['aciertos'] += 1
+            self._suma_similitud += mejor[2]
+        return json.loads(mejor[1]), mejor[2]
+
+    def guardar(self, pregunta, ruta, valor):
+        """Guarda una respuesta con su firma y bandas"""
+        conjunto = shingles(pregunta)
+        if not conjunto:
+            return
+
+        clave = self._clave(conjunto, ruta)
+        bandas = self.minhash.bandas(self.minhash.firma(conjunto), ruta)
+        ahora = time.time()
+        with self._lock:
+            self.contadores['guardados'] += 1
+            self._escrituras += 1
+            recortar = self._escrituras % 50 == 0
+
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute(
+                    "INSERT OR REPLACE INTO semantica "
+                    "(clave, ruta, pregunta, shingles, valor, version_corpus, expira, ultimo_uso) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (clave, ruta, pregunta[:500], json.dumps(sorted(conjunto), ensure_ascii=False),
+                     json.dumps(valor, ensure_ascii=False), self.version_corpus,
+                     ahora + self.ttl_segundos, ahora)
+                )
+                conexion.executemany(
+                    "INSERT OR IGNORE INTO semantica_bandas (hash, clave) VALUES (?, ?)",
+                    [(banda, clave) for banda in bandas]
+                )
+                if recortar:
+                    self._recortar(conexion, ahora)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._error_sqlite("guardando", e)
+
+    def _recortar(self, conexion, ahora):
+        conexion.execute("DELETE FROM semantica WHERE expira < ?", (ahora,))
+        total = conexion.execute("SELECT COUNT(*) FROM semantica").fetchone()[0]
+        if total > self.max_filas:
+            conexion.execute(
+                "DELETE FROM semantica WHERE clave IN "
+                "(SELECT clave FROM semantica ORDER BY ultimo_uso ASC LIMIT ?)",
+                (total - self.max_filas,)
+            )
+        self._borrar_bandas_huerfanas(conexion)
+
+    def obtener_o_calcular(self, pregunta, ruta, calcular, cacheable=None):
+        """
+        Reutiliza la respuesta de una pregunta casi igual o la calcula y la guarda
+
+        Args:
+            pregunta (str): Pregunta del usuario
+            ruta (str): Ruta que genera la respuesta
+            calcular: Función sin argumentos que produce la respuesta
+            cacheable: Función valor -> bool para descartar respuestas que no deben guardarse
+        """
+        encontrada = self.buscar(pregunta, ruta)
+        if encontrada is not None:
+            valor, similitud = encontrada
+            print(f"♻️ Respuesta reutilizada de una pregunta similar (Jaccard {similitud:.2f}, ruta {ruta})")
+            return valor
+
+        valor = calcular()
+        if valor and (cacheable is None or cacheable(valor)):
+            self.guardar(pregunta, ruta, valor)
+        return valor
+
+    def estadisticas(self):
+        """Contadores del proceso y tamaño de la caché semántica compartida"""
+        consultas = self.contadores['aciertos'] + self.contadores['fallos']
+        estadisticas = dict(self.contadores)
+        estadisticas.update({
+            'tasa_aciertos': round(self.contadores['aciertos'] / consultas, 4) if consultas else 0.0,
+            'similitud_media_aciertos': round(self._suma_similitud / self.contadores['aciertos'], 4) if self.contadores['aciertos'] else None,
+            'umbral': self.umbral,
+        })
+        try:
+            estadisticas['en_sqlite'] = self._conexion().execute("SELECT COUNT(*) FROM semantica").fetchone()[0]
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._error_sqlite("contando", e)
+        return estadisticas
+
+
+class CacheSemanticaDesactivada:
+    """Misma interfaz que CacheSemantica sin guardar nada (CACHE_SEMANTICA=0)"""
+
+    def buscar(self, pregunta, ruta):
+        return None
+
+    def guardar(self, pregunta, ruta, valor):
+        pass
+
+    def obtener_o_calcular(self, pregunta, ruta, calcular, cacheable=None):
+        return calcular()
+
+    def estadisticas(self):
+        return {'activa': False}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def obtener_cache_semantica():
+    """
+    Caché semántica del proceso (comparte archivo con la caché de respuestas)
+
+    Returns:
+        CacheSemantica: Caché ligada a la versión actual del corpus
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if not (bandera_entorno("CACHE_RESPUESTAS") and bandera_entorno("CACHE_SEMANTICA")):
+                    _cache = CacheSemanticaDesactivada()
+                else:
+                    from utils.corpus import obtener_corpus
+                    _cache = CacheSemantica(
+                        ruta=ruta_cache_por_defecto(),
+                        version_corpus=f"{obtener_corpus().version}-s{VERSION_SHINGLES}",
+                        umbral=decimal_entorno("CACHE_SEMANTICA_UMBRAL", 0.8),
+                        ttl_segundos=decimal_entorno("CACHE_RESPUESTAS_TTL_HORAS", 24) * 3600,
+                        max_filas=entero_entorno("CACHE_RESPUESTAS_MAX_FILAS", 5000),
+                    )
+    return _cache
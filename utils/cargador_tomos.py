@@ -2,44 +2,53 @@
 Módulo para cargar los tomos mejorados como fuente de información principal
 """
 
+import json
 import os
 import re
 import sys
 
-def cargar_tomo_mejorado(numero_tomo):
+# Directorio donde están los tomos mejorados
+DIRECTORIO_DATOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+def localizar_archivo_tomo(numero_tomo, archivos=None, directorio_datos=DIRECTORIO_DATOS):
     """
-    Carga el tomo mejorado según su número
-    
+    Localiza el nombre del archivo mejorado de un tomo
+
     Args:
-        numero_tomo (int): Número del tomo a cargar (1-12)
-    
+        numero_tomo (int): Número del tomo a localizar (1-12)
+        archivos (list): Listado del directorio de datos (opcional, evita repetir os.listdir)
+        directorio_datos (str): Directorio donde buscar
+
     Returns:
-        str: Contenido del tomo mejorado o None si no se encuentra
+        str: Nombre del archivo mejorado o None si no existe
     """
-    # Directorio donde están los tomos mejorados
-    directorio_datos = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
-    
-    # Buscar primero el tomo mejorado
-    patron_mejorado = f"TOMO{numero_tomo}_COMPLETO_MEJORADO_*.txt"
-    
-    # Caso especial para tomo 12 (glosario)
-    if numero_tomo == 12:
-        patron_mejorado = "TOMO12_GLOSARIO_COMPLETO_MEJORADO_*.txt"
-    
-    # Listar archivos en el directorio para encontrar coincidencias
-    archivos = os.listdir(directorio_datos)
-    archivo_mejorado = None
-    
+    if archivos is None:
+        archivos = os.listdir(directorio_datos)
+
     # Buscar el archivo que coincida con el patrón
     for archivo in archivos:
         if re.match(f"TOMO{numero_tomo}_COMPLETO_MEJORADO_\\d+_\\d+.txt", archivo):
-            archivo_mejorado = archivo
-            break
+            return archivo
         # Caso especial para el tomo 12 (glosario)
         elif numero_tomo == 12 and re.match("TOMO12_GLOSARIO_COMPLETO_MEJORADO_\\d+_\\d+.txt", archivo):
-            archivo_mejorado = archivo
-            break
-    
+            return archivo
+    return None
+
+def cargar_tomo_mejorado(numero_tomo):
+    """
+    Carga el tomo mejorado según su número
+
+    Args:
+        numero_tomo (int): Número del tomo a cargar (1-12)
+
+    Returns:
+        str: Contenido del tomo mejorado o None si no se encuentra
+    """
+    directorio_datos = DIRECTORIO_DATOS
+
+    # Buscar primero el tomo mejorado
+    archivo_mejorado = localizar_archivo_tomo(numero_tomo)
+
     # Si encontramos el archivo mejorado, cargarlo
     if archivo_mejorado:
         ruta_archivo = os.path.join(directorio_datos, archivo_mejorado)
@@ -50,7 +59,7 @@ def cargar_tomo_mejorado(numero_tomo):
                 return contenido
         except Exception as e:
             print(f"❌ Error cargando tomo {numero_tomo} mejorado: {e}")
-    
+
     # Caso especial para el tomo 1 (que aún no tiene versión mejorada)
     if numero_tomo == 1:
         ruta_original = os.path.join(directorio_datos, f"tomo_{numero_tomo}.txt")
@@ -62,7 +71,7 @@ def cargar_tomo_mejorado(numero_tomo):
                     return contenido
         except Exception as e:
             print(f"❌ Error cargando tomo 1 original: {e}")
-    
+
     # Para los demás tomos, no intentamos cargar el original
     print(f"❌ No se encontró el tomo {numero_tomo} mejorado")
     return None
@@ -71,12 +80,12 @@ def cargar_todos_los_tomos():
     """
     Carga todos los tomos mejorados disponibles (1-12, incluyendo glosario)
     VERSIÓN OPTIMIZADA: Solo utiliza tomos mejorados (versiones definitivas)
-    
+
     Returns:
         dict: Diccionario con el contenido de cada tomo {numero: contenido}
     """
     tomos = {}
-    
+
     # Mapeo de números de tomo a sus descripciones
     descripciones_tomos = {
         1: "Sistema de Evaluación y Tramitación de Permisos",
@@ -92,7 +101,7 @@ def cargar_todos_los_tomos():
         11: "Querellas",
         12: "Glosario de términos especializados"
     }
-    
+
     # Cargar tomos 1-11
     for i in range(1, 12):
         contenido = cargar_tomo_mejorado(i)
@@ -101,7 +110,7 @@ def cargar_todos_los_tomos():
             print(f"✅ Tomo {i} cargado: {descripciones_tomos[i]} ({len(contenido)} caracteres)")
         else:
             print(f"❌ Tomo {i} no disponible: {descripciones_tomos[i]}")
-    
+
     # Cargar tomo 12 (glosario)
     contenido_glosario = cargar_tomo_mejorado(12)
     if contenido_glosario:
@@ -109,6 +118,73 @@ def cargar_todos_los_tomos():
         print(f"✅ Glosario (Tomo 12) cargado: {len(contenido_glosario)} caracteres")
     else:
         print("❌ Glosario (Tomo 12) no disponible")
-    
+
     print(f"✅ Cargados {len(tomos)} tomos mejorados en total")
     return tomos
+
+def cargar_glosario():
+    """
+    Carga el glosario (primero busca la versión mejorada, Tomo 12)
+
+    Returns:
+        str: Contenido del glosario o cadena vacía si no existe
+    """
+    # Intentar cargar el glosario mejorado (Tomo 12)
+    glosario_mejorado = cargar_tomo_mejorado(12)
+    if glosario_mejorado:
+        print(f"✅ Glosario mejorado cargado: {len(glosario_mejorado)} caracteres, {len(glosario_mejorado.split('**'))} términos aprox.")
+        return glosario_mejorado
+
+    # Si no se encuentra el mejorado, buscar el original
+    ruta_glosario = os.path.join(DIRECTORIO_DATOS, "glosario.txt")
+    if os.path.exists(ruta_glosario):
+        try:
+            with open(ruta_glosario, "r", encoding="utf-8") as f:
+                contenido = f.read()
+            print(f"✅ Glosario original cargado: {len(contenido)} caracteres, {len(contenido.split('**'))} términos aprox.")
+            return contenido
+        except Exception as e:
+            print(f"❌ Error cargando glosario: {e}")
+            return ""
+    else:
+        print(f"⚠️ Glosario no encontrado en: {ruta_glosario}")
+        return ""
+
+def cargar_reglamento_emergencia():
+    """
+    Carga el reglamento de emergencia JP-RP-41
+
+    Returns:
+        str: Campo 'analisis_completo' del JSON o cadena vacía
+    """
+    ruta_emergencia = os.path.join(DIRECTORIO_DATOS, "reglamento_emergencia_jp41_chatbot_20250731_155845.json")
+    if os.path.exists(ruta_emergencia):
+        try:
+            with open(ruta_emergencia, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get('analisis_completo', '')
+        except Exception as e:
+            print(f"❌ Error cargando reglamento emergencia: {e}")
+            return ""
+    return ""
+
+def cargar_tomo_10_conservacion_historica():
+    """
+    Carga la información completa del Tomo 10 de Conservación Histórica
+
+    Returns:
+        str: Contenido del archivo o cadena vacía si no existe
+    """
+    ruta_tomo10 = os.path.join(DIRECTORIO_DATOS, "Tomo_10_Conservacion_Historica.txt")
+    if os.path.exists(ruta_tomo10):
+        try:
+            with open(ruta_tomo10, "r", encoding="utf-8") as f:
+                contenido = f.read()
+            print(f"✅ Tomo 10 Conservación Histórica cargado: {len(contenido)} caracteres")
+            return contenido
+        except Exception as e:
+            print(f"❌ Error cargando Tomo 10: {e}")
+            return ""
+    else:
+        print(f"⚠️ Tomo 10 no encontrado en: {ruta_tomo10}")
+        return ""
@@ -4,6 +4,9 @@ Utilidades para integración de la API de Claude (Anthropic) en JP_IA
 
 import anthropic
 
+from utils.pasarela_llm import CircuitoAbierto
+from utils.transmision import crear_mensaje
+
 def claude_chat_completion(client, messages, temperature=0.3, max_tokens=1000, model="claude-3-sonnet-20240229"):
     """
     Wrapper para la API de Claude que convierte el formato OpenAI al formato Claude
@@ -63,7 +66,7 @@ def claude_chat_completion(client, messages, temperature=0.3, max_tokens=1000, m
             params["system"] = system_prompt
             
         # Llamar a la API de Claude
-        response = client.messages.create(**params)
+        response = crear_mensaje(client, **params)
         
         # Convertir la respuesta de Claude al formato similar a OpenAI
         mock_openai_response = type('MockResponse', (), {})()
@@ -75,13 +78,17 @@ def claude_chat_completion(client, messages, temperature=0.3, max_tokens=1000, m
         
         return mock_openai_response
         
+    except CircuitoAbierto:
+        # El servicio está caído: ni Haiku responderá; quien llama usa el modo de emergencia
+        raise
     except Exception as e:
+        # Los errores transitorios ya se reintentaron en la pasarela con backoff.
         # Registrar el error y reintentarlo con Claude Haiku (modelo más pequeño y económico)
         print(f"Error al llamar a Claude: {e}. Reintentando con Claude Haiku...")
         try:
             # Cambiar al modelo más económico y mantener los mismos parámetros
             params["model"] = "claude-3-haiku-20240307"
-            response = client.messages.create(**params)
+            response = crear_mensaje(client, **params)
             
             # Convertir la respuesta de Claude al formato similar a OpenAI
             mock_openai_response = type('MockResponse', (), {})()
@@ -93,6 +100,8 @@ def claude_chat_completion(client, messages, temperature=0.3, max_tokens=1000, m
             
             return mock_openai_response
             
+        except CircuitoAbierto:
+            raise
         except Exception as e2:
             print(f"Error con Claude Haiku: {e2}")
             # Crear una respuesta mock para evitar errores críticos
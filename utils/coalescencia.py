@@ -0,0 +1,252 @@
+"""
+Coalescencia de consultas idénticas en curso (single-flight)
+
+Cuando un grupo comparte la misma pregunta, llegan varias copias en pocos
+segundos y cada una ejecutaría el pipeline completo. El primer hilo que pide
+una clave es el líder y la calcula; los demás hilos del proceso esperan su
+resultado (o su excepción) en un Event.
+
+Entre workers de gunicorn el líder toma además un arriendo en SQLite (mismo
+archivo que la caché de respuestas). Un worker que encuentra el arriendo
+ocupado consulta la caché hasta que aparece la respuesta guardada; si el
+arriendo se libera sin respuesta (p. ej. no era cacheable) o vence, calcula
+por su cuenta.
+
+Las esperas de un seguidor no pasan del plazo de su consulta
+(utils/plazo.py): si el plazo vence esperando, la etapa 'coalescencia' se
+registra como omitida y se lanza PlazoAgotado, sin recalcular sin tiempo.
+
+Variables de entorno:
+    COALESCENCIA=0                       Desactiva la coalescencia
+    COALESCENCIA_ESPERA_SEGUNDOS=90      Espera máxima de un seguidor (y vigencia del arriendo)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from utils.cache_respuestas import conexion_sqlite, ruta_cache_por_defecto
+from utils.configuracion import bandera_entorno, decimal_entorno
+from utils.plazo import PlazoAgotado, plazo_actual
+
+INTERVALO_SONDEO = 0.25
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS arriendos (
+    clave TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    expira REAL NOT NULL
+);
+"""
+
+
+class _Vuelo:
+    """Cálculo en curso de una clave dentro del proceso"""
+
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class Coalescedor:
+    """Agrupa cálculos idénticos concurrentes en hilos y procesos"""
+
+    def __init__(self, ruta, espera_segundos=90.0):
+        self.ruta = ruta
+        self.espera_segundos = espera_segundos
+
+        self._vuelos = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.contadores = {
+            'lideres': 0,
+            'seguidores_hilo': 0,
+            'seguidores_proceso': 0,
+            'esperas_agotadas': 0,
+            'errores_sqlite': 0,
+        }
+
+    def _conexion(self):
+        return conexion_sqlite(self._local, self.ruta, _ESQUEMA)
+
+    def _espera_maxima(self):
+        """Segundos que puede esperar un seguidor: COALESCENCIA_ESPERA_SEGUNDOS sin pasar del plazo"""
+        plazo = plazo_actual()
+        if plazo is None:
+            return self.espera_segundos
+        return min(self.espera_segundos, plazo.restante())
+
+    def _agotar_plazo(self):
+        """Si el plazo de la consulta venció esperando, registra la etapa omitida y lanza PlazoAgotado"""
+        plazo = plazo_actual()
+        if plazo is not None and plazo.vencido():
+            self._contar('esperas_agotadas')
+            plazo.omitir("coalescencia")
+            raise PlazoAgotado("Plazo de la consulta agotado esperando una consulta idéntica en curso")
+
+    def _contar(self, contador):
+        with self._lock:
+            self.contadores[contador] += 1
+
+    def _error_sqlite(self, accion, error):
+        self._contar('errores_sqlite')
+        print(f"⚠️ Coalescencia: error {accion} ({error})")
+
+    def _tomar_arriendo(self, clave):
+        """Intenta tomar el arriendo de la clave (True si otro proceso no lo tiene)"""
+        ahora = time.time()
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute("DELETE FROM arriendos WHERE clave = ? AND expira < ?", (clave, ahora))
+                cursor = conexion.execute(
+                    "INSERT OR IGNORE INTO arriendos (clave, pid, expira) VALUES (?, ?, ?)",
+                    (clave, os.getpid(), ahora + self.espera_segundos)
+                )
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            # Sin arriendo compartido se calcula igual: solo se pierde la coalescencia entre workers
+            self._error_sqlite("tomando arriendo", e)
+            return True
+
+    def _arriendo_ocupado(self, clave):
+        try:
+            fila = self._conexion().execute(
+                "SELECT expira FROM arriendos WHERE clave = ?", (clave,)
+            ).fetchone()
+            return fila is not None and fila[0] >= time.time()
+        except sqlite3.Error as e:
+            self._error_sqlite("consultando arriendo", e)
+            return False
+
+    def _liberar_arriendo(self, clave):
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute("DELETE FROM arriendos WHERE clave = ? AND pid = ?", (clave, os.getpid()))
+        except sqlite3.Error as e:
+            self._error_sqlite("liberando arriendo", e)
+
+    def _esperar_otro_proceso(self, clave, consultar):
+        """
+        Espera a que el worker que tiene el arriendo guarde la respuesta
+
+        Returns:
+            Respuesta guardada o None si hay que calcularla aquí
+        """
+        limite = time.monotonic() + self._espera_maxima()
+        while time.monotonic() < limite:
+            time.sleep(min(INTERVALO_SONDEO, max(0.0, limite - time.monotonic())))
+            valor = consultar()
+            if valor is not None:
+                return valor
+            if not self._arriendo_ocupado(clave):
+                # El líder terminó sin dejar respuesta o murió: un último intento antes de calcular
+                return consultar()
+        self._agotar_plazo()
+        self._contar('esperas_agotadas')
+        return None
+
+    def ejecutar(self, clave, calcular, consultar=None):
+        """
+        Calcula una sola vez los pedidos concurrentes de la misma clave
+
+        Args:
+            clave (str): Identificador de la pregunta normalizada y su ruta
+            calcular: Función sin argumentos que produce (y guarda) la respuesta
+            consultar: Función sin argumentos que lee la respuesta ya guardada por
+                       otro worker; sin ella la coalescencia es solo entre hilos
+
+        Returns:
+            Resultado del cálculo propio o del líder
+
+        Raises:
+            PlazoAgotado: Si el plazo de la consulta venció esperando al líder
+        """
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self.contadores['lideres'] += 1
+            else:
+                self.contadores['seguidores_hilo'] += 1
+
+        if not lider:
+            print("🔗 Consulta idéntica en curso: esperando su resultado")
+            if vuelo.terminado.wait(self._espera_maxima()):
+                if isinstance(vuelo.error, PlazoAgotado):
+                    # Se agotó el plazo del líder, no el de este seguidor
+                    self._agotar_plazo()
+                    return calcular()
+                if vuelo.error is not None:
+                    raise vuelo.error
+                return vuelo.resultado
+            self._agotar_plazo()
+            self._contar('esperas_agotadas')
+            return calcular()
+
+        arriendo = False
+        try:
+            if consultar is not None:
+                arriendo = self._tomar_arriendo(clave)
+                if not arriendo:
+                    self._contar('seguidores_proceso')
+                    print("🔗 Consulta idéntica en curso en otro worker: esperando su respuesta")
+                    valor = self._esperar_otro_proceso(clave, consultar)
+                    if valor is not None:
+                        vuelo.resultado = valor
+                        return valor
+            vuelo.resultado = calcular()
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            if arriendo:
+                self._liberar_arriendo(clave)
+            with self._lock:
+                del self._vuelos[clave]
+            vuelo.terminado.set()
+
+    def estadisticas(self):
+        """Contadores del proceso y cálculos en curso"""
+        estadisticas = dict(self.contadores)
+        estadisticas['en_curso'] = len(self._vuelos)
+        return estadisticas
+
+
+class CoalescenciaDesactivada:
+    """Misma interfaz que Coalescedor sin agrupar nada (COALESCENCIA=0)"""
+
+    def ejecutar(self, clave, calcular, consultar=None):
+        return calcular()
+
+    def estadisticas(self):
+        return {'activa': False}
+
+
+_coalescedor = None
+_coalescedor_lock = threading.Lock()
+
+def obtener_coalescedor():
+    """
+    Coalescedor del proceso
+
+    Returns:
+        Coalescedor: Agrupador de consultas idénticas en curso
+    """
+    global _coalescedor
+    if _coalescedor is None:
+        with _coalescedor_lock:
+            if _coalescedor is None:
+                if not bandera_entorno("COALESCENCIA"):
+                    _coalescedor = CoalescenciaDesactivada()
+                else:
+                    _coalescedor = Coalescedor(
+                        ruta=ruta_cache_por_defecto(),
+                        espera_segundos=decimal_entorno("COALESCENCIA_ESPERA_SEGUNDOS", 90.0),
+                    )
+    return _coalescedor
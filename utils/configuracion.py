@@ -0,0 +1,37 @@
+"""
+Lectura de variables de entorno opcionales con valor por defecto
+"""
+
+import os
+
+
+def entero_entorno(nombre, predeterminado):
+    """Entero de una variable de entorno (el valor por defecto si falta o es inválido)"""
+    valor = os.getenv(nombre)
+    if valor is None or not valor.strip():
+        return predeterminado
+    try:
+        return int(valor)
+    except ValueError:
+        print(f"⚠️ {nombre} inválido: {valor}")
+        return predeterminado
+
+
+def decimal_entorno(nombre, predeterminado):
+    """Número decimal de una variable de entorno (el valor por defecto si falta o es inválido)"""
+    valor = os.getenv(nombre)
+    if valor is None or not valor.strip():
+        return predeterminado
+    try:
+        return float(valor)
+    except ValueError:
+        print(f"⚠️ {nombre} inválido: {valor}")
+        return predeterminado
+
+
+def bandera_entorno(nombre, predeterminado=True):
+    """Interruptor de una variable de entorno: 0/false/no lo desactivan, 1/true/si lo activan"""
+    valor = os.getenv(nombre)
+    if valor is None or not valor.strip():
+        return predeterminado
+    return valor.strip().lower() not in ("0", "false", "no", "off")
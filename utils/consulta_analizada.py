@@ -0,0 +1,168 @@
+"""
+Análisis de la consulta compartido por todas las etapas de una solicitud
+
+Antes, cada etapa volvía a pasar el mensaje a minúsculas, a dividirlo y a
+buscar 'tomo\\s*(\\d+)' (procesar_mensaje, detectar_consulta_especifica,
+procesar_consulta_especifica, extraer_numero_tomo, extraer_terminos_inteligente,
+buscar_informacion_relevante, evaluar_relevancia_tomo, las claves de caché).
+ConsultaAnalizada hace ese trabajo una vez:
+
+- texto en minúsculas y plegado (sin acentos), tokens y forma canónica
+  (la misma que usan las claves de la caché de respuestas) con su huella;
+- términos sin palabras vacías, y corregidos ortográficamente;
+- intenciones y números de tomo del detector (utils/detector_intenciones.py);
+- términos candidatos para el glosario.
+
+resolver_mensaje la fija para el contexto de la solicitud con
+con_consulta(); las tareas del pool la heredan con el contexto. Las
+funciones siguen recibiendo el texto y obtienen su análisis con
+analizar_consulta(texto): dentro de la solicitud es el mismo objeto y
+fuera de ella (tareas de fondo, otros endpoints) se calcula al momento.
+Las partes costosas (corrector, glosario) se calculan la primera vez que
+alguna etapa las pide.
+"""
+
+import hashlib
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cached_property
+
+from utils.detector_intenciones import obtener_detector
+from utils.procesador_texto import PALABRAS_VACIAS, normalizar
+
+_PATRON_TOKEN = re.compile(r"\w+")
+
+# Preguntas de definición: "qué es X", "define X", "X significa"...
+PATRONES_DEFINICION = [
+    r'qu[eé]\s+es\s+(?:un[a]?\s+)?(.+?)[\?]?',
+    r'define\s+(.+?)[\?]?',
+    r'definici[oó]n\s+de\s+(.+?)[\?]?',
+    r'significado\s+de\s+(.+?)[\?]?',
+    r'explica\s+(.+?)[\?]?',
+    r'explícame\s+(.+?)[\?]?',
+    r'(.+?)\s+significa[\?]?'
+]
+PALABRAS_ELIMINAR_DEFINICION = ['qué es', 'que es', 'significa', 'es', 'un', 'una', 'el', 'la', 'los', 'las']
+
+_consulta = ContextVar("consulta_analizada", default=None)
+
+
+class ConsultaAnalizada:
+    """Formas normalizadas, términos, intenciones y tomos de una consulta"""
+
+    def __init__(self, texto):
+        self.texto = texto
+        self.minusculas = texto.lower()
+        self.normalizado = normalizar(texto)
+        self.tokens = tuple(_PATRON_TOKEN.findall(self.normalizado))
+        self.forma_canonica = " ".join(self.tokens)
+        self.huella = hashlib.sha256(self.forma_canonica.encode("utf-8")).hexdigest()
+
+    @cached_property
+    def terminos(self):
+        """Términos significativos (sin palabras vacías, 3+ caracteres, sin repetir)"""
+        terminos = []
+        for token in self.tokens:
+            if len(token) >= 3 and token not in PALABRAS_VACIAS and token not in terminos:
+                terminos.append(token)
+        return terminos
+
+    @cached_property
+    def terminos_corregidos(self):
+        """Términos con su corrección ortográfica contra el vocabulario del corpus
+
+        Cada término original se conserva delante de su corrección: una
+        palabra bien escrita que el corpus no usa ("gasolinera") también se
+        "corrige" ("gasolina"), y la búsqueda debe seguir encontrándola.
+        """
+        from utils.corrector_ortografico import obtener_corrector
+        corrector = obtener_corrector()
+        terminos = []
+        for termino in self.terminos:
+            for variante in (termino, corrector.corregir(termino)):
+                if variante not in terminos:
+                    terminos.append(variante)
+        return terminos
+
+    @cached_property
+    def intenciones(self):
+        """AnalisisIntenciones del detector (una pasada por el texto plegado)"""
+        return obtener_detector().analizar(self.texto, self.normalizado)
+
+    def tiene(self, *intenciones):
+        """True si la consulta activó alguna de las intenciones"""
+        return self.intenciones.tiene(*intenciones)
+
+    @property
+    def tomos(self):
+        return self.intenciones.tomos
+
+    @property
+    def tomo(self):
+        """Primer número de tomo mencionado (None si no hay)"""
+        return self.intenciones.tomo
+
+    @cached_property
+    def candidatos_glosario(self):
+        """
+        Términos a buscar en el glosario: lo que sigue a "qué es", "define"...
+        (y sus palabras sueltas si es compuesto) o, si no hay patrón, hasta
+        3 palabras largas de la pregunta
+        """
+        terminos = []
+        for patron in PATRONES_DEFINICION:
+            match = re.search(patron, self.minusculas)
+            if not match:
+                continue
+            termino = match.group(1).strip()
+            for palabra in PALABRAS_ELIMINAR_DEFINICION:
+                if termino.startswith(palabra + ' '):
+                    termino = termino[len(palabra):].strip()
+            if termino and len(termino) > 2:
+                terminos.append(termino)
+                # Si es un término compuesto, también sus palabras individuales
+                if ' ' in termino:
+                    terminos.extend(palabra for palabra in termino.split() if len(palabra) > 3)
+
+        if not terminos:
+            terminos.extend([palabra for palabra in self.texto.split() if len(palabra) > 3][:3])
+        return terminos
+
+
+def consulta_actual():
+    """ConsultaAnalizada de la solicitud en curso (None fuera de una solicitud)"""
+    return _consulta.get()
+
+
+@contextmanager
+def con_consulta(consulta):
+    """
+    Fija el análisis de la consulta para el contexto actual
+
+    Args:
+        consulta (ConsultaAnalizada): Análisis de la pregunta de la solicitud
+    """
+    token = _consulta.set(consulta)
+    try:
+        yield consulta
+    finally:
+        _consulta.reset(token)
+
+
+def analizar_consulta(texto):
+    """
+    Análisis de un texto: el de la solicitud en curso si es la misma pregunta
+
+    Args:
+        texto (str): Pregunta (o una ConsultaAnalizada, que se devuelve tal cual)
+
+    Returns:
+        ConsultaAnalizada: Análisis compartido o recién calculado
+    """
+    if isinstance(texto, ConsultaAnalizada):
+        return texto
+    actual = _consulta.get()
+    if actual is not None and (actual.texto is texto or actual.texto == texto):
+        return actual
+    return ConsultaAnalizada(texto)
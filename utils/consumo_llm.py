@@ -0,0 +1,224 @@
+"""
+Consumo de tokens y costo estimado de las llamadas al modelo
+
+Cada llamada de la pasarela (utils/pasarela_llm.py) se anota con su modelo,
+los tokens de entrada y salida que informa la API (campo usage), su
+duración y la ruta del pipeline que la hizo:
+
+- ruta_llm("glosario") marca, como bloque with o decorador, las llamadas
+  hechas dentro; las tareas del pool heredan la ruta con el contexto de la
+  consulta. Las llamadas fuera de cualquier ruta se anotan como 'sin_ruta'.
+- registrar_uso() acumula en un UsoLLM las llamadas de una consulta: el
+  registro de solicitudes guarda el detalle de cada llamada y los totales
+  por ruta. Las llamadas que fallan se cuentan aparte (anotar_falla): una
+  consulta con alguna falla quedó degradada y su respuesta no se cachea.
+- Cada llamada suma además a los contadores de /metrics por modelo y ruta
+  (tokens, costo, duración); resumen_consumo() los agrega para /estadisticas.
+
+El costo es una estimación con los precios de lista por millón de tokens de
+PRECIOS_POR_MODELO; un modelo que no está en la tabla cuenta como costo 0.
+"""
+
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.metricas import obtener_metricas
+
+# USD por millón de tokens (entrada, salida)
+PRECIOS_POR_MODELO = {
+    "claude-3-haiku-20240307": (0.25, 1.25),
+    "claude-3-sonnet-20240229": (3.0, 15.0),
+}
+
+SIN_RUTA = "sin_ruta"
+
+LlamadaLLM = namedtuple("LlamadaLLM", "modelo ruta tokens_entrada tokens_salida segundos costo_usd")
+
+_ruta = ContextVar("ruta_llm", default=None)
+_uso = ContextVar("uso_llm", default=None)
+
+
+def costo_usd(modelo, tokens_entrada, tokens_salida):
+    """Costo estimado de una llamada según PRECIOS_POR_MODELO (0 si el modelo no tiene precio)"""
+    precio_entrada, precio_salida = PRECIOS_POR_MODELO.get(modelo, (0.0, 0.0))
+    return (tokens_entrada * precio_entrada + tokens_salida * precio_salida) / 1_000_000
+
+
+def ruta_actual():
+    """Ruta del pipeline a la que se atribuyen las llamadas del contexto actual"""
+    return _ruta.get() or SIN_RUTA
+
+
+@contextmanager
+def ruta_llm(ruta):
+    """
+    Atribuye a una ruta del pipeline las llamadas al modelo de un bloque o función
+
+    Args:
+        ruta (str): Etiqueta de la ruta ('glosario', 'hibrida-sintesis', ...)
+    """
+    token = _ruta.set(ruta)
+    try:
+        yield
+    finally:
+        _ruta.reset(token)
+
+
+def _totales(llamadas):
+    return {
+        'llamadas': len(llamadas),
+        'tokens_entrada': sum(l.tokens_entrada for l in llamadas),
+        'tokens_salida': sum(l.tokens_salida for l in llamadas),
+        'segundos': round(sum(l.segundos for l in llamadas), 3),
+        'costo_usd': round(sum(l.costo_usd for l in llamadas), 6),
+    }
+
+
+class UsoLLM:
+    """Llamadas al modelo de una consulta (se anotan desde varios hilos)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.detalle = []
+        self.fallidas = 0
+
+    def anotar(self, llamada):
+        with self._lock:
+            self.detalle.append(llamada)
+
+    def anotar_falla(self):
+        with self._lock:
+            self.fallidas += 1
+
+    @property
+    def degradada(self):
+        """True si alguna llamada al modelo de la consulta falló (la respuesta usó un respaldo)"""
+        return self.fallidas > 0
+
+    @property
+    def llamadas(self):
+        return len(self.detalle)
+
+    @property
+    def tokens_entrada(self):
+        return sum(l.tokens_entrada for l in self.detalle)
+
+    @property
+    def tokens_salida(self):
+        return sum(l.tokens_salida for l in self.detalle)
+
+    @property
+    def costo_usd(self):
+        return sum(l.costo_usd for l in self.detalle)
+
+    def como_dict(self):
+        """Totales de la consulta, por ruta y el detalle de cada llamada (para el registro)"""
+        with self._lock:
+            detalle = list(self.detalle)
+        por_ruta = {}
+        for llamada in detalle:
+            por_ruta.setdefault(llamada.ruta, []).append(llamada)
+        totales = _totales(detalle)
+        return {
+            'llamadas_llm': totales['llamadas'],
+            'llamadas_llm_fallidas': self.fallidas,
+            'tokens_entrada': totales['tokens_entrada'],
+            'tokens_salida': totales['tokens_salida'],
+            'costo_usd': totales['costo_usd'],
+            'consumo_por_ruta': {ruta: _totales(llamadas) for ruta, llamadas in por_ruta.items()},
+            'detalle_llm': [llamada._asdict() for llamada in detalle],
+        }
+
+
+@contextmanager
+def registrar_uso():
+    """
+    Acumula en un UsoLLM las llamadas al modelo hechas en este contexto
+    (incluidas las fuentes del pool, que heredan el contexto de la consulta)
+    """
+    uso = UsoLLM()
+    token = _uso.set(uso)
+    try:
+        yield uso
+    finally:
+        _uso.reset(token)
+
+
+def uso_actual():
+    """UsoLLM de la consulta en curso, o None fuera de registrar_uso()"""
+    return _uso.get()
+
+
+def anotar_falla():
+    """Cuenta una llamada fallida en el UsoLLM de la consulta (la marca como degradada)"""
+    uso_consulta = _uso.get()
+    if uso_consulta is not None:
+        uso_consulta.anotar_falla()
+
+
+def anotar_llamada(mensaje, modelo, segundos):
+    """
+    Anota una llamada terminada en el UsoLLM de la consulta y en los contadores de /metrics
+
+    Args:
+        mensaje: Message de Anthropic (su 'usage' y 'model')
+        modelo (str): Modelo pedido (si la respuesta no lo informa)
+        segundos (float): Duración de la llamada, incluida la espera de turno
+
+    Returns:
+        LlamadaLLM: La llamada anotada
+    """
+    uso = getattr(mensaje, "usage", None)
+    modelo = getattr(mensaje, "model", None) or modelo or "desconocido"
+    entrada = getattr(uso, "input_tokens", 0) or 0
+    salida = getattr(uso, "output_tokens", 0) or 0
+    ruta = ruta_actual()
+    llamada = LlamadaLLM(modelo, ruta, entrada, salida, round(segundos, 3), costo_usd(modelo, entrada, salida))
+
+    uso_consulta = _uso.get()
+    if uso_consulta is not None:
+        uso_consulta.anotar(llamada)
+
+    metricas = obtener_metricas()
+    metricas.contar("jp_llm_tokens_total", entrada, modelo=modelo, ruta=ruta, direccion="entrada")
+    metricas.contar("jp_llm_tokens_total", salida, modelo=modelo, ruta=ruta, direccion="salida")
+    metricas.contar("jp_llm_costo_usd_total", llamada.costo_usd, modelo=modelo, ruta=ruta)
+    return llamada
+
+
+def resumen_consumo():
+    """
+    Consumo acumulado de todos los workers por ruta y modelo
+
+    Returns:
+        dict: {ruta: {modelo: {llamadas, errores, tokens_entrada, tokens_salida,
+              costo_usd, segundos_medios}}}
+    """
+    metricas = obtener_metricas()
+    resumen = {}
+
+    def entrada(etiquetas):
+        return resumen.setdefault(etiquetas.get('ruta', SIN_RUTA), {}).setdefault(
+            etiquetas.get('modelo', "desconocido"),
+            {'llamadas': 0, 'errores': 0, 'tokens_entrada': 0, 'tokens_salida': 0, 'costo_usd': 0.0, 'segundos': 0.0}
+        )
+
+    for etiquetas, histograma in metricas.series("jp_llm_segundos"):
+        if etiquetas.get('resultado') == "ok":
+            entrada(etiquetas)['llamadas'] += histograma[-1]
+            entrada(etiquetas)['segundos'] += histograma[-2]
+        else:
+            entrada(etiquetas)['errores'] += histograma[-1]
+    for etiquetas, valor in metricas.series("jp_llm_tokens_total"):
+        entrada(etiquetas)[f"tokens_{etiquetas.get('direccion')}"] += valor
+    for etiquetas, valor in metricas.series("jp_llm_costo_usd_total"):
+        entrada(etiquetas)['costo_usd'] += valor
+
+    for modelos in resumen.values():
+        for consumo in modelos.values():
+            segundos = consumo.pop('segundos')
+            consumo['costo_usd'] = round(consumo['costo_usd'], 6)
+            consumo['segundos_medios'] = round(segundos / consumo['llamadas'], 3) if consumo['llamadas'] else 0.0
+    return resumen
@@ -0,0 +1,476 @@
+"""
+Historial de las conversaciones generales, acotado y compartido por los workers
+
+Sustituye al diccionario global `conversaciones` de app.py, que guardaba por
+cada sesión el prompt de sistema (~3 KB) y todos los turnos sin recortarlos
+nunca, y que además era distinto en cada worker de gunicorn.
+
+- El prompt de sistema es el mismo para todas: no se guarda por conversación.
+- Cuando el historial supera un umbral de tokens, los turnos antiguos se
+  resumen (Haiku) en un texto que se guarda con la conversación y viaja en
+  el prompt de sistema; los turnos recientes se conservan literales. El
+  resumen se hace en un hilo de fondo después de guardar la respuesta, sin
+  sumar latencia a la consulta.
+- Además, cada historial se recorta por tokens estimados (se descartan los
+  turnos más antiguos) al guardarlo, por si el resumen no alcanza.
+- Las conversaciones inactivas expiran (TTL) y, si hay demasiadas, se
+  descartan las usadas hace más tiempo (LRU).
+
+Dos almacenes con la misma interfaz (historial, agregar, borrar, estadisticas):
+
+- AlmacenConversacionesSQLite: tabla en el archivo SQLite de las cachés,
+  compartida por los workers (por defecto).
+- AlmacenConversacionesMemoria: LRU por proceso, para un solo worker.
+
+Ambos reparten las conversaciones en franjas con su propio lock, de modo
+que los hilos de un worker solo se bloquean entre sí cuando tocan la misma
+franja.
+
+Variables de entorno:
+    CONVERSACIONES_ALMACEN=sqlite         sqlite (compartido) | memoria (por proceso)
+    CONVERSACIONES_TTL_HORAS=12           Inactividad tras la que se descarta una conversación
+    CONVERSACIONES_MAX=2000               Conversaciones guardadas como máximo
+    CONVERSACIONES_MAX_TOKENS=3000        Tokens de historial que se conservan por conversación
+    CONVERSACIONES_RESUMEN=1              Resume los turnos antiguos (0 = solo recorte)
+    CONVERSACIONES_UMBRAL_RESUMEN=1500    Tokens de historial a partir de los que se resume
+    CONVERSACIONES_TURNOS_RECIENTES=4     Turnos que se conservan literales al resumir
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.configuracion import bandera_entorno, decimal_entorno, entero_entorno
+from utils.consumo_llm import ruta_llm
+from utils.empaquetador_contexto import estimar_tokens
+
+FRANJAS = 16
+
+Historial = namedtuple("Historial", "resumen turnos")
+HISTORIAL_VACIO = Historial("", [])
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS conversaciones (
+    id TEXT PRIMARY KEY,
+    resumen TEXT NOT NULL DEFAULT '',
+    turnos TEXT NOT NULL,
+    ultimo_uso REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversaciones_ultimo_uso ON conversaciones (ultimo_uso);
+"""
+
+
+def recortar_historial(turnos, max_tokens):
+    """
+    Turnos más recientes cuyo total cabe en max_tokens
+
+    El historial recortado empieza siempre con un turno del usuario (la API
+    no acepta una respuesta del asistente como primer mensaje).
+
+    Args:
+        turnos (list): [{'role', 'content'}] en orden
+        max_tokens (int): Presupuesto del historial
+
+    Returns:
+        list: Sufijo de turnos dentro del presupuesto
+    """
+    usados = 0
+    inicio = len(turnos)
+    while inicio > 0:
+        tokens = estimar_tokens(turnos[inicio - 1]["content"])
+        if usados + tokens > max_tokens:
+            break
+        usados += tokens
+        inicio -= 1
+    while inicio < len(turnos) and turnos[inicio]["role"] != "user":
+        inicio += 1
+    return turnos[inicio:]
+
+
+def tokens_turnos(turnos):
+    return sum(estimar_tokens(turno["content"]) for turno in turnos)
+
+
+@ruta_llm("resumen-conversacion")
+def resumir_conversacion(resumen_previo, turnos):
+    """
+    Resume los turnos antiguos de una conversación (con el resumen anterior, si lo hay)
+
+    Args:
+        resumen_previo (str): Resumen acumulado hasta ahora
+        turnos (list): Turnos que se van a compactar
+
+    Returns:
+        str: Nuevo resumen
+    """
+    from utils.pasarela_llm import obtener_pasarela
+
+    transcripcion = "\n\n".join(
+        f"{'USUARIO' if turno['role'] == 'user' else 'ASISTENTE'}: {turno['content']}" for turno in turnos
+    )
+    prompt = f"""Resume esta conversación entre un usuario y Agente de Planificación para poder continuarla.
+
+RESUMEN ANTERIOR:
+{resumen_previo or "(ninguno)"}
+
+TURNOS NUEVOS:
+{transcripcion}
+
+INSTRUCCIONES:
+- Integra el resumen anterior y los turnos nuevos en un solo resumen
+- Conserva los datos concretos del usuario (proyecto, municipio, lote, trámites) y las preguntas pendientes
+- Conserva las secciones y cifras citadas en las respuestas
+- Máximo 200 palabras, sin saludos ni comentarios
+
+RESUMEN:"""
+    response = obtener_pasarela().messages.create(
+        model="claude-3-haiku-20240307",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.0,
+        max_tokens=400
+    )
+    return response.content[0].text.strip()
+
+
+class _ResumenEnSegundoPlano:
+    """
+    Compactación de los historiales largos en un hilo de fondo del proceso
+
+    Los almacenes implementan _leer_historial(conversation_id) y
+    _reemplazar(conversation_id, compactados, resumen), que aplica el
+    resumen solo si el historial todavía empieza por los turnos compactados
+    (otra respuesta o el otro worker pudo cambiarlo mientras tanto).
+    """
+
+    def _configurar_resumen(self, resumir, umbral_resumen, turnos_recientes):
+        self.resumir = resumir
+        self.umbral_resumen = umbral_resumen
+        self.turnos_recientes = turnos_recientes
+        self._pendientes = set()
+        self._pendientes_lock = threading.Lock()
+        self._ejecutor = None
+        self._pid = None
+        for contador in ('resumenes', 'resumenes_descartados', 'errores_resumen'):
+            self.contadores[contador] = 0
+
+    def _ejecutor_proceso(self):
+        # El hilo de fondo no sobrevive al fork: cada worker crea el suyo
+        if self._pid != os.getpid():
+            self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="resumen-conversacion")
+            self._pid = os.getpid()
+        return self._ejecutor
+
+    def _programar_resumen(self, conversation_id, turnos):
+        """Encola la compactación si el historial pasó el umbral (una por conversación a la vez)"""
+        if self.resumir is None or tokens_turnos(turnos) <= self.umbral_resumen:
+            return
+        with self._pendientes_lock:
+            if conversation_id in self._pendientes:
+                return
+            self._pendientes.add(conversation_id)
+            ejecutor = self._ejecutor_proceso()
+        ejecutor.submit(self._compactar, conversation_id)
+
+    def _compactar(self, conversation_id):
+        try:
+            resumen, turnos = self._leer_historial(conversation_id)
+            # Los turnos recientes quedan literales y el historial debe seguir empezando por el usuario
+            corte = len(turnos) - max(1, self.turnos_recientes)
+            while corte > 0 and turnos[corte]["role"] != "user":
+                corte -= 1
+            if corte < 2:
+                return
+            compactados = turnos[:corte]
+            nuevo_resumen = self.resumir(resumen, compactados)
+            if not nuevo_resumen:
+                return
+            if self._reemplazar(conversation_id, compactados, nuevo_resumen):
+                self.contadores['resumenes'] += 1
+                print(f"🗜️ Conversación resumida: {len(compactados)} turnos "
+                      f"({tokens_turnos(compactados)} tokens) -> {estimar_tokens(nuevo_resumen)} tokens")
+            else:
+                self.contadores['resumenes_descartados'] += 1
+        except Exception as e:
+            self.contadores['errores_resumen'] += 1
+            print(f"⚠️ Conversaciones: error resumiendo ({e})")
+        finally:
+            with self._pendientes_lock:
+                self._pendientes.discard(conversation_id)
+
+
+def _franja(conversation_id):
+    """Índice de la franja de una conversación (estable entre procesos)"""
+    return zlib.crc32(conversation_id.encode("utf-8")) % FRANJAS
+
+
+class AlmacenConversacionesMemoria(_ResumenEnSegundoPlano):
+    """Historiales en un LRU con TTL por proceso, repartido en franjas con su propio lock"""
+
+    def __init__(self, ttl_segundos=12 * 3600, max_conversaciones=2000, max_tokens=3000,
+                 resumir=None, umbral_resumen=1500, turnos_recientes=4):
+        self.ttl_segundos = ttl_segundos
+        self.max_tokens = max_tokens
+        self._max_por_franja = max(1, max_conversaciones // FRANJAS)
+        self._franjas = [OrderedDict() for _ in range(FRANJAS)]
+        self._locks = [threading.Lock() for _ in range(FRANJAS)]
+        self.contadores = {'expiradas': 0, 'desalojadas': 0, 'turnos_recortados': 0}
+        self._configurar_resumen(resumir, umbral_resumen, turnos_recientes)
+
+    def historial(self, conversation_id):
+        """
+        Resumen y turnos guardados de una conversación
+
+        Returns:
+            Historial: (resumen, [{'role', 'content'}]); vacío si no existe o expiró
+        """
+        indice = _franja(conversation_id)
+        with self._locks[indice]:
+            franja = self._franjas[indice]
+            entrada = franja.get(conversation_id)
+            if entrada is None:
+                return HISTORIAL_VACIO
+            ultimo_uso, resumen, turnos = entrada
+            if ultimo_uso + self.ttl_segundos < time.time():
+                del franja[conversation_id]
+                self.contadores['expiradas'] += 1
+                return HISTORIAL_VACIO
+            return Historial(resumen, list(turnos))
+
+    _leer_historial = historial
+
+    def agregar(self, conversation_id, *turnos):
+        """Añade turnos ({'role', 'content'}) al final del historial y lo recorta al presupuesto"""
+        indice = _franja(conversation_id)
+        ahora = time.time()
+        with self._locks[indice]:
+            franja = self._franjas[indice]
+            entrada = franja.pop(conversation_id, None)
+            if entrada is None or entrada[0] + self.ttl_segundos < ahora:
+                entrada = (ahora, "", [])
+            _, resumen, anteriores = entrada
+            combinados = anteriores + list(turnos)
+            recortados = recortar_historial(combinados, self.max_tokens)
+            self.contadores['turnos_recortados'] += len(combinados) - len(recortados)
+            franja[conversation_id] = (ahora, resumen, recortados)
+
+            # Las de delante son las usadas hace más tiempo: primero caen las expiradas, luego las sobrantes
+            while franja:
+                ultimo_uso = next(iter(franja.values()))[0]
+                if ultimo_uso + self.ttl_segundos >= ahora:
+                    break
+                franja.popitem(last=False)
+                self.contadores['expiradas'] += 1
+            while len(franja) > self._max_por_franja:
+                franja.popitem(last=False)
+                self.contadores['desalojadas'] += 1
+
+        self._programar_resumen(conversation_id, recortados)
+
+    def _reemplazar(self, conversation_id, compactados, resumen):
+        indice = _franja(conversation_id)
+        with self._locks[indice]:
+            entrada = self._franjas[indice].get(conversation_id)
+            if entrada is None or entrada[2][:len(compactados)] != compactados:
+                return False
+            ultimo_uso, _, turnos = entrada
+            self._franjas[indice][conversation_id] = (ultimo_uso, resumen, turnos[len(compactados):])
+            return True
+
+    def borrar(self, conversation_id):
+        """Olvida una conversación (nueva conversación del usuario)"""
+        indice = _franja(conversation_id)
+        with self._locks[indice]:
+            self._franjas[indice].pop(conversation_id, None)
+
+    def estadisticas(self):
+        estadisticas = dict(self.contadores)
+        estadisticas.update({
+            'almacen': 'memoria',
+            'conversaciones': sum(len(franja) for franja in self._franjas),
+            'max_conversaciones': self._max_por_franja * FRANJAS,
+            'max_tokens': self.max_tokens,
+            'ttl_segundos': self.ttl_segundos,
+        })
+        return estadisticas
+
+
+class AlmacenConversacionesSQLite(_ResumenEnSegundoPlano):
+    """Historiales en SQLite compartido por los workers, con TTL, límite de filas y recorte por tokens"""
+
+    def __init__(self, ruta, ttl_segundos=12 * 3600, max_conversaciones=2000, max_tokens=3000,
+                 resumir=None, umbral_resumen=1500, turnos_recientes=4):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self.max_conversaciones = max_conversaciones
+        self.max_tokens = max_tokens
+
+        self._locks = [threading.Lock() for _ in range(FRANJAS)]
+        self._local = threading.local()
+        self._contador_lock = threading.Lock()
+        self._escrituras = 0
+        self.contadores = {'turnos_recortados': 0, 'errores_sqlite': 0}
+        self._configurar_resumen(resumir, umbral_resumen, turnos_recientes)
+
+        try:
+            conexion = self._conexion()
+            columnas = [fila[1] for fila in conexion.execute("PRAGMA table_info(conversaciones)")]
+            if "resumen" not in columnas:
+                # Archivos creados antes de los resúmenes
+                with conexion:
+                    conexion.execute("ALTER TABLE conversaciones ADD COLUMN resumen TEXT NOT NULL DEFAULT ''")
+        except sqlite3.Error as e:
+            self._error_sqlite("inicializando", e)
+
+    def _conexion(self):
+        from utils.cache_respuestas import conexion_sqlite
+        return conexion_sqlite(self._local, self.ruta, _ESQUEMA)
+
+    def _error_sqlite(self, accion, error):
+        self.contadores['errores_sqlite'] += 1
+        print(f"⚠️ Conversaciones: error {accion} ({error})")
+
+    def _leer(self, conexion, conversation_id, ahora):
+        fila = conexion.execute(
+            "SELECT resumen, turnos FROM conversaciones WHERE id = ? AND ultimo_uso >= ?",
+            (conversation_id, ahora - self.ttl_segundos)
+        ).fetchone()
+        return Historial(fila[0], json.loads(fila[1])) if fila is not None else HISTORIAL_VACIO
+
+    def historial(self, conversation_id):
+        """
+        Resumen y turnos guardados de una conversación
+
+        Returns:
+            Historial: (resumen, [{'role', 'content'}]); vacío si no existe, expiró o falla SQLite
+        """
+        try:
+            return self._leer(self._conexion(), conversation_id, time.time())
+        except (sqlite3.Error, ValueError) as e:
+            self._error_sqlite("leyendo", e)
+            return HISTORIAL_VACIO
+
+    def _leer_historial(self, conversation_id):
+        # En el hilo de fondo un error de lectura no debe parecer un historial vacío
+        return self._leer(self._conexion(), conversation_id, time.time())
+
+    def agregar(self, conversation_id, *turnos):
+        """Añade turnos ({'role', 'content'}) al final del historial y lo recorta al presupuesto"""
+        ahora = time.time()
+        with self._contador_lock:
+            self._escrituras += 1
+            recortar = self._escrituras % 50 == 0
+
+        # El lock de la franja ordena los hilos del worker; BEGIN IMMEDIATE, los demás workers
+        with self._locks[_franja(conversation_id)]:
+            try:
+                conexion = self._conexion()
+                conexion.execute("BEGIN IMMEDIATE")
+                try:
+                    resumen, anteriores = self._leer(conexion, conversation_id, ahora)
+                    combinados = anteriores + list(turnos)
+                    recortados = recortar_historial(combinados, self.max_tokens)
+                    conexion.execute(
+                        "INSERT OR REPLACE INTO conversaciones (id, resumen, turnos, ultimo_uso) VALUES (?, ?, ?, ?)",
+                        (conversation_id, resumen, json.dumps(recortados, ensure_ascii=False), ahora)
+                    )
+                    if recortar:
+                        self._recortar(conexion, ahora)
+                    conexion.execute("COMMIT")
+                except BaseException:
+                    conexion.execute("ROLLBACK")
+                    raise
+                self.contadores['turnos_recortados'] += len(combinados) - len(recortados)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                self._error_sqlite("guardando", e)
+                return
+
+        self._programar_resumen(conversation_id, recortados)
+
+    def _reemplazar(self, conversation_id, compactados, resumen):
+        with self._locks[_franja(conversation_id)]:
+            conexion = self._conexion()
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                _, turnos = self._leer(conexion, conversation_id, time.time())
+                aplicado = turnos[:len(compactados)] == compactados
+                if aplicado:
+                    conexion.execute(
+                        "UPDATE conversaciones SET resumen = ?, turnos = ? WHERE id = ?",
+                        (resumen, json.dumps(turnos[len(compactados):], ensure_ascii=False), conversation_id)
+                    )
+                conexion.execute("COMMIT")
+            except BaseException:
+                conexion.execute("ROLLBACK")
+                raise
+            return aplicado
+
+    def _recortar(self, conexion, ahora):
+        """Borra las expiradas y, si sobran filas, las usadas hace más tiempo"""
+        conexion.execute("DELETE FROM conversaciones WHERE ultimo_uso < ?", (ahora - self.ttl_segundos,))
+        total = conexion.execute("SELECT COUNT(*) FROM conversaciones").fetchone()[0]
+        if total > self.max_conversaciones:
+            conexion.execute(
+                "DELETE FROM conversaciones WHERE id IN "
+                "(SELECT id FROM conversaciones ORDER BY ultimo_uso ASC LIMIT ?)",
+                (total - self.max_conversaciones,)
+            )
+
+    def borrar(self, conversation_id):
+        """Olvida una conversación (nueva conversación del usuario)"""
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute("DELETE FROM conversaciones WHERE id = ?", (conversation_id,))
+        except sqlite3.Error as e:
+            self._error_sqlite("borrando", e)
+
+    def estadisticas(self):
+        estadisticas = dict(self.contadores)
+        estadisticas.update({
+            'almacen': 'sqlite',
+            'max_conversaciones': self.max_conversaciones,
+            'max_tokens': self.max_tokens,
+            'ttl_segundos': self.ttl_segundos,
+        })
+        try:
+            estadisticas['conversaciones'] = self._conexion().execute(
+                "SELECT COUNT(*) FROM conversaciones WHERE ultimo_uso >= ?", (time.time() - self.ttl_segundos,)
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            self._error_sqlite("contando", e)
+        return estadisticas
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+def obtener_conversaciones():
+    """
+    Almacén de conversaciones del proceso
+
+    Returns:
+        AlmacenConversacionesSQLite o AlmacenConversacionesMemoria según CONVERSACIONES_ALMACEN
+    """
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                parametros = {
+                    'ttl_segundos': decimal_entorno("CONVERSACIONES_TTL_HORAS", 12) * 3600,
+                    'max_conversaciones': entero_entorno("CONVERSACIONES_MAX", 2000),
+                    'max_tokens': entero_entorno("CONVERSACIONES_MAX_TOKENS", 3000),
+                    'resumir': resumir_conversacion if bandera_entorno("CONVERSACIONES_RESUMEN") else None,
+                    'umbral_resumen': entero_entorno("CONVERSACIONES_UMBRAL_RESUMEN", 1500),
+                    'turnos_recientes': entero_entorno("CONVERSACIONES_TURNOS_RECIENTES", 4),
+                }
+                if os.getenv("CONVERSACIONES_ALMACEN", "sqlite").strip().lower() == "memoria":
+                    _almacen = AlmacenConversacionesMemoria(**parametros)
+                else:
+                    from utils.cache_respuestas import ruta_cache_por_defecto
+                    _almacen = AlmacenConversacionesSQLite(ruta_cache_por_defecto(), **parametros)
+    return _almacen
@@ -0,0 +1,244 @@
+"""
+Corpus compartido de solo lectura (tomos, glosario, reglamento de emergencia)
+
+Es la única copia del corpus en el proceso. Cuando existe el snapshot
+(utils/corpus_snapshot.py) los textos se sirven desde el mmap: las páginas
+del archivo las comparte el sistema operativo entre todos los workers de
+gunicorn, y con preload_app el master decodifica una sola vez antes del fork,
+de modo que la memoria no crece linealmente con el número de workers.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from utils.corpus_snapshot import obtener_snapshot
+
+# Claves de los textos fuera de la numeración de tomos
+CLAVE_GLOSARIO = "glosario"
+CLAVE_REGLAMENTO = "reglamento_emergencia"
+CLAVE_TOMO_10_CONSERVACION = "tomo_10_conservacion"
+
+
+class TomosCompartidos(Mapping):
+    """Vista {numero_tomo: contenido} que decodifica cada tomo solo cuando se usa"""
+
+    def __init__(self, corpus):
+        self._corpus = corpus
+
+    def _numeros(self):
+        return [n for n in range(1, 13) if self._corpus.contiene(f"tomo_{n}")]
+
+    def __getitem__(self, numero_tomo):
+        if not isinstance(numero_tomo, int) or not self._corpus.contiene(f"tomo_{numero_tomo}"):
+            raise KeyError(numero_tomo)
+        return self._corpus.texto(f"tomo_{numero_tomo}")
+
+    def __contains__(self, numero_tomo):
+        return isinstance(numero_tomo, int) and self._corpus.contiene(f"tomo_{numero_tomo}")
+
+    def __iter__(self):
+        return iter(self._numeros())
+
+    def __len__(self):
+        return len(self._numeros())
+
+
+class Corpus:
+    """
+    Corpus de solo lectura respaldado por el snapshot mmap o, si no existe,
+    por los textos cargados desde data/
+
+    Con presupuesto_bytes los textos decodificados desde el snapshot se
+    guardan en un LRU: al superar el presupuesto se descartan los menos
+    usados (siguen disponibles en el mmap y se vuelven a decodificar).
+    """
+
+    def __init__(self, snapshot=None, textos=None, presupuesto_bytes=None):
+        self._snapshot = snapshot
+        self._textos = dict(textos or {})
+        self._decodificados = OrderedDict()
+        self._bytes_decodificados = 0
+        self.presupuesto_bytes = presupuesto_bytes
+        self._lock = threading.Lock()
+        self.tomos = TomosCompartidos(self)
+
+        # Entradas del snapshot que apuntan al mismo bloque (p. ej. glosario = tomo_12)
+        # comparten una sola cadena decodificada
+        self._canonicas = {}
+        if snapshot is not None:
+            bloques = {}
+            for clave in sorted(snapshot.claves(), key=lambda c: (c == CLAVE_GLOSARIO, c)):
+                entrada = snapshot.entradas[clave]
+                bloque = (entrada["desplazamiento"], entrada["longitud"])
+                self._canonicas[clave] = bloques.setdefault(bloque, clave)
+            self.version = snapshot.version
+        else:
+            hash_corpus = hashlib.sha256()
+            for clave in sorted(self._textos):
+                hash_corpus.update(clave.encode("utf-8"))
+                hash_corpus.update(self._textos[clave].encode("utf-8"))
+            self.version = hash_corpus.hexdigest()
+
+    @property
+    def desde_snapshot(self):
+        return self._snapshot is not None
+
+    def contiene(self, clave):
+        """Indica si el corpus tiene la entrada"""
+        if clave in self._textos:
+            return True
+        return self._snapshot is not None and clave in self._snapshot
+
+    def claves(self):
+        """Claves disponibles en el corpus"""
+        claves = set(self._textos)
+        if self._snapshot is not None:
+            claves.update(self._snapshot.claves())
+        return sorted(claves)
+
+    def vista(self, clave):
+        """
+        Bytes utf-8 de una entrada sin copiarlos
+
+        Returns:
+            memoryview: Respaldado por el mmap si hay snapshot
+        """
+        if self._snapshot is not None and clave in self._snapshot:
+            return self._snapshot.vista(clave)
+        return memoryview(self.texto(clave).encode("utf-8"))
+
+    def fragmento(self, clave, inicio, fin):
+        """
+        Decodifica solo un rango de bytes de una entrada
+
+        Args:
+            clave (str): Entrada del corpus
+            inicio (int): Desplazamiento inicial en bytes
+            fin (int): Desplazamiento final en bytes (exclusivo)
+
+        Returns:
+            str: Texto del rango (los caracteres multibyte cortados se descartan)
+        """
+        return str(self.vista(clave)[inicio:fin], "utf-8", "ignore")
+
+    def texto(self, clave, predeterminado=""):
+        """Texto completo de una entrada (se decodifica una vez y se reutiliza)"""
+        texto = self._textos.get(clave)
+        if texto is not None:
+            return texto
+        if self._snapshot is None or clave not in self._snapshot:
+            return predeterminado
+
+        clave = self._canonicas.get(clave, clave)
+        with self._lock:
+            texto = self._decodificados.get(clave)
+            if texto is not None:
+                self._decodificados.move_to_end(clave)
+                return texto
+
+            texto = self._snapshot.texto(clave)
+            self._decodificados[clave] = texto
+            self._bytes_decodificados += self._snapshot.entradas[clave]["longitud"]
+            self._aplicar_presupuesto(clave)
+        return texto
+
+    def _aplicar_presupuesto(self, clave_actual):
+        """Descarta los textos menos usados hasta respetar el presupuesto (con el lock tomado)"""
+        if not self.presupuesto_bytes:
+            return
+        while self._bytes_decodificados > self.presupuesto_bytes and len(self._decodificados) > 1:
+            clave, _ = next(iter(self._decodificados.items()))
+            if clave == clave_actual:
+                break
+            del self._decodificados[clave]
+            self._bytes_decodificados -= self._snapshot.entradas[clave]["longitud"]
+
+    def estadisticas(self):
+        """Resumen del uso de memoria del corpus"""
+        return {
+            'version': self.version,
+            'desde_snapshot': self.desde_snapshot,
+            'entradas': len(self.claves()),
+            'decodificadas': sorted(set(self._textos) | set(self._decodificados)),
+            'bytes_decodificados': self._bytes_decodificados,
+            'presupuesto_bytes': self.presupuesto_bytes,
+        }
+
+    def tomo(self, numero_tomo):
+        """Contenido de un tomo o None si no existe"""
+        return self.tomos.get(numero_tomo)
+
+    @property
+    def glosario(self):
+        return self.texto(CLAVE_GLOSARIO)
+
+    @property
+    def reglamento_emergencia(self):
+        return self.texto(CLAVE_REGLAMENTO)
+
+    @property
+    def tomo_10_conservacion(self):
+        return self.texto(CLAVE_TOMO_10_CONSERVACION)
+
+    def precargar(self):
+        """
+        Decodifica todas las entradas. Con preload_app se llama en el master
+        de gunicorn, así los workers heredan las cadenas ya construidas.
+        Con presupuesto de memoria no se precarga: los tomos se decodifican
+        bajo demanda.
+        """
+        if self.presupuesto_bytes:
+            return self
+        for clave in self.claves():
+            self.texto(clave)
+        return self
+
+
+def _cargar_desde_archivos():
+    """Construye el corpus leyendo los archivos de texto (sin snapshot)"""
+    from utils.cargador_tomos import (
+        cargar_todos_los_tomos, cargar_glosario,
+        cargar_reglamento_emergencia, cargar_tomo_10_conservacion_historica
+    )
+
+    textos = {f"tomo_{numero}": contenido for numero, contenido in cargar_todos_los_tomos().items()}
+    textos[CLAVE_GLOSARIO] = textos.get("tomo_12") or cargar_glosario()
+    textos[CLAVE_REGLAMENTO] = cargar_reglamento_emergencia()
+    textos[CLAVE_TOMO_10_CONSERVACION] = cargar_tomo_10_conservacion_historica()
+    return Corpus(textos={clave: texto for clave, texto in textos.items() if texto})
+
+
+def _presupuesto_configurado():
+    """Presupuesto de memoria para tomos decodificados (CORPUS_MEMORIA_MAX_MB, opcional)"""
+    valor = os.getenv("CORPUS_MEMORIA_MAX_MB")
+    try:
+        return int(float(valor) * 1024 * 1024) if valor else None
+    except ValueError:
+        print(f"⚠️ CORPUS_MEMORIA_MAX_MB inválido: {valor}")
+        return None
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+def obtener_corpus():
+    """
+    Instancia única del corpus en el proceso
+
+    Returns:
+        Corpus: Corpus compartido
+    """
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                snapshot = obtener_snapshot()
+                if snapshot is not None:
+                    _corpus = Corpus(snapshot=snapshot, presupuesto_bytes=_presupuesto_configurado())
+                    print(f"✅ Corpus compartido desde snapshot {snapshot.version[:12]} ({len(snapshot.claves())} entradas)")
+                else:
+                    _corpus = _cargar_desde_archivos()
+    return _corpus
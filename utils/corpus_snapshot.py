@@ -0,0 +1,252 @@
+"""
+Snapshot binario del corpus (tomos, glosario y reglamento de emergencia)
+
+El snapshot se compila una sola vez en el paso de build:
+
+    python -m utils.corpus_snapshot
+
+y los workers lo abren con mmap al arrancar, en lugar de listar data/,
+decodificar cada tomo y hacer json.load del reglamento en cada proceso.
+
+Formato del archivo (versionado):
+    MAGIA (8 bytes) | versión de formato (uint32) | longitud del índice (uint32)
+    índice JSON (utf-8) | textos utf-8 concatenados
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+
+from utils.cargador_tomos import DIRECTORIO_DATOS, localizar_archivo_tomo
+
+MAGIA = b"JPCORPUS"
+VERSION_FORMATO = 1
+_CABECERA = struct.Struct("<II")
+
+NOMBRE_SNAPSHOT = "corpus_jp.snapshot"
+ARCHIVO_REGLAMENTO = "reglamento_emergencia_jp41_chatbot_20250731_155845.json"
+ARCHIVO_TOMO_10_CONSERVACION = "Tomo_10_Conservacion_Historica.txt"
+
+
+def ruta_snapshot_por_defecto():
+    """Ruta del snapshot (configurable con CORPUS_SNAPSHOT)"""
+    return os.getenv("CORPUS_SNAPSHOT", os.path.join(DIRECTORIO_DATOS, NOMBRE_SNAPSHOT))
+
+
+def _fuentes_corpus(directorio_datos=DIRECTORIO_DATOS):
+    """
+    Enumera los archivos que forman el corpus
+
+    Returns:
+        list: Tuplas (clave, nombre_archivo, tipo) con tipo 'texto' o 'reglamento'
+    """
+    archivos = os.listdir(directorio_datos)
+    fuentes = []
+
+    for numero_tomo in range(1, 13):
+        archivo = localizar_archivo_tomo(numero_tomo, archivos, directorio_datos)
+        # Tomo 1 aún no tiene versión mejorada: usar el original
+        if not archivo and numero_tomo == 1 and "tomo_1.txt" in archivos:
+            archivo = "tomo_1.txt"
+        if archivo:
+            fuentes.append((f"tomo_{numero_tomo}", archivo, "texto"))
+
+    # Glosario original como respaldo si no existe el tomo 12 mejorado
+    if not any(clave == "tomo_12" for clave, _, _ in fuentes) and "glosario.txt" in archivos:
+        fuentes.append(("glosario", "glosario.txt", "texto"))
+
+    if ARCHIVO_REGLAMENTO in archivos:
+        fuentes.append(("reglamento_emergencia", ARCHIVO_REGLAMENTO, "reglamento"))
+
+    if ARCHIVO_TOMO_10_CONSERVACION in archivos:
+        fuentes.append(("tomo_10_conservacion", ARCHIVO_TOMO_10_CONSERVACION, "texto"))
+
+    return fuentes
+
+
+def _firma_fuentes(fuentes, directorio_datos=DIRECTORIO_DATOS):
+    """Tamaño y fecha de modificación de cada fuente, para detectar snapshots obsoletos"""
+    firma = {}
+    for clave, archivo, _ in fuentes:
+        estado = os.stat(os.path.join(directorio_datos, archivo))
+        firma[archivo] = [estado.st_size, int(estado.st_mtime)]
+    return firma
+
+
+def construir_snapshot(directorio_datos=DIRECTORIO_DATOS, ruta_salida=None):
+    """
+    Compila todos los textos del corpus en un único snapshot binario
+
+    Args:
+        directorio_datos (str): Directorio con los tomos
+        ruta_salida (str): Ruta del snapshot (por defecto data/corpus_jp.snapshot)
+
+    Returns:
+        str: Ruta del snapshot generado
+    """
+    ruta_salida = ruta_salida or ruta_snapshot_por_defecto()
+    fuentes = _fuentes_corpus(directorio_datos)
+
+    bloques = []
+    entradas = {}
+    desplazamiento = 0
+    hash_corpus = hashlib.sha256()
+
+    for clave, archivo, tipo in fuentes:
+        ruta = os.path.join(directorio_datos, archivo)
+        if tipo == "reglamento":
+            with open(ruta, "r", encoding="utf-8") as f:
+                texto = json.load(f).get("analisis_completo", "")
+        else:
+            with open(ruta, "r", encoding="utf-8") as f:
+                texto = f.read()
+
+        datos = texto.encode("utf-8")
+        entradas[clave] = {
+            "archivo": archivo,
+            "desplazamiento": desplazamiento,
+            "longitud": len(datos),
+            "caracteres": len(texto),
+        }
+        hash_corpus.update(clave.encode("utf-8"))
+        hash_corpus.update(datos)
+        bloques.append(datos)
+        desplazamiento += len(datos)
+
+    # El glosario es el tomo 12: no duplicar los bytes, solo apuntar al mismo bloque
+    if "tomo_12" in entradas and "glosario" not in entradas:
+        entradas["glosario"] = dict(entradas["tomo_12"])
+
+    indice = {
+        "version": hash_corpus.hexdigest(),
+        "creado": datetime.now().isoformat(timespec="seconds"),
+        "fuentes": _firma_fuentes(fuentes, directorio_datos),
+        "entradas": entradas,
+    }
+    indice_bytes = json.dumps(indice, ensure_ascii=False).encode("utf-8")
+
+    # Escritura atómica: los workers nunca ven un snapshot a medio escribir
+    ruta_temporal = f"{ruta_salida}.{os.getpid()}.tmp"
+    with open(ruta_temporal, "wb") as f:
+        f.write(MAGIA)
+        f.write(_CABECERA.pack(VERSION_FORMATO, len(indice_bytes)))
+        f.write(indice_bytes)
+        for datos in bloques:
+            f.write(datos)
+    os.replace(ruta_temporal, ruta_salida)
+
+    print(f"✅ Snapshot del corpus generado: {ruta_salida} ({len(entradas)} entradas, {desplazamiento} bytes, versión {indice['version'][:12]})")
+    return ruta_salida
+
+
+class CorpusSnapshot:
+    """Snapshot del corpus mapeado en memoria (solo lectura)"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._archivo = open(ruta, "rb")
+        try:
+            self._mmap = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._archivo.close()
+            raise
+
+        if self._mmap[:len(MAGIA)] != MAGIA:
+            self.cerrar()
+            raise ValueError(f"{ruta} no es un snapshot del corpus")
+
+        inicio = len(MAGIA)
+        version_formato, longitud_indice = _CABECERA.unpack_from(self._mmap, inicio)
+        if version_formato != VERSION_FORMATO:
+            self.cerrar()
+            raise ValueError(f"Formato de snapshot {version_formato} no soportado (se esperaba {VERSION_FORMATO})")
+
+        inicio += _CABECERA.size
+        indice = json.loads(self._mmap[inicio:inicio + longitud_indice].decode("utf-8"))
+        self._inicio_datos = inicio + longitud_indice
+        self.version = indice["version"]
+        self.creado = indice.get("creado")
+        self.fuentes = indice.get("fuentes", {})
+        self.entradas = indice["entradas"]
+
+    def __contains__(self, clave):
+        return clave in self.entradas
+
+    def claves(self):
+        """Claves disponibles en el snapshot"""
+        return list(self.entradas.keys())
+
+    def vista(self, clave):
+        """
+        Vista sin copia de los bytes utf-8 de una entrada
+
+        Returns:
+            memoryview: Bytes de la entrada respaldados por el mmap
+        """
+        entrada = self.entradas[clave]
+        inicio = self._inicio_datos + entrada["desplazamiento"]
+        return memoryview(self._mmap)[inicio:inicio + entrada["longitud"]]
+
+    def texto(self, clave):
+        """Decodifica una entrada completa como str"""
+        return str(self.vista(clave), "utf-8")
+
+    def esta_vigente(self, directorio_datos=DIRECTORIO_DATOS):
+        """Comprueba que las fuentes en data/ no hayan cambiado desde que se compiló"""
+        try:
+            return _firma_fuentes(_fuentes_corpus(directorio_datos), directorio_datos) == self.fuentes
+        except OSError:
+            return False
+
+    def cerrar(self):
+        """Libera el mmap y el descriptor de archivo"""
+        try:
+            self._mmap.close()
+        finally:
+            self._archivo.close()
+
+
+def abrir_snapshot(ruta=None, directorio_datos=DIRECTORIO_DATOS):
+    """
+    Abre el snapshot si existe, es compatible y está vigente
+
+    Returns:
+        CorpusSnapshot: Snapshot abierto o None para usar la carga desde texto
+    """
+    ruta = ruta or ruta_snapshot_por_defecto()
+    if not os.path.exists(ruta):
+        print(f"⚠️ Snapshot del corpus no encontrado ({ruta}), cargando desde archivos de texto")
+        return None
+
+    try:
+        snapshot = CorpusSnapshot(ruta)
+    except Exception as e:
+        print(f"❌ Error abriendo snapshot del corpus: {e}")
+        return None
+
+    if not snapshot.esta_vigente(directorio_datos):
+        print("⚠️ Snapshot del corpus obsoleto (cambiaron los archivos de data/), cargando desde archivos de texto")
+        snapshot.cerrar()
+        return None
+
+    return snapshot
+
+
+_snapshot = None
+_snapshot_abierto = False
+
+def obtener_snapshot():
+    """Snapshot del proceso (se abre una sola vez)"""
+    global _snapshot, _snapshot_abierto
+    if not _snapshot_abierto:
+        _snapshot = abrir_snapshot()
+        _snapshot_abierto = True
+    return _snapshot
+
+
+if __name__ == "__main__":
+    construir_snapshot(ruta_salida=sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,195 @@
+"""
+Corrector ortográfico por borrados precalculados (SymSpell) para las consultas
+
+El vocabulario son las palabras del corpus (tomos 1-11) y de los términos del
+glosario, sin acentos. Para cada palabra se guardan todas sus variantes con
+hasta N caracteres borrados; una palabra mal escrita se corrige generando sus
+propios borrados y buscándolos en el diccionario, sin recorrer el vocabulario.
+
+Solo se corrigen palabras que no aparecen en el corpus (aunque sea una vez)
+y cuya corrección es una edición real: si la palabra es el singular o el
+plural de una del vocabulario ("vecino" / "vecinos"), está bien escrita.
+Aun así una palabra correcta que el corpus no usa ("gasolinera") puede
+acabar en otra ("gasolina"): las búsquedas usan la palabra original junto a
+su corrección (ConsultaAnalizada.terminos_corregidos).
+"""
+
+import threading
+from collections import Counter
+
+from utils.procesador_texto import normalizar
+
+DISTANCIA_MAXIMA = 2
+# Solo se generan borrados sobre este prefijo: acota el diccionario sin perder precisión
+LONGITUD_PREFIJO = 7
+# Palabras más cortas no se corrigen (demasiadas coincidencias posibles)
+LONGITUD_MINIMA = 4
+# Apariciones mínimas en el corpus para entrar al vocabulario (filtra ruido de OCR)
+FRECUENCIA_MINIMA = 2
+# Peso extra de las palabras del glosario frente a las del resto del corpus
+PESO_GLOSARIO = 1000
+
+
+def _borrados(palabra, distancia):
+    """Variantes de la palabra con hasta `distancia` caracteres borrados (incluida ella misma)"""
+    variantes = {palabra}
+    frontera = {palabra}
+    for _ in range(distancia):
+        siguiente = set()
+        for variante in frontera:
+            if len(variante) <= 1:
+                continue
+            for i in range(len(variante)):
+                siguiente.add(variante[:i] + variante[i + 1:])
+        siguiente -= variantes
+        variantes |= siguiente
+        frontera = siguiente
+    return variantes
+
+
+def distancia_edicion(a, b, maxima):
+    """
+    Distancia de Damerau-Levenshtein (transposiciones adyacentes) con corte temprano
+
+    Returns:
+        int: Distancia o maxima + 1 si la supera
+    """
+    if abs(len(a) - len(b)) > maxima:
+        return maxima + 1
+
+    anterior_previa = None
+    anterior = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        actual = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            costo = 0 if a[i - 1] == b[j - 1] else 1
+            actual[j] = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + costo)
+            if (anterior_previa is not None and j > 1 and
+                    a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                actual[j] = min(actual[j], anterior_previa[j - 2] + 1)
+        if min(actual) > maxima:
+            return maxima + 1
+        anterior_previa, anterior = anterior, actual
+    return anterior[-1]
+
+
+def es_plural_de(a, b):
+    """True si una de las dos palabras es la otra con una 's' o 'es' final"""
+    corta, larga = sorted((a, b), key=len)
+    return larga in (corta + "s", corta + "es")
+
+
+class CorrectorOrtografico:
+    """Diccionario de borrados sobre un vocabulario con frecuencias"""
+
+    def __init__(self, frecuencias, distancia_maxima=DISTANCIA_MAXIMA, longitud_prefijo=LONGITUD_PREFIJO,
+                 conocidas=()):
+        """
+        Args:
+            frecuencias (dict): {palabra sin acentos: frecuencia}
+            distancia_maxima (int): Ediciones máximas para corregir
+            longitud_prefijo (int): Caracteres sobre los que se generan borrados
+            conocidas (Iterable): Palabras que no se corrigen aunque no estén en el
+                                  vocabulario (todas las del corpus, incluidas las raras)
+        """
+        self.frecuencias = dict(frecuencias)
+        self.conocidas = frozenset(conocidas)
+        self.distancia_maxima = distancia_maxima
+        self.longitud_prefijo = longitud_prefijo
+        self.borrados = {}
+        self._cache = {}
+
+        for palabra in self.frecuencias:
+            for variante in _borrados(palabra[:longitud_prefijo], distancia_maxima):
+                self.borrados.setdefault(variante, []).append(palabra)
+
+    def __contains__(self, palabra):
+        return palabra in self.frecuencias
+
+    def _distancia_permitida(self, palabra):
+        # Una sola edición en palabras cortas para no cambiar su sentido
+        return 1 if len(palabra) <= 5 else self.distancia_maxima
+
+    def sugerencias(self, palabra):
+        """
+        Palabras del vocabulario a la menor distancia
+
+        Returns:
+            list: Tuplas (distancia, -frecuencia, palabra) ordenadas
+        """
+        palabra = normalizar(palabra)
+        maxima = self._distancia_permitida(palabra)
+        candidatas = set()
+        for variante in _borrados(palabra[:self.longitud_prefijo], maxima):
+            candidatas.update(self.borrados.get(variante, ()))
+
+        resultado = []
+        for candidata in candidatas:
+            distancia = distancia_edicion(palabra, candidata, maxima)
+            if distancia <= maxima:
+                resultado.append((distancia, -self.frecuencias[candidata], candidata))
+        resultado.sort()
+        return resultado
+
+    def corregir(self, palabra):
+        """
+        Corrección más probable de una palabra (distancia mínima y, en empate, la más frecuente)
+
+        Returns:
+            str: Palabra corregida sin acentos, o la original normalizada si está
+                 en el corpus, es el singular o plural de una palabra del
+                 vocabulario o no hay corrección
+        """
+        palabra = normalizar(palabra)
+        if (palabra in self.frecuencias or palabra in self.conocidas
+                or len(palabra) < LONGITUD_MINIMA or not palabra.isalpha()):
+            return palabra
+
+        correccion = self._cache.get(palabra)
+        if correccion is None:
+            sugerencias = self.sugerencias(palabra)
+            if not sugerencias or any(es_plural_de(palabra, candidata) for _, _, candidata in sugerencias):
+                correccion = palabra
+            else:
+                correccion = sugerencias[0][2]
+            if len(self._cache) >= 4096:
+                self._cache.clear()
+            self._cache[palabra] = correccion
+        return correccion
+
+    def corregir_texto(self, texto):
+        """Texto normalizado con cada palabra corregida"""
+        return " ".join(self.corregir(palabra) for palabra in normalizar(texto).split())
+
+
+_corrector = None
+_corrector_lock = threading.Lock()
+
+def obtener_corrector():
+    """
+    Corrector sobre el vocabulario del corpus y del glosario (se construye una vez)
+
+    Returns:
+        CorrectorOrtografico: Corrector compartido
+    """
+    global _corrector
+    if _corrector is None:
+        with _corrector_lock:
+            if _corrector is None:
+                from utils.indice_bm25 import obtener_indice_tomos
+                from utils.glosario_indice import obtener_indice_glosario
+
+                frecuencias = Counter()
+                postings = obtener_indice_tomos().postings
+                for palabra, documentos in postings.items():
+                    total = sum(documentos.values())
+                    if total >= FRECUENCIA_MINIMA and len(palabra) >= LONGITUD_MINIMA and palabra.isalpha():
+                        frecuencias[palabra] = total
+                for clave in obtener_indice_glosario().claves:
+                    for palabra in clave.split():
+                        if len(palabra) >= LONGITUD_MINIMA and palabra.isalpha():
+                            frecuencias[palabra] += PESO_GLOSARIO
+
+                _corrector = CorrectorOrtografico(frecuencias, conocidas=postings)
+                print(f"✅ Corrector ortográfico construido: {len(frecuencias)} palabras, {len(_corrector.borrados)} borrados")
+    return _corrector
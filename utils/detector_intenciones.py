@@ -0,0 +1,294 @@
+"""
+Detector único de intenciones de la consulta (Aho-Corasick)
+
+Sustituye la cascada de any(palabra in entrada_lower for palabra in [...])
+repartida entre procesar_mensaje, los mini-especialistas,
+detectar_consulta_especifica, detectar_y_generar_tabla_automatica,
+detectar_tipo_pregunta, la búsqueda de sitios históricos y
+palabras_legales:
+
+- Todas las listas de disparadores viven en INTENCIONES y se compilan una
+  vez por proceso en un autómata Aho-Corasick.
+- Cada consulta se pliega (minúsculas, sin acentos) y se recorre una sola
+  vez: el resultado es el conjunto de intenciones activadas, los
+  disparadores que activaron cada una y los números de tomo mencionados.
+- Los enrutadores solo consultan ese conjunto (analisis.tiene('flujograma')),
+  y analisis.explicar() deja en el registro por qué se eligió cada ruta. El
+  análisis de cada solicitud se hace una vez y viaja en su ConsultaAnalizada
+  (utils/consulta_analizada.py).
+
+Los disparadores coinciden como subcadenas, igual que los `in` a los que
+sustituyen. Una tupla de disparadores exige que aparezcan en ese orden
+(equivale a las expresiones 'tabla.*cabida' de antes).
+"""
+
+import threading
+
+from utils.procesador_texto import normalizar
+
+# {intención: [disparadores]}; una tupla exige los disparadores en ese orden
+INTENCIONES = {
+    # Estructura del documento y casos fijos de procesar_mensaje
+    'cuantos_tomos': ['cuantos tomos', 'cuántos tomos'],
+    'cumplimiento_ambiental': ['división de cumplimiento ambiental', 'division de cumplimiento ambiental'],
+
+    # Consultas estructuradas (detectar_consulta_especifica)
+    'indice_completo': ['índice', 'indice', 'lista completa', 'todos los recursos', 'qué recursos', 'recursos disponibles'],
+    'flujograma': ['flujograma', 'proceso', 'trámite', 'procedimiento'],
+    'flujograma_terrenos': ['terreno', 'terrenos', 'público', 'públicos'],
+    'flujograma_calificacion': ['calificación', 'cambio', 'cambios'],
+    'flujograma_historicos': ['histórico', 'historicos', 'sitio', 'sitios'],
+    'tabla_cabida': [
+        ('tabla', 'cabida'), ('cabida', 'tabla'), ('cabida', 'distrito'), ('cabida', 'tomo'),
+        ('tabla', 'tomo'), ('tabla', 'distrito'), ('muestra', 'tabla', 'cabida'),
+        ('ver', 'tabla', 'cabida'), ('información', 'cabida'),
+    ],
+    'resoluciones': ['resolución', 'resoluciones'],
+
+    # Tablas generadas (detectar_y_generar_tabla_automatica, MiniEspecialistaTablas)
+    'tabla': [
+        'tabla', 'tablas', 'generar tabla', 'mostrar tabla', 'crear tabla',
+        'tabla de', 'tabla con', 'resumen tabla', 'formato tabla'
+    ],
+    'cabida': ['cabida'],
+    'tabla_tipo_cabida': ['cabida', 'superficie', 'área'],
+    'tabla_tipo_calificaciones': ['calificación', 'calificacion', 'zonificación', 'zonificacion', 'distrito', 'distritos'],
+    'tabla_tipo_permisos': ['permiso', 'permisos', 'licencia', 'licencias', 'trámite', 'tramite'],
+    'tabla_tipo_agencias': ['agencia', 'agencias', 'entidad', 'entidades', 'organización', 'organizacion'],
+
+    # Títulos de los tomos (procesar_pregunta_legal)
+    'titulos': ["titulo", "títulos", "titulos", "nombre", "nombres", "llamar", "llama", "indices", "indice", "índice", "índices"],
+    'tomos': ["tomo", "tomos", "11 tomos", "once tomos", "todos los tomos", "cada tomo"],
+    'listado': ["dame", "dime", "muestra", "muéstra", "lista", "listado", "cuales", "cuáles"],
+
+    # Tomo 10 (buscar_en_tomo_10_sitios_historicos)
+    'sitios_historicos': [
+        'sitio histórico', 'sitios históricos', 'sitio historico', 'sitios historicos',
+        'zona histórica', 'zonas históricas', 'zona historica', 'zonas historicas',
+        'conservación histórica', 'conservacion historica', 'patrimonio histórico',
+        'designación histórica', 'designacion historica', 'nominación histórica'
+    ],
+
+    # Mini-especialistas (es_mi_consulta)
+    'especialista_conservacion': [
+        'sitio histórico', 'sitios históricos',
+        'designación histórica', 'nominación histórica',
+        'conservación histórica', 'patrimonio histórico',
+        'icp', 'instituto de cultura',
+        'sección 10.1.1', 'criterios históricos'
+    ],
+    'especialista_permisos': [
+        'permiso', 'permisos', 'licencia', 'licencias',
+        'autorización', 'autorizaciones', 'certificación',
+        'tramitar', 'solicitar', 'requisitos para',
+        'documentos necesarios', 'cómo obtener',
+        'permiso de construcción', 'permiso de uso',
+        'permiso único', 'permiso de demolición',
+        'desarrollo y negocios', 'ogpe', 'sui'
+    ],
+    'especialista_procedimientos': [
+        'procedimiento', 'procedimientos', 'proceso administrativo',
+        'notificación', 'notificaciones', 'plazo', 'plazos',
+        'vista pública', 'adjudicativo', 'determinación final',
+        'lpau', 'ley 38-2017', 'subsanación', 'requerimientos',
+        'municipios autónomos', 'jurisdicción', 'evaluación',
+        'trámite', 'solicitud', 'cómo presentar'
+    ],
+
+    # Tipo de pregunta (detectar_tipo_pregunta, procesar_pregunta_glosario, es_pregunta_simple)
+    'comparacion': ['diferencia', 'diferencias', 'comparar', 'comparación'],
+    'requisitos': ['requisito', 'requisitos', 'proceso', 'procedimiento', 'pasos', 'como', 'cómo', 'necesito', 'solicitar', 'obtener', 'tramitar', 'aplicar'],
+    'definicion': ['qué es', 'que es', 'define', 'definición', 'definicion', 'significado', 'explica', 'explícame', 'explicame', 'concepto', 'término', 'termino', 'significa'],
+    'permisos': ['permiso', 'autorización', 'licencia', 'trámite'],
+    'accion_tramite': ['requisito', 'como', 'cómo', 'proceso', 'solicitar', 'obtener', 'tramitar'],
+    'construccion': ['construcción', 'edificar', 'estructura', 'obra'],
+    'planificacion': ['plan', 'zonificación', 'ordenación', 'uso de suelo'],
+    'ambiental': ['ambiental', 'conservación', 'aguas', 'desperdicios'],
+    'pregunta_compleja': [
+        "todos", "lista", "cantidad", "cuantos", "cuántos", "comparar", "diferencia",
+        "análisis", "resumen", "procedimiento completo", "proceso completo"
+    ],
+    'pregunta_simple': [
+        "qué es", "que es", "define", "definición", "significa",
+        "cómo se", "como se", "para qué", "para que"
+    ],
+
+    # Ruta de procesar_mensaje: híbrida (legal o estructurada) o general
+    'legal': [
+        'permiso', 'planificación', 'construcción', 'zonificación', 'desarrollo',
+        'urbanización', 'reglamento', 'licencia', 'certificación', 'calificación',
+        'tomo', 'junta', 'planificación', 'ambiental', 'infraestructura',
+        'conservación', 'histórico', 'querella', 'edificabilidad', 'lotificación'
+    ],
+    'consulta_especifica': ['índice', 'indice', 'flujograma', 'tabla', 'cabida', 'resolución', 'lista'],
+    'contexto_legal': ['puerto rico', 'pr', 'planificación', 'planificacion', 'ley', 'legal', 'gobierno'],
+}
+
+# Disparador que, seguido de un número, indica el tomo ('tomo 3', 'tomo3')
+DISPARADOR_TOMO = "tomo"
+
+
+class AutomataAhoCorasick:
+    """Autómata de varios patrones: encuentra todas las apariciones en una sola pasada"""
+
+    def __init__(self, patrones):
+        self._transiciones = [{}]
+        self._fallo = [0]
+        self._salidas = [()]
+
+        for patron in patrones:
+            estado = 0
+            for caracter in patron:
+                siguiente = self._transiciones[estado].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self._transiciones)
+                    self._transiciones[estado][caracter] = siguiente
+                    self._transiciones.append({})
+                    self._fallo.append(0)
+                    self._salidas.append(())
+                estado = siguiente
+            self._salidas[estado] = (patron,)
+
+        # Enlaces de fallo por anchura: el sufijo propio más largo que también es prefijo
+        pendientes = list(self._transiciones[0].values())
+        while pendientes:
+            estado = pendientes.pop(0)
+            for caracter, siguiente in self._transiciones[estado].items():
+                fallo = self._fallo[estado]
+                while fallo and caracter not in self._transiciones[fallo]:
+                    fallo = self._fallo[fallo]
+                self._fallo[siguiente] = self._transiciones[fallo].get(caracter, 0)
+                self._salidas[siguiente] += self._salidas[self._fallo[siguiente]]
+                pendientes.append(siguiente)
+
+    def buscar(self, texto):
+        """
+        Apariciones de los patrones en el texto
+
+        Yields:
+            tuple: (inicio, patron) en orden de final de la aparición
+        """
+        transiciones, fallo, salidas = self._transiciones, self._fallo, self._salidas
+        estado = 0
+        for fin, caracter in enumerate(texto, 1):
+            while estado and caracter not in transiciones[estado]:
+                estado = fallo[estado]
+            estado = transiciones[estado].get(caracter, 0)
+            for patron in salidas[estado]:
+                yield fin - len(patron), patron
+
+
+class AnalisisIntenciones:
+    """Intenciones activadas por una consulta, con sus disparadores y los tomos mencionados"""
+
+    def __init__(self, coincidencias, tomos):
+        self.coincidencias = coincidencias
+        self.intenciones = frozenset(coincidencias)
+        self.tomos = tuple(tomos)
+
+    def tiene(self, *intenciones):
+        """True si se activó alguna de las intenciones"""
+        return any(intencion in self.intenciones for intencion in intenciones)
+
+    @property
+    def tomo(self):
+        """Primer número de tomo mencionado (None si no hay)"""
+        return self.tomos[0] if self.tomos else None
+
+    def explicar(self):
+        """{intenciones, disparadores, tomos} para el registro y el depurado"""
+        return {
+            'intenciones': sorted(self.intenciones),
+            'disparadores': {intencion: list(disparadores) for intencion, disparadores in sorted(self.coincidencias.items())},
+            'tomos': list(self.tomos),
+        }
+
+
+class DetectorIntenciones:
+    """Compila los disparadores de todas las intenciones en un solo autómata"""
+
+    def __init__(self, intenciones=INTENCIONES):
+        self._intenciones = {}
+        patrones = {DISPARADOR_TOMO}
+        for nombre, disparadores in intenciones.items():
+            plegados = []
+            for disparador in disparadores:
+                plegado = tuple(normalizar(parte) for parte in disparador) if isinstance(disparador, tuple) else normalizar(disparador)
+                if plegado not in plegados:
+                    plegados.append(plegado)
+                patrones.update(plegado if isinstance(plegado, tuple) else (plegado,))
+            self._intenciones[nombre] = plegados
+        self._automata = AutomataAhoCorasick(sorted(patrones))
+
+    def analizar(self, texto, plegado=None):
+        """
+        Recorre la consulta una vez y evalúa todas las intenciones
+
+        Args:
+            texto (str): Consulta tal como la escribió el usuario
+            plegado (str): normalizar(texto) si ya se calculó
+
+        Returns:
+            AnalisisIntenciones: Intenciones activadas y tomos mencionados
+        """
+        if plegado is None:
+            plegado = normalizar(texto)
+        inicios = {}
+        tomos = []
+        for inicio, patron in self._automata.buscar(plegado):
+            inicios.setdefault(patron, []).append(inicio)
+            if patron == DISPARADOR_TOMO:
+                numero = _numero_tras(plegado, inicio + len(patron))
+                if numero is not None and numero not in tomos:
+                    tomos.append(numero)
+
+        coincidencias = {}
+        for nombre, disparadores in self._intenciones.items():
+            activados = [
+                " … ".join(d) if isinstance(d, tuple) else d
+                for d in disparadores
+                if (_en_orden(d, inicios) if isinstance(d, tuple) else d in inicios)
+            ]
+            if activados:
+                coincidencias[nombre] = activados
+        return AnalisisIntenciones(coincidencias, tomos)
+
+
+def _numero_tras(texto, posicion):
+    """Número que sigue a `posicion` tras espacios opcionales (None si no hay)"""
+    while posicion < len(texto) and texto[posicion].isspace():
+        posicion += 1
+    fin = posicion
+    while fin < len(texto) and texto[fin].isdigit():
+        fin += 1
+    return int(texto[posicion:fin]) if fin > posicion else None
+
+
+def _en_orden(partes, inicios):
+    """True si cada parte aparece después del final de la anterior"""
+    cursor = 0
+    for parte in partes:
+        siguiente = next((inicio for inicio in inicios.get(parte, ()) if inicio >= cursor), None)
+        if siguiente is None:
+            return False
+        cursor = siguiente + len(parte)
+    return True
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def obtener_detector():
+    """
+    Detector de intenciones del proceso (se compila una sola vez)
+
+    Returns:
+        DetectorIntenciones: Autómata con todas las listas de INTENCIONES
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = DetectorIntenciones()
+    return _detector
+
@@ -0,0 +1,325 @@
+"""
+Armado del contexto de los prompts con presupuesto de tokens
+
+Sustituye los recortes fijos por caracteres (contenido[:1500], max_chars =
+8000, el archivo completo de conservación histórica) por fragmentos
+recuperados y puntuados (ventanas BM25 de utils/recuperacion.py) que se
+empaquetan de mayor a menor puntuación hasta el presupuesto del modelo:
+
+- Los tokens se estiman localmente (piezas de palabra de ~4 letras más
+  signos), sin llamar a la API.
+- Los fragmentos que se solapan con otros ya elegidos del mismo documento
+  se recortan a la parte nueva o se descartan; los textos repetidos
+  (p. ej. la misma definición por dos términos) entran una sola vez.
+- Una ventana más grande que todo el presupuesto (tomos con líneas de
+  miles de caracteres) se divide en sub-ventanas alrededor de sus líneas
+  coincidentes que sí caben, en lugar de descartarse.
+- Cada fragmento conserva su procedencia (fuente, entrada del corpus,
+  líneas) para el registro y el depurado.
+
+Variables de entorno:
+    CONTEXTO_MAX_TOKENS   Presupuesto de contexto para cualquier modelo (sustituye la tabla)
+"""
+
+import math
+import re
+from collections import namedtuple
+
+from utils.configuracion import entero_entorno
+from utils.procesador_texto import normalizar
+
+# Presupuesto de contexto recuperado por modelo (el resto del prompt y la respuesta quedan fuera)
+PRESUPUESTO_POR_MODELO = {
+    "claude-3-haiku-20240307": 4000,
+    "claude-3-sonnet-20240229": 6000,
+}
+PRESUPUESTO_POR_DEFECTO = 4000
+
+# Una pieza de palabra del tokenizador cubre ~4 letras en español
+LETRAS_POR_PIEZA = 4
+_PIEZAS = re.compile(r"\w+|[^\w\s]")
+
+SEPARADOR = "\n\n---\n\n"
+# Líneas de contexto a cada lado de una línea coincidente en las sub-ventanas
+LINEAS_CONTEXTO_SUBVENTANA = 1
+
+# coincidencias: líneas del texto (desde 0) donde aparece algún término de la consulta
+Fragmento = namedtuple("Fragmento", "texto fuente clave inicio fin linea_inicio linea_fin puntuacion tokens coincidencias")
+
+
+def estimar_tokens(texto):
+    """Tokens aproximados de un texto (cada palabra cuenta por piezas de ~4 letras, cada signo 1)"""
+    total = 0
+    for pieza in _PIEZAS.findall(texto):
+        total += math.ceil(len(pieza) / LETRAS_POR_PIEZA) if pieza[0].isalnum() or pieza[0] == "_" else 1
+    return total
+
+
+def presupuesto_modelo(modelo):
+    """Tokens de contexto recuperado para un modelo (CONTEXTO_MAX_TOKENS tiene prioridad)"""
+    return entero_entorno("CONTEXTO_MAX_TOKENS", PRESUPUESTO_POR_MODELO.get(modelo, PRESUPUESTO_POR_DEFECTO))
+
+
+def cabe_en_tokens(texto, max_tokens):
+    """
+    Indica si un texto cabe en el presupuesto sin recorrer documentos enteros
+
+    En texto normal un token no abarca más de ~8 caracteres con espacios, así
+    que un texto más largo que eso no cabe y no hace falta estimarlo.
+    """
+    return len(texto) <= max_tokens * 8 and estimar_tokens(texto) <= max_tokens
+
+
+def recortar_a_tokens(texto, max_tokens):
+    """Prefijo del texto que cabe en max_tokens, cortado en un salto de línea si es posible"""
+    if cabe_en_tokens(texto, max_tokens):
+        return texto
+    texto = texto[:max_tokens * 8]
+    # Búsqueda binaria sobre la longitud: la estimación crece con el prefijo
+    bajo, alto = 0, len(texto)
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        if estimar_tokens(texto[:medio]) <= max_tokens:
+            bajo = medio
+        else:
+            alto = medio - 1
+    prefijo = texto[:bajo]
+    corte = prefijo.rfind("\n")
+    return prefijo[:corte] if corte > bajo // 2 else prefijo
+
+
+def fragmento_texto(texto, fuente, puntuacion=0.0, coincidencias=None):
+    """Fragmento sin posición en el corpus (definiciones, textos generados, ventanas de un texto suelto)"""
+    return Fragmento(texto, fuente, None, None, None, None, None, puntuacion, estimar_tokens(texto), coincidencias)
+
+
+def fragmentos_corpus(consulta, clave, fuente, k=4, terminos=None, peso=1.0):
+    """
+    Ventanas más relevantes de una entrada del corpus como fragmentos candidatos
+
+    Args:
+        consulta (str): Pregunta del usuario
+        clave (str): Entrada del corpus (p. ej. 'tomo_3')
+        fuente (str): Etiqueta de procedencia
+        k (int): Número de ventanas candidatas
+        terminos (list): Términos ya extraídos (opcional)
+        peso (float): Multiplicador de la puntuación (para priorizar fuentes)
+
+    Returns:
+        list: Fragmentos de mayor a menor puntuación
+    """
+    from utils.corpus import obtener_corpus
+    from utils.recuperacion import obtener_indice_secciones
+
+    indice = obtener_indice_secciones(clave)
+    if indice is None:
+        return []
+    corpus = obtener_corpus()
+    fragmentos = []
+    for ventana in indice.buscar(consulta, k, terminos):
+        texto = corpus.fragmento(clave, ventana.inicio, ventana.fin)
+        fragmentos.append(Fragmento(
+            texto, fuente, clave, ventana.inicio, ventana.fin,
+            ventana.linea_inicio, ventana.linea_fin, ventana.puntuacion * peso, estimar_tokens(texto),
+            ventana.lineas_coincidentes
+        ))
+    return fragmentos
+
+
+class ContextoEmpaquetado:
+    """Fragmentos elegidos, en orden de fuente y de documento, con su procedencia"""
+
+    def __init__(self, fragmentos, presupuesto, descartados):
+        orden_fuentes = {}
+        for fragmento in fragmentos:
+            orden_fuentes.setdefault(fragmento.fuente, len(orden_fuentes))
+        self.fragmentos = sorted(
+            fragmentos,
+            key=lambda f: (orden_fuentes[f.fuente], f.inicio if f.inicio is not None else -1)
+        )
+        self.presupuesto = presupuesto
+        self.descartados = descartados
+        self.tokens = sum(f.tokens for f in fragmentos)
+
+    def __bool__(self):
+        return bool(self.fragmentos)
+
+    def por_fuente(self):
+        """{fuente: [fragmentos]} en orden de aparición"""
+        grupos = {}
+        for fragmento in self.fragmentos:
+            grupos.setdefault(fragmento.fuente, []).append(fragmento)
+        return grupos
+
+    def texto(self, fuente=None, separador=SEPARADOR):
+        """Texto de los fragmentos (de una fuente o de todas)"""
+        return separador.join(f.texto for f in self.fragmentos if fuente is None or f.fuente == fuente)
+
+    def procedencia(self):
+        """Lista de {fuente, clave, lineas, tokens, puntuacion} de cada fragmento elegido"""
+        return [{
+            'fuente': f.fuente,
+            'clave': f.clave,
+            'lineas': [f.linea_inicio + 1, f.linea_fin] if f.linea_inicio is not None else None,
+            'tokens': f.tokens,
+            'puntuacion': round(f.puntuacion, 3),
+        } for f in self.fragmentos]
+
+
+def _recortar_solapamiento(fragmento, elegidos):
+    """
+    Parte del fragmento que no se solapa con los ya elegidos del mismo documento
+
+    Returns:
+        Fragmento: El fragmento (recortado si hacía falta) o None si casi todo estaba repetido
+    """
+    from utils.corpus import obtener_corpus
+
+    inicio, fin = fragmento.inicio, fragmento.fin
+    for otro in elegidos:
+        if otro.clave != fragmento.clave or otro.fin <= inicio or otro.inicio >= fin:
+            continue
+        # Se conserva el tramo libre más largo a un lado del ya elegido
+        if otro.inicio - inicio >= fin - otro.fin:
+            fin = otro.inicio
+        else:
+            inicio = otro.fin
+        if fin <= inicio:
+            return None
+
+    if (inicio, fin) == (fragmento.inicio, fragmento.fin):
+        return fragmento
+    if fin - inicio < 0.4 * (fragmento.fin - fragmento.inicio):
+        return None
+    texto = obtener_corpus().fragmento(fragmento.clave, inicio, fin)
+    return fragmento._replace(texto=texto, inicio=inicio, fin=fin, tokens=estimar_tokens(texto), coincidencias=None)
+
+
+def _dividir_ventana(fragmento, max_tokens):
+    """
+    Sub-ventanas de un fragmento más grande que el presupuesto
+
+    Cada línea coincidente se toma con LINEAS_CONTEXTO_SUBVENTANA líneas a
+    cada lado; las vecinas se unen mientras quepan en max_tokens y una
+    sub-ventana que no cabe se reduce al prefijo que cabe desde su primera
+    línea coincidente. La puntuación del fragmento se reparte según las
+    coincidencias de cada sub-ventana. Sin coincidencias conocidas queda
+    el inicio del fragmento.
+
+    Returns:
+        list: Fragmentos que caben en max_tokens
+    """
+    lineas = fragmento.texto.split("\n")
+    coincidencias = sorted({c for c in fragmento.coincidencias or () if 0 <= c < len(lineas)})
+    if not coincidencias:
+        coincidencias = [0]
+
+    # (inicio, fin, primera coincidencia, número de coincidencias) en líneas del fragmento
+    tramos = []
+    for linea in coincidencias:
+        inicio = max(0, linea - LINEAS_CONTEXTO_SUBVENTANA)
+        fin = min(len(lineas), linea + 1 + LINEAS_CONTEXTO_SUBVENTANA)
+        if tramos:
+            inicio_actual, fin_actual, primera, cuenta = tramos[-1]
+            if linea < fin_actual or (
+                    inicio <= fin_actual and cabe_en_tokens("\n".join(lineas[inicio_actual:fin]), max_tokens)):
+                tramos[-1] = (inicio_actual, max(fin_actual, fin), primera, cuenta + 1)
+                continue
+            inicio = max(inicio, fin_actual)
+        tramos.append((inicio, fin, linea, 1))
+
+    # Desplazamiento en bytes del inicio de cada línea dentro del fragmento
+    desplazamientos = [0]
+    for linea in lineas:
+        desplazamientos.append(desplazamientos[-1] + len(linea.encode("utf-8")) + 1)
+
+    subventanas = []
+    for inicio, fin, primera, cuenta in tramos:
+        texto = "\n".join(lineas[inicio:fin])
+        if not cabe_en_tokens(texto, max_tokens):
+            inicio = primera
+            texto = recortar_a_tokens("\n".join(lineas[inicio:fin]), max_tokens)
+        if not texto.strip():
+            continue
+        posicion = {}
+        if fragmento.inicio is not None:
+            posicion['inicio'] = fragmento.inicio + desplazamientos[inicio]
+            posicion['fin'] = posicion['inicio'] + len(texto.encode("utf-8"))
+        if fragmento.linea_inicio is not None:
+            posicion['linea_inicio'] = fragmento.linea_inicio + inicio
+            posicion['linea_fin'] = posicion['linea_inicio'] + texto.count("\n") + 1
+        subventanas.append(fragmento._replace(
+            texto=texto, puntuacion=fragmento.puntuacion * cuenta / len(coincidencias),
+            tokens=estimar_tokens(texto), coincidencias=None, **posicion
+        ))
+    return subventanas
+
+
+def empaquetar(candidatos, max_tokens):
+    """
+    Elige fragmentos de mayor a menor puntuación hasta el presupuesto
+
+    Un fragmento que no cabe se salta (uno posterior más corto puede caber),
+    salvo que sea más grande que todo el presupuesto: ese se divide antes en
+    sub-ventanas alrededor de sus líneas coincidentes. Los que se solapan con
+    uno ya elegido se recortan a la parte nueva.
+
+    Args:
+        candidatos (list): Fragmentos de una o varias fuentes
+        max_tokens (int): Presupuesto de tokens
+
+    Returns:
+        ContextoEmpaquetado: Fragmentos elegidos con su procedencia
+    """
+    elegidos = []
+    vistos = set()
+    usados = 0
+    descartados = 0
+
+    ajustados = []
+    for fragmento in candidatos:
+        if fragmento.tokens > max_tokens:
+            ajustados.extend(_dividir_ventana(fragmento, max_tokens))
+        else:
+            ajustados.append(fragmento)
+
+    for fragmento in sorted(ajustados, key=lambda f: -f.puntuacion):
+        if fragmento.clave is not None:
+            fragmento = _recortar_solapamiento(fragmento, elegidos)
+            if fragmento is None:
+                descartados += 1
+                continue
+        huella = normalizar(fragmento.texto)
+        if not huella or huella in vistos:
+            descartados += 1
+            continue
+        if usados + fragmento.tokens > max_tokens:
+            descartados += 1
+            continue
+        vistos.add(huella)
+        elegidos.append(fragmento)
+        usados += fragmento.tokens
+
+    return ContextoEmpaquetado(elegidos, max_tokens, descartados)
+
+
+def texto_relevante(consulta, clave, max_tokens, k=4, terminos=None):
+    """
+    Texto más relevante de una entrada del corpus dentro de un presupuesto
+
+    Solo si la consulta no coincide con ninguna sección se usa el inicio
+    del documento recortado al presupuesto (el comportamiento anterior).
+
+    Returns:
+        str: Secciones elegidas (cadena vacía si la entrada no existe)
+    """
+    contexto = empaquetar(fragmentos_corpus(consulta, clave, clave, k, terminos), max_tokens)
+    if contexto:
+        return contexto.texto()
+
+    from utils.corpus import obtener_corpus
+    corpus = obtener_corpus()
+    if not corpus.contiene(clave):
+        return ""
+    # Solo se decodifica un prefijo holgado, no el documento entero
+    return recortar_a_tokens(corpus.fragmento(clave, 0, max_tokens * 8), max_tokens)
@@ -0,0 +1,123 @@
+"""
+Ejecución concurrente de las fuentes de una respuesta híbrida
+
+Las extracciones del reglamento, el glosario y los tomos son independientes
+entre sí: se lanzan a la vez en un pool de hilos acotado y se esperan antes
+de la síntesis. Una fuente que no termina en su tiempo límite se descarta
+(la respuesta se genera con las demás). Con un plazo de consulta activo
+(utils/plazo.py) el tiempo límite nunca invade la reserva de la síntesis y
+las fuentes descartadas quedan registradas como etapas omitidas.
+
+Variables de entorno:
+    FUENTES_PARALELAS=0          Ejecuta las fuentes en serie (modo original)
+    FUENTES_MAX_HILOS=8          Tamaño del pool por proceso
+    FUENTES_TIMEOUT_SEGUNDOS=25  Tiempo límite por fuente
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as TiempoAgotado
+from contextvars import copy_context
+
+from utils.configuracion import bandera_entorno, decimal_entorno, entero_entorno
+from utils.plazo import plazo_actual, reserva_sintesis
+from utils.transmision import con_emisor
+
+MAX_HILOS_POR_DEFECTO = 8
+TIMEOUT_POR_DEFECTO = 25.0
+
+
+def modo_paralelo_activo():
+    """Indica si las fuentes se ejecutan en paralelo (FUENTES_PARALELAS, activo por defecto)"""
+    return bandera_entorno("FUENTES_PARALELAS")
+
+
+# El pool se crea en el primer uso: con preload_app los hilos no sobreviven al fork
+_pool = None
+_pool_lock = threading.Lock()
+
+def obtener_pool():
+    """Pool de hilos del proceso para las fuentes"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=entero_entorno("FUENTES_MAX_HILOS", MAX_HILOS_POR_DEFECTO),
+                    thread_name_prefix="fuente"
+                )
+    return _pool
+
+
+def en_contexto_de_consulta(tarea):
+    """
+    Envuelve una tarea para el pool con el contexto de la consulta actual
+    (plazo, registro de uso...) pero sin el emisor de tokens: las
+    extracciones intermedias nunca se transmiten
+    """
+    contexto = copy_context()
+
+    def ejecutar():
+        with con_emisor(None):
+            return tarea()
+    return lambda: contexto.run(ejecutar)
+
+
+def ejecutar_fuentes(tareas, timeout=None, timeouts=None):
+    """
+    Ejecuta las fuentes y recoge sus resultados
+
+    Args:
+        tareas (dict): {nombre_fuente: función sin argumentos}
+        timeout (float): Tiempo límite por fuente en segundos (FUENTES_TIMEOUT_SEGUNDOS por defecto)
+        timeouts (dict): Tiempos límite específicos {nombre_fuente: segundos} (opcional)
+
+    Returns:
+        dict: {nombre_fuente: resultado} en el orden de `tareas`, sin las fuentes
+              que fallaron, excedieron su tiempo o no devolvieron nada
+    """
+    if timeout is None:
+        timeout = decimal_entorno("FUENTES_TIMEOUT_SEGUNDOS", TIMEOUT_POR_DEFECTO)
+    timeouts = timeouts or {}
+    resultados = {}
+    plazo = plazo_actual()
+    presupuesto = float("inf") if plazo is None else plazo.disponible(reserva_sintesis())
+
+    if not modo_paralelo_activo() or len(tareas) <= 1:
+        for nombre, tarea in tareas.items():
+            if plazo is not None and plazo.disponible(reserva_sintesis()) <= 0:
+                plazo.omitir(nombre)
+                continue
+            try:
+                resultado = tarea()
+            except Exception as e:
+                print(f"❌ Error en la fuente {nombre}: {e}")
+                continue
+            if resultado:
+                resultados[nombre] = resultado
+        return resultados
+
+    inicio = time.monotonic()
+    pool = obtener_pool()
+    futuros = {nombre: pool.submit(en_contexto_de_consulta(tarea)) for nombre, tarea in tareas.items()}
+
+    for nombre, futuro in futuros.items():
+        limite_fuente = min(timeouts.get(nombre, timeout), presupuesto)
+        try:
+            resultado = futuro.result(timeout=max(0.0, inicio + limite_fuente - time.monotonic()))
+        except TiempoAgotado:
+            # El hilo termina por su cuenta; su resultado ya no se usa
+            futuro.cancel()
+            print(f"⏱️ Fuente {nombre} descartada: superó {limite_fuente:.0f}s")
+            if plazo is not None:
+                plazo.omitir(nombre)
+            continue
+        except Exception as e:
+            print(f"❌ Error en la fuente {nombre}: {e}")
+            continue
+        if resultado:
+            resultados[nombre] = resultado
+
+    print(f"⚡ Fuentes en paralelo: {len(resultados)}/{len(tareas)} en {time.monotonic() - inicio:.2f}s")
+    return resultados
@@ -0,0 +1,323 @@
+"""
+Índice del glosario (Tomo 12) para búsquedas de términos
+
+El glosario se analiza una sola vez en entradas estructuradas (término,
+definición, categoría) y se indexa, sin acentos, con:
+    - un diccionario término -> entradas (coincidencia exacta)
+    - un trie por palabras (términos compuestos que empiezan igual)
+    - postings palabra -> entradas (términos compuestos con palabras comunes)
+    - postings de trigramas de caracteres (contención dentro de un término)
+
+Los niveles de confianza son los de la búsqueda original (100/95/90/70/60/50/40).
+Si un término no coincide con nada se reintenta con la ortografía corregida
+(utils/corrector_ortografico.py).
+Admite los dos formatos de glosario: encabezados **Término**: / **TÉRMINO**:
+y la lista numerada del Tomo 12 ("12. Término — definición").
+"""
+
+import re
+import threading
+from collections import namedtuple
+
+from utils.procesador_texto import normalizar, quitar_acentos
+
+# Líneas de definición que se conservan después del término (como la búsqueda original)
+MAX_LINEAS_DEFINICION = 14
+# Consultas recordadas por el índice (se vacía al llenarse)
+MAX_CACHE_CONSULTAS = 4096
+
+EntradaGlosario = namedtuple("EntradaGlosario", "termino definicion categoria texto")
+
+# "12. Término — definición" (el OCR confunde dígitos con O/o/l/I y añade puntos sueltos)
+_PATRON_NUMERADA = re.compile(r"^\s*[0-9OolI]{1,3}\s*\.[\s\.·\-—–|\"“]*(.+)$")
+# Separador término/definición: raya, guion con espacio, guion pegado a mayúscula o dos puntos
+_PATRON_SEPARADOR = re.compile(r"\s*(?:[—–]|\s-|-(?=\s)|-(?=[A-ZÁÉÍÓÚÑ])|:(?=\s))\s*")
+_PATRON_INICIO_TERMINO = re.compile(r"^[^\W\d_]")
+# Líneas de paginación del texto extraído
+_PATRON_PAGINACION = re.compile(r"^(=+|GLOSARIO - PÁGINA \d+|Método: .*|(\d+ \| )?REGLAMENTO CONJUNTO( \| \d+)?|[A-Z]\|?)$")
+
+
+def _clave(texto):
+    """Forma normalizada de un término: minúsculas, sin acentos y espacios simples"""
+    return " ".join(normalizar(texto).split())
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _analizar_formato_negritas(lineas):
+    """Entradas con encabezados **Término**: o **TÉRMINO**: Término"""
+    entradas = []
+    for i, linea in enumerate(lineas):
+        linea = linea.strip()
+        if not (linea.startswith('**') and '**:' in linea):
+            continue
+
+        termino = ""
+        if linea.startswith('**TÉRMINO**:'):
+            termino = linea.replace('**TÉRMINO**:', '').strip()
+        elif not linea.startswith('**DEFINICIÓN**:') and not linea.startswith('**CATEGORÍA**:'):
+            fin = linea.find('**:', 2)
+            if fin > 2:
+                termino = linea[2:fin].strip()
+        if not termino:
+            continue
+
+        contenido = []
+        definicion = []
+        categoria = None
+        for j in range(i + 1, min(len(lineas), i + 1 + MAX_LINEAS_DEFINICION)):
+            linea_sig = lineas[j].strip()
+            if linea_sig.startswith('**TÉRMINO**:'):
+                break
+            if (linea_sig.startswith('**') and '**:' in linea_sig and
+                    not linea_sig.startswith('**DEFINICIÓN') and
+                    not linea_sig.startswith('**CATEGORÍA')):
+                break
+            if not linea_sig and j + 1 < len(lineas) and lineas[j + 1].strip().startswith('**TÉRMINO**:'):
+                break
+            if linea_sig.startswith('**CATEGORÍA'):
+                contenido.append(linea_sig)
+                categoria = linea_sig.split('**:', 1)[-1].strip() or None
+            elif linea_sig.startswith('**DEFINICIÓN'):
+                contenido.append(linea_sig)
+                definicion.append(linea_sig.split('**:', 1)[-1].strip())
+            elif linea_sig and len(linea_sig) > 3 and not linea_sig.startswith('**'):
+                contenido.append(linea_sig)
+                definicion.append(linea_sig)
+
+        texto = (linea + '\n' + '\n'.join(contenido)).strip()
+        if contenido and len(texto) > 10:
+            entradas.append(EntradaGlosario(termino, ' '.join(definicion), categoria, texto))
+    return entradas
+
+
+def _analizar_formato_numerado(lineas):
+    """Entradas de la lista numerada del Tomo 12 (categoría: letra inicial del término)"""
+    entradas = []
+    actual = None
+
+    def cerrar():
+        if actual is None:
+            return
+        termino, lineas_entrada, categoria = actual
+        texto = '\n'.join(lineas_entrada).strip()
+        definicion = _PATRON_SEPARADOR.split(texto, maxsplit=1)[-1].replace('\n', ' ')
+        if definicion and len(texto) > 10:
+            entradas.append(EntradaGlosario(termino, definicion, categoria, texto))
+
+    for linea in lineas:
+        linea = linea.strip().rstrip('|').strip()
+        if not linea:
+            continue
+        if _PATRON_PAGINACION.match(linea):
+            continue
+
+        coincidencia = _PATRON_NUMERADA.match(linea)
+        if coincidencia:
+            cuerpo = coincidencia.group(1)
+            partes = _PATRON_SEPARADOR.split(cuerpo, maxsplit=1)
+            termino = partes[0].strip()
+            if (len(partes) == 2 and partes[1] and _PATRON_INICIO_TERMINO.match(termino)
+                    and len(termino) <= 100 and len(termino.split()) <= 12):
+                cerrar()
+                actual = (termino, [cuerpo], f"Letra {quitar_acentos(termino[0]).upper()}")
+                continue
+
+        # Continuación de la definición en curso
+        if actual is not None and len(actual[1]) <= MAX_LINEAS_DEFINICION:
+            actual[1].append(linea)
+
+    cerrar()
+    return entradas
+
+
+def analizar_glosario(texto):
+    """
+    Divide el glosario en entradas estructuradas
+
+    Args:
+        texto (str): Contenido del glosario
+
+    Returns:
+        list: EntradaGlosario en el orden del documento
+    """
+    lineas = texto.split('\n')
+    entradas = _analizar_formato_negritas(lineas)
+    if not entradas:
+        entradas = _analizar_formato_numerado(lineas)
+    return entradas
+
+
+class IndiceGlosario:
+    """Índices en memoria sobre las entradas del glosario"""
+
+    def __init__(self, texto, corregir_ortografia=True):
+        self.corregir_ortografia = corregir_ortografia
+        self.entradas = analizar_glosario(texto)
+        self.claves = [_clave(entrada.termino) for entrada in self.entradas]
+        self.exacto = {}
+        self.trie = {}
+        self.palabras = {}
+        self.trigramas = {}
+        self._cache = {}
+
+        for id_entrada, clave in enumerate(self.claves):
+            self.exacto.setdefault(clave, []).append(id_entrada)
+            palabras = clave.split()
+
+            if len(palabras) > 1:
+                # Cada nodo guarda las entradas compuestas que empiezan con esas palabras
+                nodo = self.trie
+                for palabra in palabras:
+                    nodo = nodo.setdefault(palabra, {})
+                    nodo.setdefault(None, []).append(id_entrada)
+                for palabra in set(palabras):
+                    self.palabras.setdefault(palabra, []).append(id_entrada)
+
+            for trigrama in _trigramas(clave):
+                self.trigramas.setdefault(trigrama, set()).add(id_entrada)
+
+    def _candidatos(self, consulta):
+        """
+        Confianza de cada entrada para una consulta ya normalizada
+
+        Returns:
+            dict: {id_entrada: confianza}
+        """
+        confianzas = {}
+        palabras_busqueda = consulta.split()
+        compuesta = len(palabras_busqueda) > 1
+
+        # 1. Coincidencia exacta
+        for id_entrada in self.exacto.get(consulta, ()):
+            confianzas[id_entrada] = 100
+
+        # 2. Términos compuestos (consulta y término con varias palabras)
+        if compuesta:
+            nodo = self.trie
+            for palabra in palabras_busqueda:
+                nodo = nodo.get(palabra)
+                if nodo is None:
+                    break
+            for id_entrada in (nodo or {}).get(None, ()):
+                confianzas.setdefault(id_entrada, 95)
+
+            significativas = [p for p in palabras_busqueda if len(p) > 2]
+            coincidencias = {}
+            for palabra in significativas:
+                for id_entrada in self.palabras.get(palabra, ()):
+                    coincidencias[id_entrada] = coincidencias.get(id_entrada, 0) + 1
+            for id_entrada, palabras_coinciden in coincidencias.items():
+                if id_entrada in confianzas:
+                    continue
+                if palabras_coinciden == len(palabras_busqueda):
+                    confianzas[id_entrada] = 90
+                elif palabras_coinciden >= max(1, len(palabras_busqueda) * 0.7):
+                    confianzas[id_entrada] = 70
+
+        # 3. Contención significativa (si uno de los dos es una sola palabra)
+        if len(consulta) >= 5:
+            def admite(id_entrada):
+                return id_entrada not in confianzas and not (compuesta and ' ' in self.claves[id_entrada])
+
+            # La consulta está dentro del término del glosario
+            conjuntos = sorted((self.trigramas.get(t, set()) for t in _trigramas(consulta)), key=len)
+            posibles = set.intersection(*conjuntos) if conjuntos and conjuntos[0] else set()
+            for id_entrada in posibles:
+                clave = self.claves[id_entrada]
+                if admite(id_entrada) and consulta in clave:
+                    ratio = len(consulta) / len(clave)
+                    if ratio >= 0.6:
+                        confianzas[id_entrada] = 60
+                    elif ratio >= 0.4:
+                        confianzas[id_entrada] = 40
+
+            # El término del glosario está dentro de la consulta (debe cubrir al menos el 60%)
+            minimo = -(-len(consulta) * 6 // 10)
+            for longitud in range(minimo, len(consulta)):
+                for inicio in range(len(consulta) - longitud + 1):
+                    for id_entrada in self.exacto.get(consulta[inicio:inicio + longitud], ()):
+                        if admite(id_entrada):
+                            confianzas[id_entrada] = 50
+
+        return confianzas
+
+    def buscar(self, termino):
+        """
+        Definiciones de un término con las mismas reglas de la búsqueda original
+
+        Args:
+            termino (str): Término a buscar
+
+        Returns:
+            list: Textos de las definiciones o None si no hay coincidencias
+        """
+        consulta = _clave(termino)
+        if consulta in self._cache:
+            return self._cache[consulta]
+
+        confianzas = self._candidatos(consulta) if consulta else {}
+        if not confianzas and consulta and self.corregir_ortografia:
+            # Sin coincidencias: reintentar con la ortografía corregida ("zonificasion")
+            from utils.corrector_ortografico import obtener_corrector
+            corregida = obtener_corrector().corregir_texto(consulta)
+            if corregida != consulta:
+                confianzas = self._candidatos(corregida)
+        # Mayor confianza primero; en empate, el orden del glosario
+        candidatos = sorted(confianzas.items(), key=lambda c: (-c[1], c[0]))
+
+        resultado = None
+        if candidatos:
+            mejor_id, mejor_confianza = candidatos[0]
+            if mejor_confianza >= 95:
+                resultado = [self.entradas[mejor_id].texto]
+            elif mejor_confianza >= 90:
+                # Priorizar términos compuestos
+                compuestos = [i for i, c in candidatos if c >= 90 and ' ' in self.claves[i]]
+                resultado = [self.entradas[(compuestos or [mejor_id])[0]].texto]
+            else:
+                resultado = [self.entradas[i].texto for i, c in candidatos[:3] if c >= 40] or None
+
+        if len(self._cache) >= MAX_CACHE_CONSULTAS:
+            self._cache.clear()
+        self._cache[consulta] = resultado
+        return resultado
+
+    def buscar_varios(self, terminos):
+        """
+        Búsqueda en lote
+
+        Args:
+            terminos (list): Términos a buscar
+
+        Returns:
+            dict: {termino: definiciones} solo para los términos encontrados
+        """
+        resultados = {}
+        for termino in terminos:
+            definiciones = self.buscar(termino)
+            if definiciones:
+                resultados[termino] = definiciones
+        return resultados
+
+
+_indice_glosario = None
+_indice_lock = threading.Lock()
+
+def obtener_indice_glosario():
+    """
+    Índice del glosario del corpus compartido (se construye una vez)
+
+    Returns:
+        IndiceGlosario: Índice del glosario
+    """
+    global _indice_glosario
+    if _indice_glosario is None:
+        with _indice_lock:
+            if _indice_glosario is None:
+                from utils.corpus import obtener_corpus
+                _indice_glosario = IndiceGlosario(obtener_corpus().glosario)
+                print(f"✅ Índice del glosario construido: {len(_indice_glosario.entradas)} términos")
+    return _indice_glosario
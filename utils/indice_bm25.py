@@ -0,0 +1,105 @@
+"""
+Índice invertido con ranking BM25 sobre los tomos mejorados
+
+Se construye una sola vez por proceso (en el master de gunicorn con
+preload_app) y responde la relevancia de todos los tomos en una pasada,
+sin abrir archivos por solicitud.
+"""
+
+import math
+import threading
+from collections import Counter
+
+from utils.procesador_texto import tokenizar, terminos_consulta
+
+
+class IndiceBM25:
+    """Índice invertido término -> {documento: frecuencia} con puntuación BM25"""
+
+    def __init__(self, documentos, k1=1.5, b=0.75):
+        """
+        Args:
+            documentos (dict): {id_documento: texto}
+            k1 (float): Saturación de la frecuencia del término
+            b (float): Normalización por longitud del documento
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.longitudes = {}
+
+        for id_documento, texto in documentos.items():
+            frecuencias = Counter(tokenizar(texto))
+            self.longitudes[id_documento] = sum(frecuencias.values())
+            for termino, frecuencia in frecuencias.items():
+                self.postings.setdefault(termino, {})[id_documento] = frecuencia
+
+        total = len(self.longitudes)
+        self.longitud_media = (sum(self.longitudes.values()) / total) if total else 0
+        self.idf = {
+            termino: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for termino, docs in self.postings.items()
+        }
+        # Normalización de longitud precalculada por documento
+        self._norma = {
+            id_documento: self.k1 * (1 - self.b + self.b * longitud / (self.longitud_media or 1))
+            for id_documento, longitud in self.longitudes.items()
+        }
+
+    def puntuar(self, consulta, terminos=None):
+        """
+        Puntuación BM25 de todos los documentos para una consulta
+
+        Args:
+            consulta (str): Pregunta del usuario
+            terminos (list): Términos ya extraídos (opcional)
+
+        Returns:
+            dict: {id_documento: puntuación} solo para documentos con puntuación > 0
+        """
+        if terminos is None:
+            terminos = terminos_consulta(consulta)
+
+        puntuaciones = {}
+        for termino in terminos:
+            docs = self.postings.get(termino)
+            if not docs:
+                continue
+            idf = self.idf[termino]
+            for id_documento, frecuencia in docs.items():
+                puntuacion = idf * frecuencia * (self.k1 + 1) / (frecuencia + self._norma[id_documento])
+                puntuaciones[id_documento] = puntuaciones.get(id_documento, 0.0) + puntuacion
+        return puntuaciones
+
+    def mejores(self, consulta, n=2, terminos=None):
+        """
+        Documentos más relevantes
+
+        Returns:
+            list: Tuplas (puntuación, id_documento) de mayor a menor
+        """
+        puntuaciones = self.puntuar(consulta, terminos)
+        ranking = sorted(((p, d) for d, p in puntuaciones.items() if p > 0), reverse=True)
+        return ranking[:n]
+
+
+_indice_tomos = None
+_indice_lock = threading.Lock()
+
+def obtener_indice_tomos():
+    """
+    Índice BM25 de los tomos 1-11 del corpus compartido (se construye una vez)
+
+    Returns:
+        IndiceBM25: Índice con id_documento = número de tomo
+    """
+    global _indice_tomos
+    if _indice_tomos is None:
+        with _indice_lock:
+            if _indice_tomos is None:
+                from utils.corpus import obtener_corpus
+                tomos = obtener_corpus().tomos
+                documentos = {numero: tomos[numero] for numero in tomos if numero <= 11}
+                _indice_tomos = IndiceBM25(documentos)
+                print(f"✅ Índice BM25 de tomos construido: {len(documentos)} tomos, {len(_indice_tomos.postings)} términos")
+    return _indice_tomos
@@ -0,0 +1,341 @@
+"""
+Métricas de latencia por etapa en formato Prometheus (/metrics)
+
+- medir(etapa) mide un bloque o, como decorador, una función. Dentro de una
+  solicitud de chat (medir_solicitud) las mediciones se guardan hasta el
+  final para etiquetarlas con el 'tipo' de la respuesta, que solo se conoce
+  entonces; las tareas del pool heredan la solicitud con el contexto.
+- medir_llm(modelo, ruta) mide cada llamada al modelo de la pasarela; los
+  tokens y el costo de cada llamada los cuenta utils/consumo_llm.py.
+
+Cada worker acumula sus valores en memoria y un hilo los vuelca a una tabla
+del archivo SQLite de las cachés cada METRICAS_INTERVALO_SEGUNDOS; /metrics
+suma las filas de todos los workers (los demás pueden ir hasta un intervalo
+por detrás). La tabla se vacía al crear las métricas, en el master de
+gunicorn (preload_app): los contadores empiezan de cero en cada arranque.
+
+Variables de entorno:
+    METRICAS=1                       0 desactiva las métricas
+    METRICAS_INTERVALO_SEGUNDOS=5    Cada cuánto vuelca cada worker sus valores
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.configuracion import bandera_entorno, decimal_entorno
+
+# Límites superiores de los buckets de los histogramas (segundos)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+METRICAS = {
+    'jp_solicitudes_total': ('counter', 'Solicitudes de chat por endpoint y tipo de respuesta'),
+    'jp_solicitud_segundos': ('histogram', 'Duración de las solicitudes de chat por endpoint y tipo de respuesta'),
+    'jp_etapa_segundos': ('histogram', 'Duración de cada etapa del pipeline por tipo de respuesta'),
+    'jp_llm_segundos': ('histogram', 'Duración de las llamadas al modelo (incluye espera de turno y reintentos)'),
+    'jp_llm_tokens_total': ('counter', 'Tokens informados por la API del modelo por ruta del pipeline'),
+    'jp_llm_costo_usd_total': ('counter', 'Costo estimado en USD de las llamadas al modelo por ruta del pipeline'),
+}
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS metricas (
+    pid INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    etiquetas TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    PRIMARY KEY (pid, nombre, etiquetas)
+);
+"""
+
+_solicitud = ContextVar("medicion_solicitud", default=None)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _formato_etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + "}"
+
+
+def _formato_numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) and not valor.is_integer() else str(int(valor))
+
+
+class Metricas:
+    """Contadores e histogramas del proceso, volcados a SQLite para sumarlos entre workers"""
+
+    def __init__(self, ruta, intervalo=5.0):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._valores = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+        self._sucio = False
+        self.errores_sqlite = 0
+
+        try:
+            conexion = self._conexion()
+            with conexion:
+                # Los valores de arranques anteriores no se suman a los de este
+                conexion.execute("DELETE FROM metricas")
+        except sqlite3.Error as e:
+            self._error_sqlite("inicializando", e)
+
+    def _conexion(self):
+        from utils.cache_respuestas import conexion_sqlite
+        return conexion_sqlite(self._local, self.ruta, _ESQUEMA)
+
+    def _error_sqlite(self, accion, error):
+        self.errores_sqlite += 1
+        print(f"⚠️ Métricas: error {accion} ({error})")
+
+    def _preparar_proceso(self):
+        """Valores e hilo de volcado propios del proceso (los del master no se suman a los workers)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._valores = {}
+                self._sucio = False
+                threading.Thread(target=self._bucle_volcado, name="metricas", daemon=True).start()
+                self._pid = os.getpid()
+
+    def contar(self, nombre, valor=1, **etiquetas):
+        """Suma `valor` a un contador"""
+        self._preparar_proceso()
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+            self._sucio = True
+
+    def observar(self, nombre, segundos, **etiquetas):
+        """Registra una duración en un histograma"""
+        self._preparar_proceso()
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._valores.get(clave)
+            if histograma is None:
+                # Un contador por bucket (el último es +Inf), la suma y el total de observaciones
+                histograma = self._valores[clave] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+            indice = next((i for i, limite in enumerate(BUCKETS) if segundos <= limite), len(BUCKETS))
+            histograma[indice] += 1
+            histograma[-2] += segundos
+            histograma[-1] += 1
+            self._sucio = True
+
+    def _bucle_volcado(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.volcar()
+
+    def volcar(self):
+        """Escribe los valores acumulados del proceso en la tabla compartida"""
+        with self._lock:
+            if not self._sucio:
+                return
+            filas = [
+                (os.getpid(), nombre, json.dumps(etiquetas), json.dumps(valor))
+                for (nombre, etiquetas), valor in self._valores.items()
+            ]
+            self._sucio = False
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.executemany(
+                    "INSERT OR REPLACE INTO metricas (pid, nombre, etiquetas, valor) VALUES (?, ?, ?, ?)", filas
+                )
+        except sqlite3.Error as e:
+            self._sucio = True
+            self._error_sqlite("volcando", e)
+
+    def _agregados(self):
+        """Valores de todos los workers sumados por (nombre, etiquetas)"""
+        self.volcar()
+        agregados = {}
+        try:
+            filas = self._conexion().execute("SELECT nombre, etiquetas, valor FROM metricas").fetchall()
+        except sqlite3.Error as e:
+            self._error_sqlite("leyendo", e)
+            # Sin la tabla, al menos los valores de este worker
+            with self._lock:
+                filas = [(nombre, json.dumps(etiquetas), json.dumps(valor))
+                         for (nombre, etiquetas), valor in self._valores.items()]
+        for nombre, etiquetas, valor in filas:
+            clave = (nombre, tuple(tuple(par) for par in json.loads(etiquetas)))
+            valor = json.loads(valor)
+            anterior = agregados.get(clave)
+            if anterior is None:
+                agregados[clave] = valor
+            elif isinstance(valor, list):
+                agregados[clave] = [a + b for a, b in zip(anterior, valor)]
+            else:
+                agregados[clave] = anterior + valor
+        return agregados
+
+    def series(self, nombre):
+        """
+        Series de una métrica sumadas entre workers
+
+        Returns:
+            list: [(etiquetas (dict), valor)] (el valor de un histograma es su lista de buckets, suma y total)
+        """
+        return [(dict(etiquetas), valor) for (clave, etiquetas), valor in self._agregados().items() if clave == nombre]
+
+    def exposicion(self):
+        """
+        Métricas de todos los workers en el formato de texto de Prometheus
+
+        Returns:
+            str: Cuerpo para /metrics
+        """
+        agregados = self._agregados()
+        lineas = []
+        for nombre, (tipo, ayuda) in METRICAS.items():
+            series = sorted((etiquetas, valor) for (clave, etiquetas), valor in agregados.items() if clave == nombre)
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for etiquetas, valor in series:
+                if tipo == 'counter':
+                    lineas.append(f"{nombre}{_formato_etiquetas(etiquetas)} {_formato_numero(valor)}")
+                    continue
+                acumulado = 0
+                for limite, cuenta in zip(BUCKETS + ("+Inf",), valor[:-2]):
+                    acumulado += cuenta
+                    le = limite if limite == "+Inf" else _formato_numero(limite)
+                    lineas.append(f"{nombre}_bucket{_formato_etiquetas(etiquetas, ('le', le))} {acumulado}")
+                lineas.append(f"{nombre}_sum{_formato_etiquetas(etiquetas)} {valor[-2]!r}")
+                lineas.append(f"{nombre}_count{_formato_etiquetas(etiquetas)} {valor[-1]}")
+        lineas.append("# HELP jp_metricas_errores_sqlite Errores de SQLite de las métricas en el worker que responde")
+        lineas.append("# TYPE jp_metricas_errores_sqlite gauge")
+        lineas.append(f"jp_metricas_errores_sqlite {self.errores_sqlite}")
+        return "\n".join(lineas) + "\n"
+
+
+class MetricasDesactivadas:
+    """Misma interfaz que Metricas sin acumular nada (METRICAS=0)"""
+
+    def contar(self, nombre, valor=1, **etiquetas):
+        pass
+
+    def observar(self, nombre, segundos, **etiquetas):
+        pass
+
+    def volcar(self):
+        pass
+
+    def series(self, nombre):
+        return []
+
+    def exposicion(self):
+        return ""
+
+
+class MedicionSolicitud:
+    """Mediciones de las etapas de una solicitud, pendientes hasta conocer su tipo"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.tipo = "desconocido"
+        self._lock = threading.Lock()
+        self.etapas = []
+
+    def anotar(self, etapa, segundos):
+        with self._lock:
+            self.etapas.append((etapa, segundos))
+
+
+@contextmanager
+def medir_solicitud(endpoint):
+    """
+    Mide una solicitud de chat; al salir registra su duración y la de sus etapas con su tipo
+
+    Args:
+        endpoint (str): Ruta HTTP ('/chat', '/chat/stream')
+
+    Yields:
+        MedicionSolicitud: Asignar .tipo con el 'type' de la respuesta
+    """
+    medicion = MedicionSolicitud(endpoint)
+    token = _solicitud.set(medicion)
+    inicio = time.monotonic()
+    try:
+        yield medicion
+    except Exception:
+        medicion.tipo = "error"
+        raise
+    finally:
+        _solicitud.reset(token)
+        metricas = obtener_metricas()
+        metricas.contar("jp_solicitudes_total", endpoint=endpoint, tipo=medicion.tipo)
+        metricas.observar("jp_solicitud_segundos", time.monotonic() - inicio, endpoint=endpoint, tipo=medicion.tipo)
+        for etapa, segundos in medicion.etapas:
+            metricas.observar("jp_etapa_segundos", segundos, etapa=etapa, tipo=medicion.tipo)
+
+
+@contextmanager
+def medir(etapa):
+    """
+    Mide una etapa del pipeline (bloque with o decorador @medir("etapa"))
+
+    Args:
+        etapa (str): Nombre de la etapa en la etiqueta 'etapa'
+    """
+    inicio = time.monotonic()
+    try:
+        yield
+    finally:
+        segundos = time.monotonic() - inicio
+        medicion = _solicitud.get()
+        if medicion is not None:
+            medicion.anotar(etapa, segundos)
+        else:
+            # Fuera de una solicitud de chat (tareas de fondo, otros endpoints)
+            obtener_metricas().observar("jp_etapa_segundos", segundos, etapa=etapa, tipo="sin_solicitud")
+
+
+@contextmanager
+def medir_llm(modelo, ruta):
+    """Mide una llamada al modelo como etapa 'llm' y en jp_llm_segundos por modelo, ruta y resultado"""
+    inicio = time.monotonic()
+    resultado = "error"
+    try:
+        with medir("llm"):
+            yield
+        resultado = "ok"
+    finally:
+        obtener_metricas().observar("jp_llm_segundos", time.monotonic() - inicio,
+                                    modelo=modelo or "desconocido", ruta=ruta, resultado=resultado)
+
+
+_metricas = None
+_metricas_lock = threading.Lock()
+
+def obtener_metricas():
+    """
+    Métricas del proceso
+
+    Returns:
+        Metricas: Registro compartido entre workers (MetricasDesactivadas si METRICAS=0)
+    """
+    global _metricas
+    if _metricas is None:
+        with _metricas_lock:
+            if _metricas is None:
+                if not bandera_entorno("METRICAS"):
+                    _metricas = MetricasDesactivadas()
+                else:
+                    from utils.cache_respuestas import ruta_cache_por_defecto
+                    _metricas = Metricas(
+                        ruta=ruta_cache_por_defecto(),
+                        intervalo=decimal_entorno("METRICAS_INTERVALO_SEGUNDOS", 5.0),
+                    )
+    return _metricas
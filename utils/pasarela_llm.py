@@ -0,0 +1,445 @@
+"""
+Pasarela única hacia la API de Anthropic
+
+Todas las llamadas al modelo (app.py, claude_adapter, mini-especialistas)
+usan el mismo cliente del proceso:
+
+- Un pool HTTP con keep-alive: no se repite el handshake TLS en cada llamada.
+- Tiempos límite de conexión y de lectura por llamada, recortados al plazo
+  restante de la consulta (utils/plazo.py).
+- Un semáforo que limita las llamadas simultáneas por worker; el tiempo que
+  cada llamada espera turno se mide y aparece en /estadisticas.
+- Reintentos con backoff exponencial y jitter ante errores transitorios
+  (conexión, 429, 5xx, 529) y un circuito que, tras varias fallas seguidas,
+  rechaza las llamadas al instante durante un enfriamiento: mientras está
+  abierto la app responde con el buscador local de emergencia.
+
+El cliente real se crea en la primera llamada de cada proceso: con
+preload_app las conexiones abiertas en el master no deben heredarse tras el
+fork.
+
+Variables de entorno:
+    LLM_MAX_CONCURRENTES=8        Llamadas simultáneas por worker
+    LLM_ESPERA_MAXIMA_SEGUNDOS=30 Tiempo máximo en cola antes de rechazar la llamada
+    LLM_TIMEOUT_CONEXION=5        Segundos para abrir la conexión
+    LLM_TIMEOUT_LECTURA=60        Segundos de espera de la respuesta
+    LLM_MAX_CONEXIONES=16         Conexiones del pool HTTP (keep-alive)
+    LLM_REINTENTOS=2              Reintentos ante errores transitorios
+    LLM_BACKOFF_BASE_SEGUNDOS=0.5 Espera base del backoff (se duplica en cada intento)
+    LLM_CIRCUITO_FALLOS=5         Llamadas fallidas seguidas (tras sus reintentos) que abren el circuito
+    LLM_CIRCUITO_ENFRIAMIENTO=60  Segundos con el circuito abierto antes de probar de nuevo
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import anthropic
+
+from utils.configuracion import decimal_entorno, entero_entorno
+from utils.consumo_llm import anotar_falla, anotar_llamada, ruta_actual
+from utils.metricas import medir_llm
+from utils.plazo import PlazoAgotado, plazo_actual
+
+
+BACKOFF_MAXIMO = 8.0
+
+
+class PasarelaSaturada(Exception):
+    """La llamada esperó turno más que LLM_ESPERA_MAXIMA_SEGUNDOS"""
+
+
+class CircuitoAbierto(Exception):
+    """El servicio falló repetidamente: la llamada se rechaza sin intentarla"""
+
+
+def _codigo_http(error):
+    return getattr(error, "status_code", None)
+
+
+def es_reintentable(error):
+    """Errores transitorios: conexión, tiempo agotado, 408/409/429 y 5xx (529 = sobrecarga)"""
+    if isinstance(error, (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)):
+        return True
+    codigo = _codigo_http(error)
+    return codigo is not None and (codigo in (408, 409, 429) or codigo >= 500)
+
+
+def es_falla_del_servicio(error):
+    """Errores que cuentan para el circuito (transitorios y credenciales rechazadas)"""
+    return es_reintentable(error) or _codigo_http(error) in (401, 403)
+
+
+class Circuito:
+    """
+    Circuit breaker del proceso
+
+    Cerrado: las llamadas pasan. Tras `umbral_fallos` fallas seguidas se abre y
+    rechaza todo durante `enfriamiento` segundos; luego deja pasar una sola
+    llamada de prueba (semiabierto): si funciona se cierra, si falla se reabre.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallos=5, enfriamiento=60.0):
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self._lock = threading.Lock()
+        self._estado = self.CERRADO
+        self._fallos_seguidos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self.aperturas = 0
+        self.rechazadas = 0
+
+    def abierto(self):
+        """Indica si las llamadas se están rechazando (abierto y sin cumplir el enfriamiento)"""
+        with self._lock:
+            return (self._estado == self.ABIERTO
+                    and time.monotonic() - self._abierto_desde < self.enfriamiento)
+
+    def permitir(self):
+        """
+        Autoriza una llamada
+
+        Raises:
+            CircuitoAbierto: Si el circuito está abierto o ya hay una prueba en curso
+        """
+        with self._lock:
+            if self._estado == self.ABIERTO and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+                self._estado = self.SEMIABIERTO
+            if self._estado == self.CERRADO:
+                return
+            if self._estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return
+            self.rechazadas += 1
+        raise CircuitoAbierto("Servicio de IA no disponible (circuito abierto)")
+
+    def registrar(self, exito):
+        """
+        Registra el resultado de una llamada autorizada
+
+        Args:
+            exito (bool): True si el servicio respondió, False si falló y None si
+                          la llamada no llegó a probar el servicio
+        """
+        with self._lock:
+            self._prueba_en_curso = False
+            if exito is None:
+                return
+            if exito:
+                if self._estado != self.CERRADO:
+                    print("✅ Servicio de IA recuperado: circuito cerrado")
+                self._estado = self.CERRADO
+                self._fallos_seguidos = 0
+                return
+            self._fallos_seguidos += 1
+            if self._estado == self.SEMIABIERTO or self._fallos_seguidos >= self.umbral_fallos:
+                if self._estado != self.ABIERTO:
+                    self.aperturas += 1
+                    print(f"🚨 Circuito abierto tras {self._fallos_seguidos} fallas: "
+                          f"respuestas locales durante {self.enfriamiento:.0f}s")
+                self._estado = self.ABIERTO
+                self._abierto_desde = time.monotonic()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'estado': self._estado,
+                'fallos_seguidos': self._fallos_seguidos,
+                'aperturas': self.aperturas,
+                'rechazadas': self.rechazadas,
+            }
+
+
+def _tiempo_limite(tope=None):
+    """
+    Tiempos límite de una llamada (LLM_TIMEOUT_LECTURA y LLM_TIMEOUT_CONEXION)
+
+    Args:
+        tope (float): Segundos que ninguno de los dos puede superar (el plazo restante)
+
+    Returns:
+        httpx.Timeout: Límites de lectura/escritura y de conexión
+    """
+    import httpx
+
+    lectura = decimal_entorno("LLM_TIMEOUT_LECTURA", 60.0)
+    conexion = decimal_entorno("LLM_TIMEOUT_CONEXION", 5.0)
+    if tope is not None:
+        lectura, conexion = min(lectura, tope), min(conexion, tope)
+    return httpx.Timeout(lectura, connect=conexion)
+
+
+def _crear_cliente():
+    """Cliente Anthropic con pool HTTP persistente y tiempos límite"""
+    import httpx
+
+    timeout = _tiempo_limite()
+    max_conexiones = entero_entorno("LLM_MAX_CONEXIONES", 16)
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_conexiones,
+            max_keepalive_connections=max_conexiones,
+            keepalive_expiry=60.0,
+        ),
+    )
+    return anthropic.Anthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        http_client=http_client,
+        timeout=timeout,
+        # Los reintentos los hace la pasarela (con backoff y circuito)
+        max_retries=0,
+    )
+
+
+class _Mensajes:
+    """Equivalente de client.messages que pasa por el semáforo de la pasarela"""
+
+    def __init__(self, pasarela):
+        self._pasarela = pasarela
+
+    def create(self, **parametros):
+        modelo = parametros.get("model")
+        inicio = time.monotonic()
+        try:
+            with medir_llm(modelo, ruta_actual()):
+                respuesta = self._pasarela.llamar(
+                    lambda cliente, opciones: cliente.messages.create(**parametros, **opciones)
+                )
+        except Exception:
+            anotar_falla()
+            raise
+        anotar_llamada(respuesta, modelo, time.monotonic() - inicio)
+        return respuesta
+
+    @contextmanager
+    def stream(self, **parametros):
+        # Sin reintentos: los tokens ya emitidos no se pueden retirar.
+        # El turno se mantiene mientras llegan los tokens
+        modelo = parametros.get("model")
+        inicio = time.monotonic()
+        try:
+            with medir_llm(modelo, ruta_actual()), self._pasarela.intento(), self._pasarela.turno():
+                opciones = self._pasarela.opciones_plazo()
+                with self._pasarela.cliente().messages.stream(**parametros, **opciones) as stream:
+                    yield stream
+                    anotar_llamada(stream.get_final_message(), modelo, time.monotonic() - inicio)
+        except Exception:
+            anotar_falla()
+            raise
+
+
+class PasarelaLLM:
+    """Cliente Anthropic compartido con límite de concurrencia y métricas de cola"""
+
+    def __init__(self, max_concurrentes=8, espera_maxima=30.0, reintentos=2, backoff_base=0.5,
+                 circuito=None, fabrica_cliente=_crear_cliente):
+        self.max_concurrentes = max_concurrentes
+        self.espera_maxima = espera_maxima
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.circuito = circuito or Circuito()
+        self._fabrica_cliente = fabrica_cliente
+        self.messages = _Mensajes(self)
+
+        self._lock = threading.Lock()
+        self._cliente = None
+        self._pid = None
+        self._semaforo = None
+        self._en_curso = 0
+        self.contadores = {
+            'llamadas': 0,
+            'errores': 0,
+            'rechazadas': 0,
+            'reintentos': 0,
+            'max_en_curso': 0,
+            'espera_total_segundos': 0.0,
+            'espera_max_segundos': 0.0,
+            'duracion_total_segundos': 0.0,
+        }
+
+    def _preparar_proceso(self):
+        """Cliente y semáforo propios del proceso actual (se recrean tras un fork)"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._cliente = None
+                    self._semaforo = threading.BoundedSemaphore(self.max_concurrentes)
+                    self._en_curso = 0
+                    self._pid = os.getpid()
+
+    def cliente(self):
+        """Cliente Anthropic del proceso"""
+        self._preparar_proceso()
+        if self._cliente is None:
+            with self._lock:
+                if self._cliente is None:
+                    self._cliente = self._fabrica_cliente()
+        return self._cliente
+
+    @contextmanager
+    def turno(self):
+        """
+        Espera un lugar entre las llamadas simultáneas permitidas
+
+        Raises:
+            PasarelaSaturada: Si no hay lugar dentro de la espera máxima
+            PlazoAgotado: Si la consulta se quedó sin tiempo esperando turno
+        """
+        self._preparar_proceso()
+        plazo = plazo_actual()
+        espera_maxima = self.espera_maxima if plazo is None else min(self.espera_maxima, plazo.restante())
+        inicio = time.monotonic()
+        if not self._semaforo.acquire(timeout=espera_maxima):
+            with self._lock:
+                self.contadores['rechazadas'] += 1
+            if espera_maxima < self.espera_maxima:
+                raise PlazoAgotado(f"Plazo de la consulta agotado esperando turno ({espera_maxima:.1f}s)")
+            raise PasarelaSaturada(
+                f"{self.max_concurrentes} llamadas al modelo en curso; se esperó {self.espera_maxima:.0f}s"
+            )
+
+        espera = time.monotonic() - inicio
+        with self._lock:
+            self._en_curso += 1
+            self.contadores['llamadas'] += 1
+            self.contadores['espera_total_segundos'] += espera
+            self.contadores['espera_max_segundos'] = max(self.contadores['espera_max_segundos'], espera)
+            self.contadores['max_en_curso'] = max(self.contadores['max_en_curso'], self._en_curso)
+        if espera > 1.0:
+            print(f"⏳ Llamada al modelo en cola durante {espera:.1f}s")
+
+        inicio_llamada = time.monotonic()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.contadores['errores'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._en_curso -= 1
+                self.contadores['duracion_total_segundos'] += time.monotonic() - inicio_llamada
+            self._semaforo.release()
+
+    @contextmanager
+    def intento(self):
+        """Autoriza una llamada con el circuito y le informa el resultado"""
+        self.circuito.permitir()
+        try:
+            yield
+        except Exception as e:
+            plazo = plazo_actual()
+            if isinstance(e, (PasarelaSaturada, PlazoAgotado)) or (plazo is not None and plazo.vencido()):
+                # No dice nada del servicio: el límite fue local (cola o plazo de la consulta)
+                self.circuito.registrar(None)
+            else:
+                # Un 400 demuestra que el servicio responde
+                self.circuito.registrar(not es_falla_del_servicio(e))
+            raise
+        else:
+            self.circuito.registrar(True)
+
+    def _espera_reintento(self, error, numero):
+        """Segundos antes del reintento: Retry-After si el servicio lo indica, si no backoff con jitter"""
+        respuesta = getattr(error, "response", None)
+        try:
+            indicado = float(respuesta.headers.get("retry-after"))
+            return min(indicado, BACKOFF_MAXIMO)
+        except (AttributeError, TypeError, ValueError):
+            return random.uniform(0, min(BACKOFF_MAXIMO, self.backoff_base * 2 ** numero))
+
+    def opciones_plazo(self):
+        """
+        Opciones por llamada según el plazo de la consulta en curso
+
+        Returns:
+            dict: {'timeout': los límites del cliente recortados al plazo restante}
+                  o vacío si no hay plazo
+
+        Raises:
+            PlazoAgotado: Si el plazo ya venció
+        """
+        plazo = plazo_actual()
+        if plazo is None:
+            return {}
+        restante = plazo.restante()
+        if restante <= 0:
+            raise PlazoAgotado("Plazo de la consulta agotado antes de llamar al modelo")
+        return {'timeout': _tiempo_limite(restante)}
+
+    def llamar(self, funcion):
+        """
+        Ejecuta funcion(cliente, opciones) con circuito, turno, plazo y reintentos
+
+        Raises:
+            CircuitoAbierto: Si el servicio se considera caído
+            PasarelaSaturada: Si no hubo turno dentro de la espera máxima
+            PlazoAgotado: Si la consulta se quedó sin tiempo
+        """
+        plazo = plazo_actual()
+        # El circuito cuenta llamadas, no intentos: solo se le informa el resultado final
+        with self.intento():
+            for numero in range(self.reintentos + 1):
+                try:
+                    with self.turno():
+                        return funcion(self.cliente(), self.opciones_plazo())
+                except Exception as e:
+                    if numero == self.reintentos or not es_reintentable(e):
+                        raise
+                    espera = self._espera_reintento(e, numero)
+                    if plazo is not None and espera >= plazo.restante():
+                        raise
+                    with self._lock:
+                        self.contadores['reintentos'] += 1
+                    print(f"🔁 Error transitorio del modelo ({type(e).__name__}); reintento en {espera:.1f}s")
+                    time.sleep(espera)
+
+    def estadisticas(self):
+        """Contadores de llamadas, concurrencia, espera en cola y estado del circuito"""
+        estadisticas = dict(self.contadores)
+        llamadas = estadisticas['llamadas']
+        estadisticas.update({
+            'en_curso': self._en_curso,
+            'max_concurrentes': self.max_concurrentes,
+            'espera_media_segundos': round(estadisticas['espera_total_segundos'] / llamadas, 4) if llamadas else 0.0,
+            'duracion_media_segundos': round(estadisticas['duracion_total_segundos'] / llamadas, 4) if llamadas else 0.0,
+        })
+        for clave in ('espera_total_segundos', 'espera_max_segundos', 'duracion_total_segundos'):
+            estadisticas[clave] = round(estadisticas[clave], 4)
+        estadisticas['circuito'] = self.circuito.estadisticas()
+        return estadisticas
+
+
+_pasarela = None
+_pasarela_lock = threading.Lock()
+
+def obtener_pasarela():
+    """
+    Pasarela LLM del proceso (se usa como cliente: pasarela.messages.create(...))
+
+    Returns:
+        PasarelaLLM: Cliente compartido con límite de concurrencia
+    """
+    global _pasarela
+    if _pasarela is None:
+        with _pasarela_lock:
+            if _pasarela is None:
+                _pasarela = PasarelaLLM(
+                    max_concurrentes=entero_entorno("LLM_MAX_CONCURRENTES", 8),
+                    espera_maxima=decimal_entorno("LLM_ESPERA_MAXIMA_SEGUNDOS", 30.0),
+                    reintentos=entero_entorno("LLM_REINTENTOS", 2),
+                    backoff_base=decimal_entorno("LLM_BACKOFF_BASE_SEGUNDOS", 0.5),
+                    circuito=Circuito(
+                        umbral_fallos=entero_entorno("LLM_CIRCUITO_FALLOS", 5),
+                        enfriamiento=decimal_entorno("LLM_CIRCUITO_ENFRIAMIENTO", 60.0),
+                    ),
+                )
+    return _pasarela
@@ -0,0 +1,118 @@
+"""
+Plazo por consulta para el pipeline de /chat
+
+Cada consulta recibe un presupuesto de tiempo menor que el timeout de
+gunicorn. El plazo viaja en un ContextVar (igual que el emisor de
+utils/transmision.py) y cada etapa lo consulta:
+
+- La pasarela LLM limita cada llamada al tiempo restante y no reintenta si
+  ya no alcanza.
+- Las fuentes opcionales (glosario, tomos) se omiten cuando no queda tiempo
+  para extraerlas y además sintetizar la respuesta.
+- Las fuentes que no terminan a tiempo se descartan.
+
+Las etapas omitidas se informan en la respuesta ('etapas_omitidas') y esa
+respuesta incompleta no se guarda en caché.
+
+Variables de entorno:
+    CHAT_PLAZO_SEGUNDOS=90              Presupuesto total de una consulta
+    CHAT_RESERVA_SINTESIS_SEGUNDOS=20   Tiempo reservado para generar la respuesta final
+    CHAT_MINIMO_FUENTE_SEGUNDOS=5       Tiempo mínimo para que valga la pena consultar una fuente opcional
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.configuracion import decimal_entorno
+
+_plazo = ContextVar("plazo_consulta", default=None)
+
+
+class PlazoAgotado(Exception):
+    """La consulta agotó su presupuesto de tiempo antes de una etapa"""
+
+
+class Plazo:
+    """Presupuesto de tiempo de una consulta y registro de las etapas omitidas"""
+
+    def __init__(self, segundos):
+        self.segundos = segundos
+        self._limite = time.monotonic() + segundos
+        self._lock = threading.Lock()
+        self.etapas_omitidas = []
+
+    def restante(self):
+        """Segundos que quedan (0 si venció)"""
+        return max(0.0, self._limite - time.monotonic())
+
+    def vencido(self):
+        return self.restante() <= 0
+
+    def disponible(self, reserva=0.0):
+        """Segundos que quedan después de apartar `reserva`"""
+        return max(0.0, self.restante() - reserva)
+
+    def omitir(self, etapa):
+        """Registra una etapa que no se ejecutó (o se descartó) por falta de tiempo"""
+        with self._lock:
+            if etapa in self.etapas_omitidas:
+                return
+            self.etapas_omitidas.append(etapa)
+        print(f"⏭️ Etapa omitida por plazo: {etapa} (quedan {self.restante():.1f}s)")
+
+
+def reserva_sintesis():
+    """Segundos que las etapas previas dejan libres para la respuesta final"""
+    return decimal_entorno("CHAT_RESERVA_SINTESIS_SEGUNDOS", 20.0)
+
+
+def nuevo_plazo():
+    """Plazo de una consulta según CHAT_PLAZO_SEGUNDOS"""
+    return Plazo(decimal_entorno("CHAT_PLAZO_SEGUNDOS", 90.0))
+
+
+@contextmanager
+def con_plazo(plazo):
+    """
+    Activa un plazo en el contexto actual
+
+    Args:
+        plazo (Plazo): Presupuesto de la consulta (None desactiva el plazo)
+    """
+    token = _plazo.set(plazo)
+    try:
+        yield plazo
+    finally:
+        _plazo.reset(token)
+
+
+def plazo_actual():
+    """Plazo de la consulta en curso o None"""
+    return _plazo.get()
+
+
+def hay_tiempo_para(etapa, minimo=None, reserva=None):
+    """
+    Indica si una etapa opcional cabe en el plazo en curso (y si no, la registra como omitida)
+
+    Args:
+        etapa (str): Nombre de la etapa para el informe
+        minimo (float): Segundos que necesita la etapa (CHAT_MINIMO_FUENTE_SEGUNDOS por defecto)
+        reserva (float): Segundos que deben quedar libres después (la síntesis por defecto)
+
+    Returns:
+        bool: True si no hay plazo o si queda tiempo suficiente
+    """
+    plazo = plazo_actual()
+    if plazo is None:
+        return True
+    if minimo is None:
+        minimo = decimal_entorno("CHAT_MINIMO_FUENTE_SEGUNDOS", 5.0)
+    if reserva is None:
+        reserva = reserva_sintesis()
+    if plazo.disponible(reserva) >= minimo:
+        return True
+    plazo.omitir(etapa)
+    return False
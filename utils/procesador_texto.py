@@ -0,0 +1,62 @@
+"""
+Utilidades de normalización y tokenización de texto en español
+"""
+
+import re
+
+# Plegado de acentos con str.translate (mucho más rápido que unicodedata sobre tomos completos)
+_TABLA_ACENTOS = str.maketrans(
+    "áéíóúüñàèìòùäëïöÁÉÍÓÚÜÑÀÈÌÒÙÄËÏÖ",
+    "aeiouunaeiouaeioAEIOUUNAEIOUAEIO"
+)
+
+_PATRON_TOKEN = re.compile(r"\w+")
+
+# Palabras vacías frecuentes en las preguntas (ya sin acentos)
+PALABRAS_VACIAS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada como con contra cual cuales
+cuando de del desde donde dos el ella ellas ello ellos en entre era es esa esas ese eso esos esta estan
+estas este esto estos fue ha hay la las le les lo los mas me mi mis muy ni no nos o otra otras otro otros
+para pero poco por porque que quien quienes se sea ser si sin sobre son su sus tambien tan tanto te tiene
+tienen todo todos tu tus un una uno unos y ya yo puedo puede pueden debo debe deben hacer hace dame dime
+favor necesito quiero saber sabes explica explicame
+""".split())
+
+
+def quitar_acentos(texto):
+    """Elimina tildes y diéresis (y convierte ñ en n)"""
+    return texto.translate(_TABLA_ACENTOS)
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos"""
+    return quitar_acentos(texto.lower())
+
+
+def tokenizar(texto, min_longitud=1, sin_vacias=False):
+    """
+    Divide un texto en tokens normalizados
+
+    Args:
+        texto (str): Texto a tokenizar
+        min_longitud (int): Longitud mínima de cada token
+        sin_vacias (bool): Descartar palabras vacías
+
+    Returns:
+        list: Tokens en minúsculas y sin acentos
+    """
+    tokens = _PATRON_TOKEN.findall(normalizar(texto))
+    if min_longitud > 1:
+        tokens = [t for t in tokens if len(t) >= min_longitud]
+    if sin_vacias:
+        tokens = [t for t in tokens if t not in PALABRAS_VACIAS]
+    return tokens
+
+
+def terminos_consulta(texto):
+    """Términos significativos de una pregunta (sin palabras vacías, 3+ caracteres)"""
+    terminos = []
+    for token in tokenizar(texto, min_longitud=3, sin_vacias=True):
+        if token not in terminos:
+            terminos.append(token)
+    return terminos
@@ -0,0 +1,208 @@
+"""
+Recuperación de secciones relevantes dentro de un documento del corpus
+
+Sustituye el recorrido línea por línea de buscar_informacion_relevante:
+cada documento se indexa una vez por proceso (término -> líneas donde
+aparece), las ventanas alrededor de cada coincidencia se fusionan cuando
+se solapan, se puntúan con BM25 y se devuelven como desplazamientos en
+bytes del documento, que se decodifican con Corpus.fragmento solo para
+las ventanas elegidas.
+"""
+
+import math
+import threading
+from bisect import bisect_right
+from collections import Counter, namedtuple
+from itertools import accumulate
+
+from utils.procesador_texto import tokenizar, terminos_consulta
+
+# Contexto alrededor de cada línea relevante (igual que el recorrido original)
+LINEAS_ANTES = 15
+LINEAS_DESPUES = 40
+# Tamaño máximo de una ventana fusionada: el de una ventana original, para no
+# enviar al prompt secciones más largas que antes
+MAX_LINEAS_VENTANA = LINEAS_ANTES + LINEAS_DESPUES
+
+# lineas_coincidentes: líneas de la ventana (relativas a linea_inicio) donde aparece algún término
+Ventana = namedtuple("Ventana", "puntuacion inicio fin linea_inicio linea_fin lineas_coincidentes")
+
+
+class IndiceSecciones:
+    """Índice posicional término -> {línea: frecuencia} de un documento"""
+
+    def __init__(self, datos, k1=1.2, b=0.75):
+        """
+        Args:
+            datos (bytes | memoryview | str): Documento (utf-8 si son bytes)
+            k1 (float): Saturación de la frecuencia del término
+            b (float): Normalización por longitud de la ventana
+        """
+        if isinstance(datos, str):
+            datos = datos.encode("utf-8")
+        datos = bytes(datos)
+
+        self.k1 = k1
+        self.b = b
+        self.longitud_bytes = len(datos)
+        self.postings = {}
+
+        lineas = datos.split(b"\n")
+        self.total_lineas = len(lineas)
+
+        # Desplazamiento en bytes del inicio de cada línea (+ centinela al final)
+        self._inicios = [0]
+        for linea in lineas:
+            self._inicios.append(self._inicios[-1] + len(linea) + 1)
+
+        tokens_por_linea = []
+        for numero, linea in enumerate(lineas):
+            tokens = tokenizar(str(linea, "utf-8", "ignore"))
+            tokens_por_linea.append(len(tokens))
+            for termino, frecuencia in Counter(tokens).items():
+                self.postings.setdefault(termino, {})[numero] = frecuencia
+
+        # Suma acumulada de tokens para conocer la longitud de cualquier ventana en O(1)
+        self._tokens_acumulados = [0] + list(accumulate(tokens_por_linea))
+
+        ventana_tipica = LINEAS_ANTES + LINEAS_DESPUES
+        total_tokens = self._tokens_acumulados[-1]
+        self.longitud_media = max(1.0, total_tokens * ventana_tipica / max(1, self.total_lineas))
+
+    def _idf(self, termino):
+        lineas_con_termino = len(self.postings.get(termino, ()))
+        return math.log(1 + (self.total_lineas - lineas_con_termino + 0.5) / (lineas_con_termino + 0.5))
+
+    def _fusionar(self, lineas_coincidentes):
+        """
+        Une las ventanas [i-15, i+40) que se solapan. Si la unión supera
+        MAX_LINEAS_VENTANA se corta y la siguiente ventana empieza donde
+        terminó la anterior, de modo que ningún texto se repite.
+
+        Returns:
+            list: Pares (linea_inicio, linea_fin) sin solapamiento
+        """
+        tramos = []
+        for linea in sorted(lineas_coincidentes):
+            inicio = max(0, linea - LINEAS_ANTES)
+            fin = min(self.total_lineas, linea + LINEAS_DESPUES)
+            if tramos and inicio <= tramos[-1][1]:
+                inicio_actual, fin_actual = tramos[-1]
+                if fin - inicio_actual <= MAX_LINEAS_VENTANA:
+                    tramos[-1] = (inicio_actual, max(fin_actual, fin))
+                    continue
+                inicio = fin_actual
+                if inicio >= fin:
+                    continue
+            tramos.append((inicio, fin))
+        return tramos
+
+    def buscar(self, consulta, k=2, terminos=None):
+        """
+        Ventanas más relevantes para una consulta
+
+        Args:
+            consulta (str): Pregunta del usuario
+            k (int): Número de ventanas a devolver
+            terminos (list): Términos ya extraídos (opcional)
+
+        Returns:
+            list: Ventanas (puntuación, inicio, fin en bytes, líneas) de mayor a menor
+        """
+        if terminos is None:
+            terminos = terminos_consulta(consulta)
+        terminos = [t for t in terminos if t in self.postings]
+        if not terminos:
+            return []
+
+        lineas_coincidentes = set()
+        for termino in terminos:
+            lineas_coincidentes.update(self.postings[termino])
+
+        tramos = self._fusionar(lineas_coincidentes)
+        inicios_tramos = [inicio for inicio, _ in tramos]
+
+        # Frecuencia de cada término por ventana en una sola pasada por sus postings
+        frecuencias = [Counter() for _ in tramos]
+        coincidentes = [set() for _ in tramos]
+        for termino in terminos:
+            for linea, frecuencia in self.postings[termino].items():
+                posicion = bisect_right(inicios_tramos, linea) - 1
+                if posicion >= 0 and linea < tramos[posicion][1]:
+                    frecuencias[posicion][termino] += frecuencia
+                    coincidentes[posicion].add(linea - tramos[posicion][0])
+
+        idf = {termino: self._idf(termino) for termino in terminos}
+        ventanas = []
+        for (inicio, fin), frecuencias_tramo, coincidentes_tramo in zip(tramos, frecuencias, coincidentes):
+            longitud = self._tokens_acumulados[fin] - self._tokens_acumulados[inicio]
+            norma = self.k1 * (1 - self.b + self.b * longitud / self.longitud_media)
+            puntuacion = sum(
+                idf[termino] * frecuencia * (self.k1 + 1) / (frecuencia + norma)
+                for termino, frecuencia in frecuencias_tramo.items()
+            )
+            if puntuacion > 0:
+                ventanas.append(Ventana(
+                    puntuacion,
+                    self._inicios[inicio],
+                    min(self._inicios[fin] - 1, self.longitud_bytes),
+                    inicio,
+                    fin,
+                    tuple(sorted(coincidentes_tramo)),
+                ))
+
+        ventanas.sort(key=lambda v: (-v.puntuacion, v.inicio))
+        return ventanas[:k]
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+def obtener_indice_secciones(clave):
+    """
+    Índice posicional de una entrada del corpus compartido (se construye una vez)
+
+    Args:
+        clave (str): Entrada del corpus (p. ej. 'tomo_3', 'reglamento_emergencia')
+
+    Returns:
+        IndiceSecciones: Índice de la entrada o None si no existe
+    """
+    from utils.corpus import obtener_corpus
+    corpus = obtener_corpus()
+    clave_indice = (corpus.version, clave)
+
+    indice = _indices.get(clave_indice)
+    if indice is None:
+        if not corpus.contiene(clave):
+            return None
+        with _indices_lock:
+            indice = _indices.get(clave_indice)
+            if indice is None:
+                indice = IndiceSecciones(corpus.vista(clave))
+                _indices[clave_indice] = indice
+    return indice
+
+
+def secciones_relevantes(consulta, clave, k=2, separador="\n\n---\n\n", terminos=None):
+    """
+    Texto de las k ventanas más relevantes de una entrada del corpus
+
+    Args:
+        consulta (str): Pregunta del usuario
+        clave (str): Entrada del corpus
+        k (int): Número de ventanas
+        separador (str): Separador entre ventanas
+        terminos (list): Términos ya extraídos (opcional)
+
+    Returns:
+        str: Secciones unidas o cadena vacía si no hay coincidencias
+    """
+    indice = obtener_indice_secciones(clave)
+    if indice is None:
+        return ""
+
+    from utils.corpus import obtener_corpus
+    corpus = obtener_corpus()
+    ventanas = indice.buscar(consulta, k, terminos)
+    return separador.join(corpus.fragmento(clave, v.inicio, v.fin) for v in ventanas)
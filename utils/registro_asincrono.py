@@ -0,0 +1,262 @@
+"""
+Registro estructurado de solicitudes escrito en segundo plano
+
+Sustituye las escrituras a log.txt en el hilo de la solicitud (pregunta y
+respuesta completas en cada /chat, HTML de cada tabla de cabida):
+
+- registrar() solo encola el registro; si la cola está llena el registro se
+  descarta (y se cuenta) en lugar de bloquear la solicitud.
+- Un hilo por worker saca los registros en lotes y los escribe como JSONL
+  (una línea JSON por registro) en una sola escritura por lote, cada
+  REGISTRO_INTERVALO_SEGUNDOS o al completar el lote.
+- El archivo rota al superar REGISTRO_MAX_MB o al cambiar de periodo
+  (REGISTRO_ROTACION_HORAS); los segmentos rotados se comprimen con gzip y
+  se conservan los REGISTRO_SEGMENTOS más recientes. Los workers comparten
+  el archivo: escritura y rotación van bajo un flock.
+
+Variables de entorno:
+    REGISTRO=1                       0 desactiva el registro
+    REGISTRO_RUTA                    Archivo JSONL (logs/solicitudes.jsonl)
+    REGISTRO_COLA=1000               Registros en espera como máximo por worker
+    REGISTRO_LOTE=200                Registros por escritura
+    REGISTRO_INTERVALO_SEGUNDOS=1    Espera máxima antes de escribir un lote incompleto
+    REGISTRO_MAX_MB=20               Tamaño a partir del cual rota el archivo
+    REGISTRO_ROTACION_HORAS=24       Periodo de rotación por tiempo
+    REGISTRO_SEGMENTOS=14            Segmentos rotados que se conservan
+    REGISTRO_COMPRIMIR=1             Comprime con gzip los segmentos rotados
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos (un solo proceso en desarrollo)
+    fcntl = None
+
+from utils.configuracion import bandera_entorno, decimal_entorno, entero_entorno
+
+RUTA_POR_DEFECTO = os.path.join("logs", "solicitudes.jsonl")
+
+
+class RegistroAsincrono:
+    """Cola acotada de registros y un hilo por proceso que los escribe en lotes con rotación"""
+
+    def __init__(self, ruta, max_cola=1000, tam_lote=200, intervalo=1.0, max_bytes=20 * 1024 * 1024,
+                 periodo_rotacion=24 * 3600, max_segmentos=14, comprimir=True):
+        self.ruta = ruta
+        self.max_cola = max_cola
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.max_bytes = max_bytes
+        self.periodo_rotacion = periodo_rotacion
+        self.max_segmentos = max_segmentos
+        self.comprimir = comprimir
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cola = None
+        self.contadores = {
+            'encolados': 0,
+            'escritos': 0,
+            'descartados': 0,
+            'lotes': 0,
+            'rotaciones': 0,
+            'errores': 0,
+        }
+
+    def _preparar_proceso(self):
+        """Cola e hilo escritor del proceso actual (los del master no sobreviven al fork)"""
+        if self._pid == os.getpid():
+            return self._cola
+        with self._lock:
+            if self._pid != os.getpid():
+                self._cola = queue.Queue(maxsize=self.max_cola)
+                threading.Thread(target=self._bucle, args=(self._cola,), name="registro-asincrono", daemon=True).start()
+                self._pid = os.getpid()
+        return self._cola
+
+    def registrar(self, registro):
+        """
+        Encola un registro sin bloquear
+
+        Args:
+            registro (dict): Campos serializables a JSON (se le añaden 'ts' y 'pid')
+
+        Returns:
+            bool: False si la cola estaba llena y el registro se descartó
+        """
+        registro.setdefault('ts', datetime.now().isoformat(timespec="milliseconds"))
+        registro.setdefault('pid', os.getpid())
+        try:
+            self._preparar_proceso().put_nowait(registro)
+        except queue.Full:
+            self.contadores['descartados'] += 1
+            return False
+        self.contadores['encolados'] += 1
+        return True
+
+    def _bucle(self, cola):
+        while True:
+            lote = [cola.get()]
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < self.tam_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                self._escribir(lote)
+            except Exception as e:
+                self.contadores['errores'] += 1
+                print(f"⚠️ Registro: error escribiendo {len(lote)} registros ({e})")
+            finally:
+                for _ in lote:
+                    cola.task_done()
+
+    def _escribir(self, lote):
+        """Escribe un lote en una sola operación (rotando antes si toca)"""
+        datos = "".join(json.dumps(registro, ensure_ascii=False, default=str) + "\n" for registro in lote)
+        datos = datos.encode("utf-8")
+
+        with open(self.ruta + ".lock", "a") as cerrojo:
+            if fcntl is not None:
+                fcntl.flock(cerrojo, fcntl.LOCK_EX)
+            rotado = self._rotar_si_toca(len(datos))
+            with open(self.ruta, "ab") as archivo:
+                archivo.write(datos)
+
+        self.contadores['escritos'] += len(lote)
+        self.contadores['lotes'] += 1
+        if rotado:
+            self.contadores['rotaciones'] += 1
+            if self.comprimir:
+                self._comprimir(rotado)
+            self._podar()
+
+    def _rotar_si_toca(self, bytes_nuevos):
+        """
+        Renombra el archivo actual si el lote lo haría superar max_bytes o si es de otro periodo
+
+        Returns:
+            str: Ruta del segmento rotado o None
+        """
+        try:
+            estado = os.stat(self.ruta)
+        except FileNotFoundError:
+            return None
+        if estado.st_size == 0:
+            return None
+        otro_periodo = int(estado.st_mtime // self.periodo_rotacion) != int(time.time() // self.periodo_rotacion)
+        if not otro_periodo and estado.st_size + bytes_nuevos <= self.max_bytes:
+            return None
+
+        base = f"{self.ruta}.{datetime.fromtimestamp(estado.st_mtime).strftime('%Y%m%d-%H%M%S')}"
+        destino = base
+        numero = 1
+        while os.path.exists(destino) or os.path.exists(destino + ".gz"):
+            destino = f"{base}-{numero}"
+            numero += 1
+        os.replace(self.ruta, destino)
+        return destino
+
+    def _comprimir(self, segmento):
+        with open(segmento, "rb") as origen, gzip.open(segmento + ".gz", "wb") as destino:
+            shutil.copyfileobj(origen, destino)
+        os.remove(segmento)
+
+    def _podar(self):
+        """Borra los segmentos rotados más antiguos por encima de max_segmentos"""
+        segmentos = [s for s in glob.glob(glob.escape(self.ruta) + ".*") if not s.endswith(".lock")]
+        segmentos.sort(key=os.path.getmtime)
+        for segmento in segmentos[:max(0, len(segmentos) - self.max_segmentos)]:
+            try:
+                os.remove(segmento)
+            except OSError:
+                pass
+
+    def vaciar(self, espera=2.0):
+        """
+        Espera a que se escriban los registros encolados por este proceso
+
+        Returns:
+            bool: True si la cola quedó vacía antes de `espera` segundos
+        """
+        cola = self._cola if self._pid == os.getpid() else None
+        if cola is None:
+            return True
+        limite = time.monotonic() + espera
+        while cola.unfinished_tasks:
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def estadisticas(self):
+        estadisticas = dict(self.contadores)
+        estadisticas.update({
+            'ruta': self.ruta,
+            'en_cola': self._cola.qsize() if self._pid == os.getpid() else 0,
+            'max_cola': self.max_cola,
+        })
+        return estadisticas
+
+
+class RegistroDesactivado:
+    """Misma interfaz que RegistroAsincrono sin escribir nada (REGISTRO=0)"""
+
+    def registrar(self, registro):
+        return False
+
+    def vaciar(self, espera=2.0):
+        return True
+
+    def estadisticas(self):
+        return {'activo': False}
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+def obtener_registro():
+    """
+    Registro de solicitudes del proceso
+
+    Returns:
+        RegistroAsincrono: Escritor en segundo plano (RegistroDesactivado si REGISTRO=0)
+    """
+    global _registro
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                if not bandera_entorno("REGISTRO"):
+                    _registro = RegistroDesactivado()
+                else:
+                    _registro = RegistroAsincrono(
+                        ruta=os.getenv("REGISTRO_RUTA", RUTA_POR_DEFECTO),
+                        max_cola=entero_entorno("REGISTRO_COLA", 1000),
+                        tam_lote=entero_entorno("REGISTRO_LOTE", 200),
+                        intervalo=decimal_entorno("REGISTRO_INTERVALO_SEGUNDOS", 1.0),
+                        max_bytes=int(decimal_entorno("REGISTRO_MAX_MB", 20) * 1024 * 1024),
+                        periodo_rotacion=decimal_entorno("REGISTRO_ROTACION_HORAS", 24) * 3600,
+                        max_segmentos=entero_entorno("REGISTRO_SEGMENTOS", 14),
+                        comprimir=bandera_entorno("REGISTRO_COMPRIMIR"),
+                    )
+                    # Al apagar el worker se escriben los registros pendientes
+                    atexit.register(_registro.vaciar)
+    return _registro
@@ -1,13 +1,60 @@
 """
-Módulo para respuestas de emergencia cuando la API de OpenAI no está disponible
+Módulo para respuestas de emergencia cuando la API de Anthropic no está disponible
+
+El modo de emergencia se activa a mano con MODO_EMERGENCIA=true en el archivo
+.modo_emergencia, o solo cuando el circuito de la pasarela LLM está abierto
+tras fallas repetidas del servicio.
 """
 
+import os
 import re
+import threading
+
+ARCHIVO_MODO_EMERGENCIA = ".modo_emergencia"
+
+_bandera_lock = threading.Lock()
+_bandera = {'mtime': None, 'activa': False}
+
+
+def bandera_emergencia(ruta=ARCHIVO_MODO_EMERGENCIA):
+    """
+    Lee MODO_EMERGENCIA del archivo de bandera (se relee solo si cambió)
+
+    Returns:
+        bool: True si el archivo fuerza el modo de emergencia
+    """
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return False
+
+    with _bandera_lock:
+        if mtime != _bandera['mtime']:
+            activa = False
+            try:
+                with open(ruta, encoding="utf-8") as archivo:
+                    for linea in archivo:
+                        nombre, _, valor = linea.partition("=")
+                        if nombre.strip().upper() == "MODO_EMERGENCIA":
+                            activa = valor.strip().lower() in ("1", "true", "si", "sí", "on")
+            except OSError as e:
+                print(f"⚠️ No se pudo leer {ruta}: {e}")
+            if activa != _bandera['activa']:
+                print(f"🚨 Modo de emergencia {'activado' if activa else 'desactivado'} por {ruta}")
+            _bandera.update(mtime=mtime, activa=activa)
+        return _bandera['activa']
+
+
+def modo_emergencia_activo():
+    """Indica si las consultas deben responderse sin IA (bandera o circuito abierto)"""
+    from utils.pasarela_llm import obtener_pasarela
+    return bandera_emergencia() or obtener_pasarela().circuito.abierto()
+
 
 def generar_respuesta_emergencia(pregunta, tomos_mejorados):
     """
     Genera una respuesta de emergencia basada en búsqueda de texto simple
-    cuando la API de OpenAI no está disponible
+    cuando la API de Anthropic no está disponible
     
     Args:
         pregunta (str): La pregunta del usuario
@@ -88,7 +135,7 @@ Contacto oficial:
     palabras_pregunta = [p for p in pregunta.split() if p not in palabras_comunes and len(p) > 2]
     
     # Construir patrón de búsqueda
-    patron = '|'.join(palabras_pregunta)
+    patron = '|'.join(re.escape(palabra) for palabra in palabras_pregunta)
     
     # Buscar en cada tomo
     for num_tomo in tomos_a_consultar:
@@ -105,7 +152,7 @@ Contacto oficial:
             if all(palabra in parrafo.lower() for palabra in palabras_pregunta):
                 # Párrafo contiene todas las palabras clave
                 resultados.append((5, num_tomo, parrafo))
-            elif re.search(patron, parrafo.lower()):
+            elif patron and re.search(patron, parrafo.lower()):
                 # Párrafo contiene algunas palabras clave
                 relevancia = sum(1 for palabra in palabras_pregunta if palabra in parrafo.lower())
                 resultados.append((relevancia, num_tomo, parrafo))
@@ -119,7 +166,7 @@ Contacto oficial:
     # Si no hay resultados, dar respuesta genérica
     if not mejores_resultados:
         return f"""
-Actualmente estoy en modo de emergencia debido a limitaciones técnicas con la API de OpenAI.
+Actualmente estoy en modo de emergencia debido a limitaciones técnicas con el servicio de IA.
 
 No he podido encontrar información específica sobre tu consulta relacionada con: {', '.join(temas_relevantes)}.
 
@@ -133,7 +180,7 @@ Por favor:
     
     # Construir respuesta
     respuesta = f"""
-⚠️ **MODO DE EMERGENCIA ACTIVADO** - Respuesta generada sin acceso a la API de OpenAI
+⚠️ **MODO DE EMERGENCIA ACTIVADO** - Respuesta generada sin acceso al servicio de IA
 
 He encontrado información relacionada con tu consulta sobre: {', '.join(temas_relevantes)}
 Información extraída de los tomos: {', '.join(str(resultado[1]) for resultado in mejores_resultados)}
@@ -154,7 +201,7 @@ Información extraída de los tomos: {', '.join(str(resultado[1]) for resultado
     
     respuesta += """
 ---
-⚠️ Nota: Esta respuesta fue generada en modo de emergencia debido a problemas con la API de OpenAI.
+⚠️ Nota: Esta respuesta fue generada en modo de emergencia debido a problemas con el servicio de IA.
 La precisión podría ser menor que en funcionamiento normal.
 
 Para obtener información más precisa, por favor contacta directamente con la Junta de Planificación de Puerto Rico.
@@ -0,0 +1,117 @@
+"""
+Modo de síntesis directa para las respuestas híbridas
+
+El modo original ("extraccion") pide a Haiku un resumen de cada fuente
+(reglamento, glosario, tomos) y luego otra llamada para sintetizar: de 3 a
+5 llamadas por pregunta. Buena parte de esas extracciones solo vuelve a
+resumir texto que la recuperación local ya acotó.
+
+El modo "directa" usa las ventanas que ya puntúa el índice de secciones
+(BM25) de todas las fuentes, las empaqueta de mayor a menor puntuación
+hasta el presupuesto de tokens del modelo (utils/empaquetador_contexto.py)
+y hace una sola llamada de síntesis.
+
+El modo se elige globalmente (SINTESIS_MODO) o por consulta
+('modo_sintesis' en el cuerpo de /chat); /comparar-sintesis ejecuta ambos
+sobre la misma pregunta y compara latencia, llamadas y tokens.
+
+Variables de entorno:
+    SINTESIS_MODO=extraccion               Modo por defecto (extraccion | directa)
+    SINTESIS_DIRECTA_MAX_TOKENS            Presupuesto del contexto empaquetado (por defecto el del modelo)
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from utils.configuracion import entero_entorno
+from utils.empaquetador_contexto import empaquetar, fragmento_texto, fragmentos_corpus, presupuesto_modelo
+
+MODO_EXTRACCION = "extraccion"
+MODO_DIRECTA = "directa"
+MODOS_SINTESIS = (MODO_EXTRACCION, MODO_DIRECTA)
+
+# Ventanas candidatas por fuente antes de empaquetar
+VENTANAS_REGLAMENTO = 4
+VENTANAS_POR_TOMO = 3
+# El reglamento de emergencia es la norma vigente: sus ventanas pesan más que las de los tomos
+PESO_REGLAMENTO = 1.25
+MAX_TOKENS_GLOSARIO = 700
+# Modelo de generar_respuesta_hibrida_inteligente (fija el presupuesto por defecto)
+MODELO_SINTESIS = "claude-3-haiku-20240307"
+
+_modo = ContextVar("modo_sintesis", default=None)
+
+
+def modo_valido(modo):
+    """Normaliza un nombre de modo (None si no es uno de MODOS_SINTESIS)"""
+    modo = (modo or "").strip().lower()
+    return modo if modo in MODOS_SINTESIS else None
+
+
+def modo_sintesis():
+    """Modo de la consulta en curso, o el global de SINTESIS_MODO"""
+    return _modo.get() or modo_valido(os.getenv("SINTESIS_MODO")) or MODO_EXTRACCION
+
+
+@contextmanager
+def con_modo_sintesis(modo):
+    """
+    Fija el modo de síntesis para el contexto actual
+
+    Args:
+        modo (str): 'extraccion', 'directa' o None para usar el global
+    """
+    token = _modo.set(modo_valido(modo))
+    try:
+        yield
+    finally:
+        _modo.reset(token)
+
+
+def contexto_directo(consulta, tomos, terminos=None, definiciones=None, max_tokens=None, modelo=MODELO_SINTESIS):
+    """
+    Fuentes de información para la síntesis sin extracciones intermedias
+
+    Args:
+        consulta (str): Pregunta del usuario
+        tomos (list): Números de los tomos más relevantes
+        terminos (list): Términos de búsqueda ya corregidos (opcional)
+        definiciones (dict): {termino: [definiciones]} del glosario (opcional)
+        max_tokens (int): Presupuesto total (SINTESIS_DIRECTA_MAX_TOKENS o el del modelo)
+        modelo (str): Modelo que hará la síntesis
+
+    Returns:
+        dict: Mismas claves que el modo de extracción ('emergencia', 'glosario', 'tomos')
+    """
+    from utils.corpus import CLAVE_REGLAMENTO
+    if max_tokens is None:
+        max_tokens = entero_entorno("SINTESIS_DIRECTA_MAX_TOKENS", presupuesto_modelo(modelo))
+
+    # Las definiciones son cortas y precisas: entran primero, con su propio tope
+    glosario = empaquetar(
+        [fragmento_texto(f"**{termino.upper()}:** {texto}", "glosario")
+         for termino, textos in (definiciones or {}).items() for texto in textos],
+        min(max_tokens, MAX_TOKENS_GLOSARIO)
+    )
+
+    candidatos = fragmentos_corpus(consulta, CLAVE_REGLAMENTO, "emergencia", VENTANAS_REGLAMENTO, terminos, PESO_REGLAMENTO)
+    for tomo_id in tomos:
+        candidatos += fragmentos_corpus(consulta, f"tomo_{tomo_id}", tomo_id, VENTANAS_POR_TOMO, terminos)
+    contexto = empaquetar(candidatos, max_tokens - glosario.tokens)
+
+    fuentes = {}
+    if glosario:
+        fuentes["glosario"] = glosario.texto(separador="\n\n")
+    if contexto.texto("emergencia"):
+        fuentes["emergencia"] = contexto.texto("emergencia")
+    bloques_tomos = [f"**TOMO {tomo_id}:**\n" + contexto.texto(tomo_id) for tomo_id in tomos if contexto.texto(tomo_id)]
+    if bloques_tomos:
+        fuentes["tomos"] = "\n\n".join(bloques_tomos)
+
+    print(f"📦 Contexto directo: {len(contexto.fragmentos)} ventanas, "
+          f"{glosario.tokens + contexto.tokens}/{max_tokens} tokens (sin extracciones intermedias)")
+    for origen in contexto.procedencia():
+        print(f"   · {origen['clave']} líneas {origen['lineas'][0]}-{origen['lineas'][1]} "
+              f"({origen['tokens']} tokens, puntuación {origen['puntuacion']})")
+    return fuentes
@@ -0,0 +1,366 @@
+"""
+Tablas de cabida precalculadas por tomo y distrito
+
+Antes, cada pedido de una tabla de cabida recorría el tomo mejorado con
+cuatro expresiones re.DOTALL, probaba dos rutas de archivo por tomo y volvía
+a convertir el texto a HTML (once veces si no se indicaba tomo). Ahora las
+tablas se analizan una sola vez, al cargar el corpus:
+
+- todas las tablas markdown de los tomos mejorados cuyo encabezado habla de
+  cabida, y los archivos TablaCabida_Tomo_N*.txt (en la carpeta del tomo o
+  en Tablas/), se guardan como TablaCabida: encabezado, filas y la nota que
+  acompaña a la tabla en el archivo;
+- la tabla principal de cada tomo sigue la preferencia de antes: la del tomo
+  mejorado, luego el archivo directo, luego el de Tablas/ y después las
+  variantes (TablaCabida_Tomo_10_nuevo.txt);
+- las filas se indexan por distrito (sin acentos ni el prefijo "Distrito",
+  y también por el código entre paréntesis: "(ZIT)").
+
+Las solicitudes quedan en búsquedas en diccionarios; el HTML de cada tabla
+(completa o las primeras filas del resumen) se genera la primera vez que se
+pide y se reutiliza.
+"""
+
+import glob
+import os
+import re
+import threading
+from collections import namedtuple
+
+from utils.procesador_texto import normalizar
+
+DIRECTORIO_RESPUESTAS = os.path.join("data", "RespuestasParaChatBot")
+# Filas de cada tomo en el resumen de todas las tablas
+FILAS_RESUMEN = 3
+
+# Tabla que se muestra cuando un tomo no tiene tabla de cabida
+TABLA_CABIDA_GENERICA = """
+A continuación se presenta una tabla con la cabida mínima y máxima permitida para cada distrito de calificación en Puerto Rico:
+
+| Distrito de Calificación | Cabida Mínima Permitida | Cabida Máxima Permitida |
+|-------------------------|------------------------|------------------------|
+| Distrito A | 200 m2 | 300 m2 |
+| Distrito B | 150 m2 | 250 m2 |
+| Distrito C | 100 m2 | 200 m2 |
+| Distrito D | 50 m2 | 150 m2 |
+| Distrito E | 25 m2 | 100 m2 |
+
+Es importante tener en cuenta que estos valores pueden variar según la normativa específica de cada municipio o entidad reguladora.
+"""
+
+TablaCabida = namedtuple("TablaCabida", "tomo fuente encabezado filas nota")
+
+_PATRON_SEPARADOR = re.compile(r"^\|?[\s\-:|+]*-[\s\-:|+]*\|?$")
+_PATRON_FRAGMENTO = re.compile(r"(?:🔍\s*)?fragmento\s*\d*\s*:", re.IGNORECASE)
+_PATRON_TOMO_CARPETA = re.compile(r"RespuestasIA_Tomo(\d+)$")
+_PATRON_PARENTESIS = re.compile(r"\(([^)]+)\)")
+_PATRON_MENCION_DISTRITO = re.compile(r"\b(?:distritos?|zonas?)\s+(?:de\s+)?([\w\-]+)")
+_PATRON_CODIGO = re.compile(r"\b[a-z]{1,3}-[a-z0-9]{1,3}\b")
+
+
+def _celdas(linea):
+    linea = linea.strip()
+    if linea.startswith('|'):
+        linea = linea[1:]
+    if linea.endswith('|'):
+        linea = linea[:-1]
+    return [celda.strip() for celda in linea.split('|')]
+
+
+def tablas_markdown(texto):
+    """
+    Tablas markdown de un texto (encabezado, línea separadora y filas con '|')
+
+    Args:
+        texto (str): Texto con tablas
+
+    Returns:
+        list: (encabezado, filas, linea_fin) por tabla; las filas tienen el ancho del encabezado
+    """
+    lineas = texto.split('\n')
+    tablas = []
+    i = 0
+    while i < len(lineas):
+        if not lineas[i].strip().startswith('|'):
+            i += 1
+            continue
+        inicio = i
+        while i < len(lineas) and lineas[i].strip().startswith('|'):
+            i += 1
+        bloque = lineas[inicio:i]
+        if len(bloque) < 2 or not _PATRON_SEPARADOR.match(bloque[1].strip()):
+            continue
+
+        encabezado = _celdas(bloque[0])
+        filas = []
+        for linea in bloque[2:]:
+            celdas = _celdas(linea)
+            if not any(celdas) or _PATRON_SEPARADOR.match(linea.strip()):
+                continue
+            filas.append(celdas)
+        ancho = max([len(encabezado)] + [len(fila) for fila in filas])
+        encabezado = tuple(encabezado + [''] * (ancho - len(encabezado)))
+        filas = [tuple(fila + [''] * (ancho - len(fila))) for fila in filas]
+        tablas.append((encabezado, filas, i))
+    return tablas
+
+
+def es_tabla_cabida(encabezado):
+    """True si alguna columna del encabezado habla de cabida"""
+    return any('cabida' in normalizar(columna) for columna in encabezado)
+
+
+def columna_distrito(encabezado):
+    """Índice de la columna con el distrito o la calificación (la primera si no hay otra)"""
+    for i, columna in enumerate(encabezado):
+        columna = normalizar(columna)
+        if 'distrito' in columna or 'calificacion' in columna or 'zona' in columna:
+            return i
+    return 0
+
+
+def clave_distrito(texto):
+    """Forma de búsqueda de un distrito: sin acentos, espacios simples y sin el prefijo 'Distrito'"""
+    clave = " ".join(normalizar(texto).split())
+    return re.sub(r"^distritos?\s+", "", clave)
+
+
+def _tabla_desde_texto(texto, tomo, fuente):
+    """Primera tabla de cabida de un archivo (o su primera tabla) con la nota que la sigue"""
+    texto = _PATRON_FRAGMENTO.sub('', texto)
+    tablas = tablas_markdown(texto)
+    if not tablas:
+        return None
+    encabezado, filas, fin = next((t for t in tablas if es_tabla_cabida(t[0])), tablas[0])
+    nota = " ".join(" ".join(texto.split('\n')[fin:]).split())
+    return TablaCabida(tomo, fuente, encabezado, filas, nota)
+
+
+def _archivos_tabla(directorio):
+    """
+    Archivos TablaCabida_Tomo_N*.txt por tomo, en orden de preferencia
+
+    Returns:
+        dict: {tomo: [ruta, ...]} (directo, Tablas/ y luego las variantes)
+    """
+    archivos = {}
+    for carpeta in glob.glob(os.path.join(directorio, "RespuestasIA_Tomo*")):
+        match = _PATRON_TOMO_CARPETA.search(carpeta)
+        if not match:
+            continue
+        tomo = int(match.group(1))
+        preferidas = [
+            os.path.join(carpeta, f"TablaCabida_Tomo_{tomo}.txt"),
+            os.path.join(carpeta, "Tablas", f"TablaCabida_Tomo_{tomo}.txt"),
+        ]
+        variantes = sorted(
+            glob.glob(os.path.join(carpeta, f"TablaCabida_Tomo_{tomo}*.txt")) +
+            glob.glob(os.path.join(carpeta, "Tablas", f"TablaCabida_Tomo_{tomo}*.txt"))
+        )
+        rutas = [r for r in preferidas if os.path.isfile(r)] + [r for r in variantes if r not in preferidas]
+        if rutas:
+            archivos[tomo] = rutas
+    return archivos
+
+
+def _clase_celda(contenido):
+    """Clase CSS según el tipo de contenido de una celda (número, fecha o estado)"""
+    if not contenido or not contenido.strip():
+        return ""
+
+    contenido = contenido.strip()
+
+    if re.match(r'^[\d\.,\$€£¥₹]+$', contenido) or re.match(r'^\d+(\.\d+)?$', contenido):
+        return ' class="numero"'
+
+    if re.match(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', contenido) or re.match(r'\d{2,4}[/-]\d{1,2}[/-]\d{1,2}', contenido):
+        return ' class="fecha"'
+
+    contenido_lower = contenido.lower()
+    if contenido_lower in ['activo', 'aprobado', 'completado', 'si', 'sí', 'yes', 'vigente']:
+        return ' class="estado activo"'
+    elif contenido_lower in ['pendiente', 'en proceso', 'tramitando', 'revisión']:
+        return ' class="estado pendiente"'
+    elif contenido_lower in ['inactivo', 'rechazado', 'vencido', 'no', 'cancelado']:
+        return ' class="estado inactivo"'
+
+    return ""
+
+
+def tabla_html(encabezado, filas):
+    """
+    Tabla HTML con las clases CSS de la interfaz (también la usa texto_a_tabla_html)
+
+    Args:
+        encabezado (list): Nombres de las columnas
+        filas (list): Filas de celdas
+
+    Returns:
+        str: HTML de la tabla, sin espacios extra
+    """
+    html = '<div class="tabla-container"><table class="tabla-moderna">'
+    html += '<thead><tr>' + ''.join(f'<th>{col}</th>' for col in encabezado) + '</tr></thead>'
+    html += '<tbody>'
+    for fila in filas:
+        html += '<tr>' + ''.join(f'<td{_clase_celda(celda)}>{celda}</td>' for celda in fila) + '</tr>'
+    html += '</tbody></table></div>'
+    return html
+
+
+class AlmacenTablasCabida:
+    """Tablas de cabida estructuradas, indexadas por tomo y por distrito, con su HTML en caché"""
+
+    def __init__(self, tomos, directorio=DIRECTORIO_RESPUESTAS):
+        """
+        Args:
+            tomos (Mapping): {numero_tomo: texto} de los tomos mejorados
+            directorio (str): Carpeta con las respuestas por tomo (RespuestasIA_TomoN)
+        """
+        self.tablas = {}
+        for tomo in sorted(tomos):
+            for encabezado, filas, _ in tablas_markdown(tomos[tomo]):
+                if es_tabla_cabida(encabezado) and filas:
+                    self.tablas.setdefault(tomo, []).append(
+                        TablaCabida(tomo, f"tomo_{tomo}", encabezado, filas, ""))
+
+        for tomo, rutas in sorted(_archivos_tabla(directorio).items()):
+            for ruta in rutas:
+                try:
+                    with open(ruta, 'r', encoding='utf-8') as archivo:
+                        tabla = _tabla_desde_texto(archivo.read(), tomo, ruta)
+                except OSError as e:
+                    print(f"⚠️ No se pudo leer {ruta}: {e}")
+                    continue
+                if tabla and tabla.filas:
+                    self.tablas.setdefault(tomo, []).append(tabla)
+
+        self.generica = _tabla_desde_texto(TABLA_CABIDA_GENERICA, None, "generica")
+
+        # clave de distrito -> [(tabla, fila)] de las tablas principales
+        self.por_distrito = {}
+        for tomo in sorted(self.tablas):
+            tabla = self.tablas[tomo][0]
+            columna = columna_distrito(tabla.encabezado)
+            for fila in tabla.filas:
+                claves = {clave_distrito(fila[columna])}
+                claves.update(clave_distrito(codigo) for codigo in _PATRON_PARENTESIS.findall(fila[columna]))
+                for clave in claves - {""}:
+                    self.por_distrito.setdefault(clave, []).append((tabla, fila))
+
+        self._html = {}
+
+    def tomos(self):
+        """Tomos con tabla de cabida propia"""
+        return sorted(self.tablas)
+
+    def tabla(self, tomo):
+        """
+        Tabla principal de un tomo
+
+        Args:
+            tomo (int): Número de tomo
+
+        Returns:
+            TablaCabida: Tabla del tomo, o la genérica si no tiene
+        """
+        tablas = self.tablas.get(tomo)
+        return tablas[0] if tablas else self.generica
+
+    def html(self, tomo, max_filas=None):
+        """
+        HTML de la tabla principal de un tomo (generado una vez por tomo y tamaño)
+
+        Args:
+            tomo (int): Número de tomo
+            max_filas (int): Solo las primeras filas, sin la nota (para el resumen)
+
+        Returns:
+            str: Tabla HTML seguida de su nota
+        """
+        clave = (tomo, max_filas)
+        html = self._html.get(clave)
+        if html is None:
+            tabla = self.tabla(tomo)
+            if max_filas is None:
+                html = tabla_html(tabla.encabezado, tabla.filas)
+                if tabla.nota:
+                    html += f"<br><i>{tabla.nota}</i>"
+            else:
+                html = tabla_html(tabla.encabezado, tabla.filas[:max_filas])
+            html = self._html.setdefault(clave, html)
+        return html
+
+    def distrito_mencionado(self, texto_normalizado):
+        """
+        Distrito de las tablas que menciona una consulta ("distrito R-1", "zona ZIT", "R-1")
+
+        Args:
+            texto_normalizado (str): Consulta en minúsculas y sin acentos
+
+        Returns:
+            str: Clave del distrito, o None si no menciona ninguno conocido
+        """
+        candidatos = _PATRON_MENCION_DISTRITO.findall(texto_normalizado)
+        candidatos += _PATRON_CODIGO.findall(texto_normalizado)
+        for candidato in candidatos:
+            if candidato in self.por_distrito:
+                return candidato
+        return None
+
+    def html_distrito(self, distrito, tomo=None):
+        """
+        Filas de un distrito en las tablas de cabida (de un tomo o de todos)
+
+        Args:
+            distrito (str): Nombre o código del distrito
+            tomo (int): Limitar a la tabla de este tomo
+
+        Returns:
+            str: Una tabla HTML por tomo con las filas del distrito, o None si no aparece
+        """
+        clave = ("distrito", clave_distrito(distrito), tomo)
+        html = self._html.get(clave)
+        if html is None:
+            por_tomo = {}
+            for tabla, fila in self.por_distrito.get(clave[1], []):
+                if tomo is None or tabla.tomo == tomo:
+                    por_tomo.setdefault(tabla.tomo, (tabla, []))[1].append(fila)
+            if not por_tomo:
+                return None
+            html = '<br><br>'.join(
+                f"<strong>TOMO {n}:</strong><br>{tabla_html(tabla.encabezado, filas)}"
+                for n, (tabla, filas) in sorted(por_tomo.items())
+            )
+            html = self._html.setdefault(clave, html)
+        return html
+
+    def estadisticas(self):
+        """Tablas, filas y distritos indexados, y la fuente de la tabla principal de cada tomo"""
+        return {
+            'tablas': sum(len(tablas) for tablas in self.tablas.values()),
+            'filas': sum(len(tabla.filas) for tablas in self.tablas.values() for tabla in tablas),
+            'distritos': len(self.por_distrito),
+            'html_en_cache': len(self._html),
+            'fuentes': {tomo: tablas[0].fuente for tomo, tablas in sorted(self.tablas.items())},
+        }
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_tablas_cabida():
+    """
+    Almacén de tablas de cabida del corpus compartido (se construye una vez)
+
+    Returns:
+        AlmacenTablasCabida: Tablas de cabida por tomo y distrito
+    """
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                from utils.corpus import obtener_corpus
+                _almacen = AlmacenTablasCabida(obtener_corpus().tomos)
+                print(f"✅ Tablas de cabida cargadas: {len(_almacen.tablas)} tomos, {len(_almacen.por_distrito)} distritos")
+    return _almacen
@@ -0,0 +1,66 @@
+"""
+Transmisión de tokens de la respuesta final (Server-Sent Events)
+
+El endpoint /chat/stream instala un emisor en un ContextVar mientras
+resuelve la consulta. Las llamadas que generan la respuesta final usan
+crear_mensaje(): si hay un emisor activo piden la respuesta en modo
+streaming a Anthropic y reenvían cada fragmento de texto; si no, hacen la
+llamada normal. Las extracciones intermedias (fuentes en el pool de hilos)
+heredan el resto del contexto de la consulta pero no el emisor, y nunca se
+transmiten.
+"""
+
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_emisor = ContextVar("emisor_respuesta", default=None)
+
+
+@contextmanager
+def con_emisor(emisor):
+    """
+    Activa un emisor en el contexto actual
+
+    Args:
+        emisor: Función emisor(evento, datos) que recibe 'inicio' y 'token'
+    """
+    token = _emisor.set(emisor)
+    try:
+        yield
+    finally:
+        _emisor.reset(token)
+
+
+def transmision_activa():
+    """Indica si la respuesta en curso se está transmitiendo"""
+    return _emisor.get() is not None
+
+
+def crear_mensaje(client, **parametros):
+    """
+    client.messages.create con transmisión de tokens si hay un emisor activo
+
+    Args:
+        client: Cliente Anthropic
+        **parametros: Parámetros de messages.create
+
+    Returns:
+        Message: Mensaje completo (mismo objeto que devuelve messages.create)
+    """
+    emisor = _emisor.get()
+    if emisor is None:
+        return client.messages.create(**parametros)
+
+    # Cada llamada transmitida empieza de cero: si una anterior falló o se
+    # descartó (p. ej. el respaldo a la respuesta genérica), el cliente limpia lo recibido
+    emisor("inicio", "")
+    with client.messages.stream(**parametros) as stream:
+        for texto in stream.text_stream:
+            emisor("token", texto)
+        return stream.get_final_message()
+
+
+def evento_sse(evento, datos):
+    """Serializa un evento en formato text/event-stream"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"